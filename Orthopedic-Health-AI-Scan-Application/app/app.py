@@ -1,13 +1,34 @@
 import os
+import json
+import mimetypes
+import time
 import uuid
-from flask import Flask, render_template, request, session, redirect, url_for, send_file, flash, jsonify
+from datetime import datetime
+from flask import (
+    Flask, Response, g, render_template, request, session, redirect, url_for, send_file, flash, jsonify,
+    stream_with_context
+)
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
-from ultralytics import YOLO
 
-from app.utils.pdf_generator import generate_pdf_report
-from app.utils.yolo_utils import detect_body_part, save_annotated_image_cv2
+from app.utils.model_registry import preload_models, loaded_models, model_status
+from app.utils.pipeline import (
+    store_upload, analyze_uploads, build_img_results, report_images_info, create_report, save_study,
+    result_labels, join_templates, get_models
+)
+from app.utils.upload_stream import iter_multipart, analyze_stream
+from app.utils import job_queue, report_store, study_index, metrics, report_export
+from app.utils.study_store import get_study_store
+from app.utils.body_part_router import router_stats
+from app.utils.result_cache import cache_stats
+from app.utils.inference_client import (
+    server_stats, model_status as server_model_status, InferenceServerUnavailable, InferenceServerError
+)
+from app.utils.storage_reaper import reaper_stats
 from app.config import (
-    LOGO_PATH, YOLO_MODELS, UPLOAD_FOLDER, PROCESSED_FOLDER, REPORTS_FOLDER,
+    LOGO_PATH, YOLO_MODELS, PRELOAD_MODELS, INFERENCE_SERVER_SOCKET, ASYNC_JOBS, JOB_POLL_INTERVAL, REPORT_CACHE_MAX_AGE,
+    READINESS_TIMEOUT, EXPORT_MAX_STUDIES, IMAGE_CACHE_MAX_AGE, X_ACCEL_REDIRECT_PREFIX, USE_X_SENDFILE,
+    UPLOAD_FOLDER, PROCESSED_FOLDER, REPORTS_FOLDER, DATA_FOLDER,
     ALLOWED_IMAGE_EXTENSIONS, body_part_findings,
     findings_template, risks_template, tests_template
 )
@@ -16,30 +37,96 @@ app = Flask(__name__, template_folder='templates')
 app.secret_key = os.urandom(24)
 
 # Create directories if they don't exist
-for folder in [UPLOAD_FOLDER, PROCESSED_FOLDER, REPORTS_FOLDER]:
+for folder in [UPLOAD_FOLDER, PROCESSED_FOLDER, REPORTS_FOLDER, DATA_FOLDER]:
     os.makedirs(folder, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
 app.config['REPORTS_FOLDER'] = REPORTS_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
+app.config['USE_X_SENDFILE'] = USE_X_SENDFILE
+
+# Under gunicorn --preload the weights are deserialized once in the master;
+# workers warm them up after fork (see gunicorn.conf.py). With an inference
+# server the models live there instead, and so do routing and result caching.
+if INFERENCE_SERVER_SOCKET:
+    def router_stats():
+        try:
+            return server_stats()['router']
+        except InferenceServerUnavailable:
+            return {}
+
+    def cache_stats():
+        try:
+            return server_stats()['cache']
+        except InferenceServerUnavailable:
+            return {}
+elif PRELOAD_MODELS:
+    preload_models()
+
+# Scrape-time metrics over counters kept by other modules
+metrics.Gauge('job_queue_depth', 'Analysis jobs waiting for a worker', func=job_queue.queue_depth)
+metrics.Gauge('models_loaded', 'Detection models loaded in this process', ['body_part', 'backend'],
+              func=lambda: {item: 1 for item in loaded_models().items()})
+metrics.Counter('router_images_total', 'Images by how the body-part router handled them', ['route'],
+                func=lambda: {(route,): router_stats()[key] for route, key in
+                              (('routed', 'routed'), ('hinted', 'hinted'), ('fallback', 'fallbacks'))})
+metrics.Counter('router_detector_runs_total', 'Detector runs issued by the body-part router',
+                func=lambda: router_stats()['detector_runs'])
+metrics.Counter('result_cache_lookups_total', 'Inference result cache lookups', ['result'],
+                func=lambda: {(result,): cache_stats()[result] for result in ('memory_hits', 'disk_hits', 'misses')})
+metrics.Counter('storage_reclaimed_bytes_total', 'Bytes deleted by the storage reaper', ['folder'],
+                func=lambda: {(folder,): value for folder, value in reaper_stats().get('bytes_reclaimed', {}).items()})
+metrics.Gauge('storage_folder_bytes', 'Folder sizes at the last storage reaper run', ['folder'],
+              func=lambda: {(folder,): value for folder, value in
+                            reaper_stats().get('last_run', {}).get('folder_bytes', {}).items()})
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    if 'request_start' in g:
+        # The URL rule, not the path, keeps the label set small
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, method=request.method,
+                                        endpoint=endpoint, status=response.status_code)
+    return response
 
 def allowed_file(filename, file_type='image'):
     if file_type == 'image':
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_IMAGE_EXTENSIONS
 
+def current_study():
+    """The study referenced by the session, loaded from the study store (empty if none)."""
+    study_id = session.get('study_id')
+    study = get_study_store().get(study_id) if study_id else None
+    return study or {'uploaded_images': [], 'img_results': []}
+
+def current_results():
+    return current_study()['img_results']
+
+def release_study():
+    """Drop the session's study from the store; the reaper then collects its files."""
+    study_id = session.pop('study_id', None)
+    if study_id:
+        get_study_store().delete(study_id)
+
 @app.route('/')
 def index():
     # Initialize session variables if they don't exist
     if 'patient_info' not in session:
         session['patient_info'] = {}
-    if 'img_results' not in session:
-        session['img_results'] = []
     
     return render_template('index.html', 
+                         body_parts=list(YOLO_MODELS),
                          patient_info=session.get('patient_info', {}),
-                         img_results=session.get('img_results', []),
-                         video_results=session.get('video_results', []))
+                         img_results=current_results(),
+                         video_results=session.get('video_results', []),
+                         job_id=session.get('job_id'),
+                         # Queued analysis keeps the form; otherwise it streams its images
+                         stream_uploads=not ASYNC_JOBS)
 
 @app.route('/save_patient_info', methods=['POST'])
 def save_patient_info():
@@ -62,93 +149,42 @@ def upload_images():
         flash('No images selected', 'error')
         return redirect(url_for('index'))
     
-    files = request.files.getlist('images')
-    
-    # Load all models once
-    models = {}
-    for body_part, model_path in YOLO_MODELS.items():
-        if not os.path.exists(model_path):
-            flash(f'YOLO model not found for {body_part}', 'error')
-            continue
-        models[body_part] = YOLO(model_path)
-    
-    uploaded_files = []
-    for file in files:
-        if file and allowed_file(file.filename, 'image'):
-            filename = secure_filename(file.filename)
-            unique_filename = f"{uuid.uuid4().hex}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(filepath)
-            
-            # Store only the filename relative to UPLOAD_FOLDER, using forward slashes
-            relative_filepath = f'uploads/{unique_filename}'
-
-            # Auto-detect body part
-            body_part, label, img, conf = detect_body_part(filepath, models)
-            if body_part:
-                # Generate unique filename for annotated image
-                unique_filename_annotated = f"annotated_{uuid.uuid4().hex}_{filename}"
-                annotated_abs_path = os.path.join(app.config['PROCESSED_FOLDER'], unique_filename_annotated)
-                
-                # Save annotated image to the processed folder
-                saved_annotated_path = save_annotated_image_cv2(img, annotated_abs_path)
-
-                uploaded_files.append({
-                    'path': relative_filepath,
-                    'body_part': body_part,
-                    'initial_detection': {
-                        'label': label,
-                        'confidence': conf,
-                        'annotated_img_path': f'processed/{unique_filename_annotated}' if saved_annotated_path else None
-                    }
-                })
+    files = [file for file in request.files.getlist('images') if file and allowed_file(file.filename, 'image')]
+    # Optional body part chosen by the user; skips routing when it is known
+    hint = request.form.get('body_part_hint') or None
+
+    if ASYNC_JOBS:
+        return enqueue_analysis(files, hint)
+
+    def stored_uploads():
+        # Decode each upload once, straight from the request stream, and hand it
+        # to the pipeline; only one batch of decoded images is held at a time
+        for file in files:
+            item = store_upload(file.read(), file.filename)
+            if item is None:
+                flash(f'Could not decode image {secure_filename(file.filename)}', 'error')
+                continue
+            yield item
+
+    uploaded_files, messages = analyze_uploads(stored_uploads(), hint)
+    for category, message in messages:
+        flash(message, category)
     
     if uploaded_files:
-        session['uploaded_images'] = uploaded_files
         flash(f'Successfully uploaded and analyzed {len(uploaded_files)} images', 'success')
 
         try:
-            img_results = []
-            for i, image_info in enumerate(session['uploaded_images']):
-                image_path = image_info['path']
-                body_part = image_info['body_part']
-                initial_detection = image_info['initial_detection']
-
-                saved_path = initial_detection['annotated_img_path']
-
-                if saved_path:
-                    result = {
-                        'id': i,
-                        'original_path': image_path,
-                        'annotated_path': saved_path,
-                        'label': initial_detection['label'],
-                        'body_part': body_part,
-                        'confidence': initial_detection['confidence'],
-                        'type': 'image',
-                        'findings': findings_template.get(initial_detection['label'], 'No specific findings available'),
-                        'tests': tests_template.get(initial_detection['label'], 'No specific tests available')
-                    }
-                    img_results.append(result)
-
-            session['img_results'] = img_results
+            img_results = build_img_results(uploaded_files)
+            # Results stay server-side; the session cookie only references them
+            release_study()
+            session['study_id'] = save_study(uploaded_files, img_results, session.get('patient_info'))
             flash(f'Successfully processed {len(img_results)} images!', 'success')
 
             # --- Automatic Report Generation ---
             if session.get('patient_info') and img_results:
-                selected_images_info = []
-                for result in img_results:
-                    selected_images_info.append({
-                        'original_path': result['original_path'],
-                        'annotated_path': result['annotated_path'],
-                        'label': result['label']
-                    })
-
-                report_filename = f"report_{uuid.uuid4().hex}.pdf"
-                report_path = os.path.join(app.config['REPORTS_FOLDER'], report_filename)
+                report_filename = create_report(session['patient_info'], report_images_info(img_results))
 
-                generated_path = generate_pdf_report(session['patient_info'], selected_images_info, report_path)
-
-                if generated_path:
+                if report_filename:
                     session['last_report_filename'] = report_filename
                     flash(f'Report generated successfully! Download here: {url_for("download_report", filename=report_filename)}', 'success')
                 else:
@@ -163,22 +199,310 @@ def upload_images():
 
     return redirect(url_for('index'))
 
+@app.route('/api/uploads/stream', methods=['POST'])
+def upload_images_stream():
+    """
+    Streaming upload: each image is analyzed as soon as its part of the
+    multipart body has arrived, while the rest is still uploading. Responds
+    with NDJSON, one line per image in upload order as it is analyzed, then a
+    summary line with the study and its report.
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return jsonify({'error': 'Expected a multipart/form-data body'}), 400
+    try:
+        models, missing = get_models()
+    except InferenceServerUnavailable as e:
+        print(str(e))
+        return jsonify({'error': 'The analysis service is unavailable, please try again shortly'}), 503
+
+    # Headers (and the session cookie) go out before the body has been read,
+    # so the study the results will fill is created up front
+    patient_info = session.get('patient_info') or None
+    release_study()
+    session.pop('last_report_filename', None)
+    study_id = get_study_store().create({'uploaded_images': [], 'img_results': [], 'patient_info': patient_info})
+    session['study_id'] = study_id
+
+    parts = iter_multipart(request.stream, boundary, max_form_memory_size=request.max_form_memory_size,
+                           max_parts=request.max_form_parts)
+    hint = request.args.get('body_part_hint') or None
+
+    def stream():
+        uploaded_files = []
+        for record in analyze_stream(parts, models, allowed_file, hint):
+            line = {key: record[key] for key in ('index', 'filename', 'status', 'error') if key in record}
+            if record.get('uploaded_file'):
+                uploaded_files.append(record['uploaded_file'])
+                result = build_img_results([record['uploaded_file']])
+                if result:
+                    line['result'] = dict(result[0], id=len(uploaded_files) - 1)
+            yield json.dumps(line) + '\n'
+
+        img_results = build_img_results(uploaded_files)
+        save_study(uploaded_files, img_results, patient_info, study_id=study_id)
+        report_filename = None
+        if patient_info and img_results:
+            report_filename = create_report(patient_info, report_images_info(img_results))
+        yield json.dumps({
+            'status': 'done',
+            'study_id': study_id,
+            'images': len(img_results),
+            'report_url': url_for('download_report', filename=report_filename) if report_filename else None,
+            'messages': [f'YOLO model not found for {body_part}' for body_part in missing]
+        }) + '\n'
+
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def wants_json():
+    return request.accept_mimetypes.best == 'application/json'
+
+def enqueue_analysis(files, hint):
+    """Store the uploads and queue them for the job workers; returns immediately."""
+    uploads = [store_upload(file.read(), file.filename, decode=False) for file in files]
+    if not uploads:
+        if wants_json():
+            return jsonify({'success': False, 'error': 'No valid images were uploaded'}), 400
+        flash('No valid images were uploaded', 'error')
+        return redirect(url_for('index'))
 
+    payload = {
+        'uploads': uploads,
+        'hint': hint,
+        'patient_info': session.get('patient_info') or None
+    }
+    job_id = job_queue.enqueue('analyze_study', payload, total=len(uploads))
+    session['job_id'] = job_id
+
+    if wants_json():
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': url_for('job_status', job_id=job_id),
+            'result_url': url_for('job_result', job_id=job_id)
+        }), 202
+    flash(f'{len(uploads)} images queued for analysis', 'success')
+    return redirect(url_for('index'))
+
+def job_status_dict(job):
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'total': job['total'],
+        'error': job['error']
+    }
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == 'failed' and session.get('job_id') == job_id:
+        session.pop('job_id')
+    return jsonify(job_status_dict(job))
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-sent events stream of the job's progress until it finishes"""
+    if job_queue.get_job(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def stream():
+        last = None
+        while True:
+            job = job_queue.get_job(job_id)
+            status = job_status_dict(job)
+            if status != last:
+                yield f"data: {json.dumps(status)}\n\n"
+                last = status
+            if job['status'] in ('done', 'failed'):
+                return
+            time.sleep(JOB_POLL_INTERVAL)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Return a finished job's results and load them into the session that queued it"""
+    job = job_queue.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] != 'done':
+        return jsonify(job_status_dict(job)), 409
+
+    result = job['result']
+    if session.get('job_id') == job_id:
+        session.pop('job_id')
+        if result.get('study_id'):
+            release_study()
+            session['study_id'] = result['study_id']
+        if result['report_filename']:
+            session['last_report_filename'] = result['report_filename']
+        for category, message in result['messages']:
+            flash(message, category)
+        flash(f"Successfully processed {len(result['img_results'])} images!", 'success')
+
+    return jsonify(dict(job_status_dict(job), result=result))
+
+@app.route('/router_stats')
+def get_router_stats():
+    """How often the body-part router had to fall back to the full model sweep"""
+    return jsonify(router_stats())
+
+@app.route('/cache_stats')
+def get_cache_stats():
+    """Hit/miss counters of the inference result cache"""
+    return jsonify(cache_stats())
+
+def parse_date(value):
+    """Epoch seconds from an ISO 8601 date/datetime or a number."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus scrape endpoint, summed over every process (see app.utils.metrics)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the worker is serving requests, whether or not its models are warm"""
+    return jsonify({'status': 'serving'})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: 200 once every available model is warm, 503 while they are still loading"""
+    try:
+        if INFERENCE_SERVER_SOCKET:
+            status = server_model_status(timeout=READINESS_TIMEOUT)
+        else:
+            status = model_status()
+    except (OSError, InferenceServerError) as e:
+        return jsonify({'status': 'unavailable', 'error': str(e)}), 503
+    ready = 'warm' in status.values() and all(state in ('warm', 'missing') for state in status.values())
+    return jsonify({'status': 'ready' if ready else 'warming', 'models': status}), 200 if ready else 503
+
+@app.route('/storage_stats')
+def get_storage_stats():
+    """Files deleted and bytes reclaimed by the storage reaper"""
+    return jsonify(reaper_stats())
+
+@app.route('/api/detections')
+def api_detections():
+    """
+    Paginated query over the study index, newest first. Filters: patient_id,
+    body_part, label, since/until (ISO date or epoch seconds) and
+    min_confidence/max_confidence. Pass next_cursor back as `cursor`.
+    """
+    args = request.args
+    try:
+        detections, next_cursor = study_index.query(
+            patient_id=args.get('patient_id'),
+            body_part=args.get('body_part'),
+            label=args.get('label'),
+            since=parse_date(args['since']) if args.get('since') else None,
+            until=parse_date(args['until']) if args.get('until') else None,
+            min_confidence=float(args['min_confidence']) if args.get('min_confidence') else None,
+            max_confidence=float(args['max_confidence']) if args.get('max_confidence') else None,
+            limit=int(args['limit']) if args.get('limit') else None,
+            cursor=args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {str(e)}'}), 400
+    return jsonify({'detections': detections, 'next_cursor': next_cursor})
+
+@app.route('/api/report_exports', methods=['POST'])
+def api_create_report_export():
+    """
+    Render the reports of many studies in the background. JSON body: either
+    study_ids, or since/until (ISO date or epoch seconds) and optionally
+    patient_id to take every indexed study in that range; format is 'zip'
+    (default) or 'merged'. Poll the returned status_url for progress.
+    """
+    data = request.get_json(silent=True) or {}
+    fmt = data.get('format', 'zip')
+    if fmt not in report_export.FORMATS:
+        return jsonify({'error': f'Unknown format: {fmt}'}), 400
+    if fmt == 'merged' and not report_export.merge_available():
+        return jsonify({'error': 'Merged exports need the pypdf package'}), 400
+    if 'study_ids' not in data and not any(data.get(key) for key in ('since', 'until', 'patient_id')):
+        return jsonify({'error': 'Give study_ids, or since/until/patient_id'}), 400
+    try:
+        if 'study_ids' in data:
+            if not isinstance(data['study_ids'], list):
+                raise TypeError('study_ids must be a list')
+            studies = [(str(study_id), None) for study_id in data['study_ids']]
+        else:
+            studies = study_index.study_ids(
+                patient_id=data.get('patient_id'),
+                since=parse_date(str(data['since'])) if data.get('since') else None,
+                until=parse_date(str(data['until'])) if data.get('until') else None,
+                limit=EXPORT_MAX_STUDIES + 1
+            )
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Invalid export request: {str(e)}'}), 400
+    if not studies:
+        return jsonify({'error': 'No studies to export'}), 400
+    if len(studies) > EXPORT_MAX_STUDIES:
+        return jsonify({'error': f'At most {EXPORT_MAX_STUDIES} studies per export'}), 400
+
+    export_id = report_export.create_export(studies, fmt)
+    report_export.start_export(export_id)
+    return jsonify({
+        'export_id': export_id,
+        'total': len(studies),
+        'status_url': url_for('api_report_export_status', export_id=export_id)
+    }), 202
+
+@app.route('/api/report_exports/<export_id>')
+def api_report_export_status(export_id):
+    """Progress of a bulk export; has a download_url once it is done"""
+    status = report_export.export_status(export_id)
+    if status is None:
+        return jsonify({'error': 'Export not found'}), 404
+    status.pop('merged_filename')
+    if status['status'] == 'done':
+        status['download_url'] = url_for('api_download_report_export', export_id=export_id)
+    return jsonify(status)
+
+@app.route('/api/report_exports/<export_id>/download')
+def api_download_report_export(export_id):
+    status = report_export.export_status(export_id)
+    if status is None:
+        return jsonify({'error': 'Export not found'}), 404
+    if status['status'] != 'done':
+        return jsonify({'error': f"Export is {status['status']}"}), 409
+
+    if status['format'] == 'merged':
+        path = safe_join(REPORTS_FOLDER, status['merged_filename'])
+        if not path or not os.path.isfile(path):
+            return jsonify({'error': 'Export has expired'}), 410
+        return send_file(path, mimetype='application/pdf', as_attachment=True,
+                         download_name=f"reports_{export_id}.pdf")
+    # Streamed as it is built; the archive is never held in memory
+    return Response(report_export.iter_zip(export_id), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="reports_{export_id}.zip"'})
 
 @app.route('/get_selection_options')
 def get_selection_options():
     options = []
     
     # Add image options
-    for i, result in enumerate(session.get('img_results', [])):
+    for i, result in enumerate(current_results()):
         options.append({
             'id': f"img_{i}",
-            'label': f"Image {i+1} ({result['label']})",
+            'label': f"Image {i+1} ({', '.join(result_labels(result))})",
             'type': 'image',
             'index': i,
             'original_path': result['original_path'],
-            'annotated_path': result['annotated_path']
+            'annotated_path': result['annotated_path'],
+            'original_thumb_path': result.get('original_thumb_path'),
+            'annotated_thumb_path': result.get('annotated_thumb_path')
         })
     
     return jsonify(options)
@@ -187,7 +511,7 @@ def get_selection_options():
 def get_clinical_details(selection_type, index):
     try:
         if selection_type == 'image':
-            results = session.get('img_results', [])
+            results = current_results()
         else:
             # If selection_type is not image, it's an invalid selection now
             return jsonify({'error': 'Invalid selection type'}), 400
@@ -195,13 +519,12 @@ def get_clinical_details(selection_type, index):
         if index >= len(results):
             return jsonify({'error': 'Invalid selection'}), 400
             
-        result = results[index]
-        label = result['label']
+        labels = result_labels(results[index])
         
         details = {
-            'findings': findings_template.get(label, 'No specific findings available'),
-            'risks': risks_template.get(label, 'No specific risks available'),
-            'tests': tests_template.get(label, 'No specific tests available')
+            'findings': join_templates(findings_template, labels, 'No specific findings available'),
+            'risks': join_templates(risks_template, labels, 'No specific risks available'),
+            'tests': join_templates(tests_template, labels, 'No specific tests available')
         }
         
         return jsonify(details)
@@ -226,15 +549,14 @@ def generate_report():
         
         
         selected_images_info = []
+        results = current_results()
 
         for item in selected_items:
             try:
                 item_type, index = item.split('_', 1)
                 index = int(index)
                 
-                if item_type == 'img':
-                    results = session.get('img_results', [])
-                else:
+                if item_type != 'img':
                     # If item_type is not img, it's an invalid selection now
                     return jsonify({'success': False, 'error': f'Invalid item type: {item}'}), 400
                 
@@ -243,21 +565,14 @@ def generate_report():
                     
                 result = results[index]
                 
-                selected_images_info.append({
-                    'original_path': result['original_path'],
-                    'annotated_path': result['annotated_path'],
-                    'label': result['label']
-                })
+                selected_images_info.extend(report_images_info([result]))
             except (ValueError, IndexError) as e:
                 return jsonify({'success': False, 'error': f'Invalid item format: {item}'}), 400
         
         # Generate PDF report
-        report_filename = f"report_{uuid.uuid4().hex}.pdf"
-        report_path = os.path.join(app.config['REPORTS_FOLDER'], report_filename)
-        
-        generated_path = generate_pdf_report(session['patient_info'], selected_images_info, report_path)
+        report_filename = create_report(session['patient_info'], selected_images_info)
         
-        if generated_path:
+        if report_filename:
             return jsonify({
                 'success': True, 
                 'report_url': url_for('download_report', filename=report_filename)
@@ -271,45 +586,74 @@ def generate_report():
 @app.route('/download_report/<filename>')
 def download_report(filename):
     try:
-        file_path = os.path.join(app.config['REPORTS_FOLDER'], filename)
-        if not os.path.exists(file_path):
+        if filename != secure_filename(filename):
             flash('Report not found', 'error')
             return redirect(url_for('index'))
-            
-        return send_file(
-            file_path,
-            mimetype='application/pdf'
-        )
+
+        # Served from the in-memory report store; disk is only a fallback, for
+        # reports rendered by another process, which may still be writing it
+        report = report_store.get(filename, wait=True)
+        if report is None:
+            flash('Report not found', 'error')
+            return redirect(url_for('index'))
+
+        response = Response(report.data, mimetype='application/pdf')
+        response.set_etag(report.etag)
+        response.last_modified = report.created_at
+        # Reports hold patient data: cache only in the user's browser
+        response.cache_control.private = True
+        response.cache_control.max_age = REPORT_CACHE_MAX_AGE
+        return response.make_conditional(request)
     except Exception as e:
         flash(f'Error downloading report: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+def resolve_image_path(filename):
+    """Map an 'uploads/...' or 'processed/...' path to (absolute path, path relative to the app folder)."""
+    if filename.startswith('uploads/'):
+        candidates = [('uploads', app.config['UPLOAD_FOLDER'], filename[len('uploads/'):])]
+    elif filename.startswith('processed/'):
+        candidates = [('processed', app.config['PROCESSED_FOLDER'], filename[len('processed/'):])]
+    else:
+        # Fallback for any other unexpected path format
+        candidates = [('uploads', app.config['UPLOAD_FOLDER'], filename),
+                      ('processed', app.config['PROCESSED_FOLDER'], filename)]
+
+    for prefix, folder, name in candidates:
+        file_path = safe_join(folder, name)
+        if file_path and os.path.isfile(file_path):
+            return file_path, f"{prefix}/{name}"
+    return None, None
+
 @app.route('/serve_image/<path:filename>')
 def serve_image(filename):
     """Serve processed images"""
     try:
-        # Handle different path formats
-        if filename.startswith('uploads/'):
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename.replace('uploads/', ''))
-        elif filename.startswith('processed/'):
-            file_path = os.path.join(app.config['PROCESSED_FOLDER'], filename.replace('processed/', ''))
-        else:
-            # Fallback for any other unexpected path format
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if not os.path.exists(file_path):
-                file_path = os.path.join(app.config['PROCESSED_FOLDER'], filename)
-        
-        if os.path.exists(file_path):
-            print(f"Serving file: {file_path}")
-            return send_file(file_path)
-        else:
+        file_path, relative_path = resolve_image_path(filename)
+        if file_path is None:
             return "Image not found", 404
+
+        # Filenames are UUID-unique and never rewritten, so browsers may keep them forever
+        if X_ACCEL_REDIRECT_PREFIX:
+            # Let the front server (nginx) send the bytes
+            response = Response(mimetype=mimetypes.guess_type(file_path)[0] or 'application/octet-stream')
+            response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX + relative_path
+        else:
+            # Strong ETag + Last-Modified; If-None-Match and Range are handled by send_file
+            response = send_file(file_path, conditional=True, etag=True, max_age=IMAGE_CACHE_MAX_AGE)
+        # X-ray images are patient data: browser cache only, never shared caches
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.max_age = IMAGE_CACHE_MAX_AGE
+        response.cache_control.immutable = True
+        return response
     except Exception as e:
         return f"Error serving image: {str(e)}", 500
 
 @app.route('/clear_session', methods=['POST'])
 def clear_session():
     """Clear all session data"""
+    release_study()
     session.clear()
     flash('Session cleared successfully', 'success')
     return redirect(url_for('index'))
@@ -319,12 +663,15 @@ def delete_file(file_type, index):
     """Delete uploaded files and results"""
     try:
         if file_type == 'image':
-            results = session.get('img_results', [])
+            study_id = session.get('study_id')
+            study = current_study()
+            results = study['img_results']
             if index < len(results):
                 result = results[index]
                 # Delete files if they exist
-                for path_key in ['original_path', 'annotated_path']:
-                    if path_key in result:
+                for path_key in ['original_path', 'annotated_path', 'original_thumb_path',
+                                 'annotated_report_path', 'annotated_thumb_path']:
+                    if result.get(path_key):
                         relative_path = result[path_key]
                         if relative_path.startswith('uploads/'):
                             abs_path = os.path.join(app.config['UPLOAD_FOLDER'], relative_path.replace('uploads/', ''))
@@ -335,9 +682,10 @@ def delete_file(file_type, index):
 
                         if abs_path and os.path.exists(abs_path):
                             os.remove(abs_path)
-                # Remove from session
+                # Remove from the study and the study index
                 results.pop(index)
-                session['img_results'] = results
+                study_index.forget(study_id, result['original_path'])
+                get_study_store().update(study_id, study)
         else:
             return jsonify({'success': False, 'error': 'Invalid file type'}), 400
         
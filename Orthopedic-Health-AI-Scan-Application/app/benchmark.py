@@ -0,0 +1,252 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+# Benchmarks must not be skewed by cached results or by the router learning
+# from synthetic images, so both are off unless explicitly requested
+os.environ.setdefault('RESULT_CACHE_ENABLED', '0')
+os.environ.setdefault('ROUTER_ENABLED', '0')
+
+import cv2
+import numpy as np
+
+from app.config import YOLO_MODELS, PROCESSED_FOLDER
+from app.utils.inference_backend import Detections
+from app.utils.model_registry import SharedModel, get_models
+from app.utils.pdf_generator import generate_pdf_report
+from app.utils.yolo_utils import (
+    decode_image, detect_body_parts, custom_yolo_annotate, save_annotated_image_cv2
+)
+
+# Offline benchmark of the detection and report pipeline:
+#
+#   python -m app.benchmark --sizes 1024 2048 --batch-sizes 1 8 --output run.json
+#   python -m app.benchmark --baseline run.json --threshold 0.15
+#
+# Real weights from YOLO_MODELS are used when present; otherwise tiny
+# randomly-initialized stand-ins are built so the harness runs anywhere.
+
+PATIENT_INFO = {
+    'Name': 'Benchmark', 'Age': '50', 'Gender': 'Other', 'Patient_ID': 'PTBENCH',
+    'Radiologist_Name': '', 'Radiologist_ID': ''
+}
+
+
+class RandomStandInModel:
+    """Numpy stand-in with a model-like cost profile: resize to 640 and emit seeded boxes."""
+
+    thread_safe = True
+
+    def __init__(self, seed):
+        self.rng = np.random.default_rng(seed)
+        self.names = {0: 'fracture', 1: 'metal'}
+
+    def __call__(self, source, **kwargs):
+        imgs = source if isinstance(source, list) else [source]
+        outputs = []
+        for img in imgs:
+            small = cv2.resize(img, (640, 640), interpolation=cv2.INTER_LINEAR).astype(np.float32)
+            cv2.GaussianBlur(small, (5, 5), 0)
+            h, w = img.shape[:2]
+            x1, y1 = self.rng.uniform(0, 0.5, 2) * (w, h)
+            x2, y2 = x1 + w * 0.3, y1 + h * 0.3
+            outputs.append(Detections([[x1, y1, x2, y2]], [self.rng.uniform(0.3, 0.9)],
+                                      [self.rng.integers(0, 2)]))
+        return outputs
+
+
+def build_stand_in_models(kind):
+    """Randomly-initialized YOLOv8n models when Ultralytics is installed, numpy stand-ins otherwise."""
+    models = {}
+    for i, body_part in enumerate(YOLO_MODELS):
+        if kind in ('auto', 'yolo'):
+            try:
+                from app.utils.inference_backend import TorchModel
+                # A .yaml builds the architecture with random weights, no download needed
+                model = TorchModel('yolov8n.yaml')
+            except ImportError:
+                if kind == 'yolo':
+                    raise
+                model = RandomStandInModel(i)
+        else:
+            model = RandomStandInModel(i)
+        models[body_part] = SharedModel(body_part, f'stand-in:{body_part}', model, 0)
+    return models
+
+
+def synthetic_xray(size, seed=0):
+    """A radiograph-like grayscale image: smooth bone-ish blobs plus noise, stored as BGR."""
+    rng = np.random.default_rng(seed)
+    h, w = size, int(size * 0.8)
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    img = 40 + 120 * np.exp(-(((xx - w / 2) / (w / 5)) ** 2))
+    img += 60 * np.exp(-(((yy - h / 2) / (h / 6)) ** 2))
+    img += rng.normal(0, 8, (h, w))
+    img = np.clip(img, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+
+def percentiles(samples):
+    arr = np.array(samples) * 1000.0
+    return {
+        'n': len(samples),
+        'mean_ms': float(arr.mean()),
+        'p50_ms': float(np.percentile(arr, 50)),
+        'p90_ms': float(np.percentile(arr, 90)),
+        'p99_ms': float(np.percentile(arr, 99))
+    }
+
+
+def timed(samples, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+def measure_cold_start():
+    """Time a fresh interpreter importing the app and warming every model."""
+    code = (
+        "import time; t = time.perf_counter();"
+        "import app.app;"
+        "from app.utils.model_registry import warm_models; warm_models();"
+        "print(time.perf_counter() - t)"
+    )
+    try:
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                             timeout=600, check=True)
+        return float(out.stdout.strip().splitlines()[-1])
+    except (subprocess.SubprocessError, ValueError, IndexError) as e:
+        print(f"Cold start measurement failed: {str(e)}")
+        return None
+
+
+def run(args):
+    models, missing = get_models()
+    stand_in = bool(missing) or args.stand_in_only
+    if stand_in:
+        print(f"Model weights missing for {missing or 'all'}; using {args.stand_in} stand-in models")
+        models = build_stand_in_models(args.stand_in)
+
+    for model in models.values():
+        model.warmup()
+
+    stages = {}
+
+    def stage(name):
+        return stages.setdefault(name, [])
+
+    throughput = {}
+    tmp_dir = tempfile.mkdtemp(prefix='bench_')
+    bench_files = []
+
+    for size in args.sizes:
+        images = [synthetic_xray(size, seed) for seed in range(max(args.batch_sizes))]
+        encoded = [cv2.imencode('.jpg', img)[1].tobytes() for img in images]
+
+        for _ in range(args.repeat):
+            decoded = [timed(stage(f'decode@{size}'), decode_image, data) for data in encoded]
+
+            # Single image through every model, then one model alone
+            body_part, label, annotated, conf, detections = timed(
+                stage(f'detect_body_part@{size}'), lambda: detect_body_parts([decoded[0]], models)[0])
+            any_model = next(iter(models.items()))
+            timed(stage(f'custom_yolo_annotate@{size}'), custom_yolo_annotate,
+                  decoded[0], any_model[1], any_model[0])
+
+            if annotated is None:
+                annotated = decoded[0]
+            name = f"bench_{uuid.uuid4().hex}.jpg"
+            bench_files.append(os.path.join(PROCESSED_FOLDER, name))
+            timed(stage(f'save_annotated_image_cv2@{size}'), save_annotated_image_cv2,
+                  annotated, bench_files[-1])
+
+            report_images = [{'original_path': '', 'annotated_path': f'processed/{name}',
+                              'label': label or 'fracture'}]
+            timed(stage(f'generate_pdf_report@{size}'), generate_pdf_report, PATIENT_INFO,
+                  report_images, os.path.join(tmp_dir, f'{uuid.uuid4().hex}.pdf'))
+
+        for batch_size in args.batch_sizes:
+            batch = [decode_image(data) for data in encoded[:batch_size]]
+            samples = stage(f'detect_body_parts@{size}x{batch_size}')
+            for _ in range(args.repeat):
+                timed(samples, detect_body_parts, batch, models)
+            throughput[f'{size}x{batch_size}'] = batch_size / float(np.median(samples))
+
+    for path in bench_files:
+        if os.path.exists(path):
+            os.remove(path)
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'stand_in_models': stand_in,
+            'backends': sorted({getattr(m, 'backend', 'stand-in') for m in models.values()}),
+            'sizes': args.sizes,
+            'batch_sizes': args.batch_sizes,
+            'repeat': args.repeat
+        },
+        'stages': {name: percentiles(samples) for name, samples in stages.items()},
+        'images_per_sec': throughput,
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        'cold_start_s': None if args.skip_cold_start else measure_cold_start()
+    }
+
+
+def compare(current, baseline, threshold):
+    """Return the stages whose p50 regressed by more than threshold (a fraction)."""
+    regressions = []
+    for name, stats in current['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if not old or old['p50_ms'] <= 0:
+            continue
+        change = stats['p50_ms'] / old['p50_ms'] - 1
+        if change > threshold:
+            regressions.append(f"{name}: p50 {old['p50_ms']:.1f}ms -> {stats['p50_ms']:.1f}ms (+{change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the detection and report pipeline")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 2048], help="image heights in pixels")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--stand-in', choices=['auto', 'yolo', 'random'], default='auto',
+                        help="stand-in model kind when real weights are missing")
+    parser.add_argument('--stand-in-only', action='store_true', help="ignore real weights")
+    parser.add_argument('--skip-cold-start', action='store_true')
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="JSON from a previous run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="fail if a stage's p50 is this fraction slower than the baseline")
+    args = parser.parse_args()
+
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from werkzeug.utils import secure_filename
+
+from app.config import ALLOWED_IMAGE_EXTENSIONS, INFERENCE_MAX_BATCH
+
+# Offline bulk analysis of archived radiographs, for backfills:
+#
+#   python -m app.bulk_process /archive/xrays --output results.jsonl \
+#       --annotated out/annotated --reports out/reports --workers 4
+#
+# The input is a directory tree or a ZIP archive, walked lazily. Images go to a
+# pool of worker processes in batches of --batch-size; at most --max-in-flight
+# batches are queued at a time, so memory stays flat however large the archive.
+# Each finished batch is appended to the output (JSONL, or CSV when the file
+# ends in .csv) straight away. Re-running with the same output skips every
+# image already recorded, so an interrupted run resumes where it stopped;
+# images that failed with an error are retried.
+#
+# With --reports, one PDF per patient is rendered at the end, the patient ID
+# being the first folder of each image's path (e.g. PT0042/knee_ap.jpg).
+
+CSV_FIELDS = ['source', 'status', 'body_part', 'label', 'confidence', 'labels', 'detections',
+              'model_version', 'annotated_path', 'report_image_path', 'error']
+
+# Set per worker process by _init_worker
+_source = None
+_options = None
+_models = None
+
+
+def is_image(name):
+    return '.' in name and name.rsplit('.', 1)[1].lower() in ALLOWED_IMAGE_EXTENSIONS
+
+
+def iter_sources(root):
+    """Yield the relative path of every image under a directory or in a ZIP, in a stable order."""
+    if zipfile.is_zipfile(root):
+        with zipfile.ZipFile(root) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_image(info.filename):
+                    yield info.filename
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if is_image(filename):
+                yield os.path.relpath(os.path.join(dirpath, filename), root).replace(os.sep, '/')
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def output_name(source, directory, prefix=''):
+    """Mirror an image's relative path under an output directory, with safe components only."""
+    parts = [secure_filename(part) or '_' for part in source.split('/')]
+    stem = os.path.splitext(parts[-1])[0]
+    path = os.path.join(directory, *parts[:-1], f"{prefix}{stem}.jpg")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def patient_of(source):
+    parts = source.split('/')
+    return parts[0] if len(parts) > 1 else 'unknown'
+
+
+# --- Worker side ---
+
+def _init_worker(root, options):
+    global _source, _options, _models
+    _source = zipfile.ZipFile(root) if zipfile.is_zipfile(root) else root
+    _options = options
+    from app.utils.pipeline import get_models
+    _models, missing = get_models()
+    for body_part in missing:
+        print(f"YOLO model not found for {body_part}")
+
+
+def _load(source):
+    """Decode one image as (BGR array or None, pixel spacing or None)."""
+    from app.utils.yolo_utils import decode_scan, read_scan
+    if isinstance(_source, zipfile.ZipFile):
+        return decode_scan(_source.read(source))
+    # DICOM files on disk are memory-mapped, only the analyzed frame is read
+    return read_scan(os.path.join(_source, source))
+
+
+def process_batch(sources):
+    """Analyze one batch of images in a worker. Returns one result record per image."""
+    from app.utils.pipeline import detect_body_parts, result_labels
+    from app.utils.yolo_utils import save_annotated_image_cv2
+    from app.utils.derivatives import downscale, encode_params
+    from app.config import REPORT_IMAGE_MAX_SIDE, REPORT_IMAGE_JPEG_QUALITY
+    import cv2
+
+    records = {}
+    images = []
+    spacings = []
+    decoded = []
+    for source in sources:
+        try:
+            image, spacing = _load(source)
+        except Exception as e:
+            records[source] = {'source': source, 'status': 'error', 'error': str(e)}
+            continue
+        if image is None:
+            records[source] = {'source': source, 'status': 'unreadable'}
+            continue
+        images.append(image)
+        spacings.append(spacing)
+        decoded.append(source)
+
+    if decoded:
+        hints = [_options['hint']] * len(images)
+        try:
+            outputs = detect_body_parts(images, _models, hints, spacings)
+        except Exception as e:
+            outputs = None
+            for source in decoded:
+                records[source] = {'source': source, 'status': 'error', 'error': str(e)}
+        for source, output in zip(decoded, outputs or []):
+            body_part, label, annotated, conf, detections = output
+            if not body_part:
+                records[source] = {'source': source, 'status': 'no_finding'}
+                continue
+            record = {
+                'source': source,
+                'status': 'ok',
+                'body_part': body_part,
+                'label': label,
+                'confidence': conf,
+                'labels': result_labels({'label': label, 'detections': detections}),
+                'detections': detections,
+                'model_version': _models[body_part].version
+            }
+            if _options['annotated'] and annotated is not None:
+                record['annotated_path'] = save_annotated_image_cv2(
+                    annotated, output_name(source, _options['annotated']))
+                if _options['reports']:
+                    path = output_name(source, _options['annotated'], prefix='report_')
+                    if cv2.imwrite(path, downscale(annotated, REPORT_IMAGE_MAX_SIDE),
+                                   encode_params('jpeg', REPORT_IMAGE_JPEG_QUALITY)):
+                        record['report_image_path'] = path
+            records[source] = record
+    return [records[source] for source in sources]
+
+
+def render_patient_report(patient_id, records, path):
+    """Render one patient's PDF in a worker. Returns the path, or None on failure."""
+    from app.utils.pdf_generator import render_pdf_report
+    patient_info = {'Name': '', 'Age': '', 'Gender': '', 'Patient_ID': patient_id,
+                    'Radiologist_Name': '', 'Radiologist_ID': ''}
+    images_info = [{
+        'original_path': record['source'],
+        'annotated_path': record['annotated_path'],
+        'annotated_report_path': record.get('report_image_path'),
+        'label': record['label'],
+        'labels': record['labels'],
+        'detections': record['detections']
+    } for record in records]
+    try:
+        data = render_pdf_report(patient_info, images_info)
+    except Exception as e:
+        print(f"Error generating PDF for {patient_id}: {e}")
+        return None
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+# --- Results file ---
+
+def read_results(path):
+    """Yield the records already in a JSONL or CSV results file (a torn last line is skipped)."""
+    if not os.path.exists(path):
+        return
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                record = {k: v for k, v in row.items() if v not in ('', None)}
+                for key in ('labels', 'detections'):
+                    if key in record:
+                        record[key] = json.loads(record[key])
+                if 'confidence' in record:
+                    record['confidence'] = float(record['confidence'])
+                yield record
+        else:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+class ResultWriter:
+    """Appends records to a JSONL or CSV file, flushing after every batch."""
+
+    def __init__(self, path):
+        self.csv = path.endswith('.csv')
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', newline='')
+        if self.csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            if new:
+                self.writer.writeheader()
+
+    def write(self, records):
+        for record in records:
+            if self.csv:
+                row = dict(record)
+                for key in ('labels', 'detections'):
+                    if key in row:
+                        row[key] = json.dumps(row[key])
+                self.writer.writerow(row)
+            else:
+                self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# --- Driver ---
+
+def run_bounded(pool, func, tasks, max_in_flight, on_result):
+    """Submit func(*task) for every task, keeping at most max_in_flight pending."""
+    pending = set()
+    for task in tasks:
+        if len(pending) >= max_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                on_result(future.result())
+        pending.add(pool.submit(func, *task))
+    for future in pending:
+        on_result(future.result())
+
+
+def run(args):
+    done_sources = set()
+    for record in read_results(args.output):
+        if record.get('status') != 'error':
+            done_sources.add(record['source'])
+    if done_sources:
+        print(f"Resuming: {len(done_sources)} images already in {args.output}")
+
+    # Split the cores between workers instead of letting every model take all of them
+    os.environ.setdefault('MODEL_THREADS', str(max(1, (os.cpu_count() or 1) // args.workers)))
+
+    options = {'hint': args.hint, 'annotated': args.annotated, 'reports': args.reports}
+    todo = (source for source in iter_sources(args.input) if source not in done_sources)
+    writer = ResultWriter(args.output)
+    counts = {}
+    patients = set()
+    started = time.perf_counter()
+
+    def on_batch(records):
+        writer.write(records)
+        for record in records:
+            counts[record['status']] = counts.get(record['status'], 0) + 1
+            if record['status'] == 'ok':
+                patients.add(patient_of(record['source']))
+        processed = sum(counts.values())
+        if processed % args.progress_every < len(records):
+            rate = processed / (time.perf_counter() - started)
+            print(f"{processed} images ({rate:.1f}/s): {counts}")
+
+    # Spawned workers: never fork a process that may already hold torch threads
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(args.workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(args.input, options)) as pool:
+        try:
+            run_bounded(pool, process_batch, ((batch,) for batch in chunked(todo, args.batch_size)),
+                        args.max_in_flight, on_batch)
+            writer.close()
+            if args.reports:
+                write_reports(pool, args, patients)
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            writer.close()
+            print("Interrupted; run again with the same --output to resume")
+            return 1
+
+    print(f"Done: {counts} in {time.perf_counter() - started:.1f}s")
+    return 1 if counts.get('error') else 0
+
+
+def write_reports(pool, args, patients):
+    """Render a PDF for every patient with new results, or whose PDF is missing."""
+    os.makedirs(args.reports, exist_ok=True)
+    by_patient = {}
+    for record in read_results(args.output):
+        if record.get('status') == 'ok' and record.get('annotated_path'):
+            by_patient.setdefault(patient_of(record['source']), {})[record['source']] = record
+
+    tasks = []
+    for patient_id, records in sorted(by_patient.items()):
+        path = os.path.join(args.reports, f"{secure_filename(patient_id) or 'unknown'}_report.pdf")
+        if patient_id in patients or not os.path.exists(path):
+            tasks.append((patient_id, list(records.values()), path))
+
+    written = []
+    run_bounded(pool, render_patient_report, tasks, args.max_in_flight,
+                lambda path: written.append(path) if path else None)
+    print(f"Wrote {len(written)} of {len(tasks)} patient reports to {args.reports}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a folder or ZIP archive of X-ray images")
+    parser.add_argument('input', help="directory tree or ZIP archive of images")
+    parser.add_argument('--output', required=True, help="results file, JSONL or .csv (appended to on resume)")
+    parser.add_argument('--annotated', help="directory for annotated images")
+    parser.add_argument('--reports', help="directory for per-patient PDF reports (needs --annotated)")
+    parser.add_argument('--hint', help="body part of every image, skips auto-detection")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument('--batch-size', type=int, default=INFERENCE_MAX_BATCH, help="images per model call")
+    parser.add_argument('--max-in-flight', type=int, help="batches queued at once (default 2 per worker)")
+    parser.add_argument('--progress-every', type=int, default=500, help="images between progress lines")
+    args = parser.parse_args(argv)
+
+    if args.reports and not args.annotated:
+        parser.error("--reports needs --annotated")
+    # Recorded image paths must be absolute: the PDF renderer resolves relative
+    # ones against PROCESSED_FOLDER, not the working directory
+    for name in ('annotated', 'reports'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    args.max_in_flight = args.max_in_flight or 2 * args.workers
+    return args
+
+
+def main():
+    sys.exit(run(parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -11,13 +11,187 @@ YOLO_MODELS = {
     'wrist': "app/models/wrist.pt"
 }
 
+# Inference backend: 'auto' serves the ONNX export of a model when one exists
+# (python -m app.export_models) and PyTorch otherwise; 'torch' or 'onnx' force one
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'auto')
+ONNX_INT8 = os.environ.get('ONNX_INT8', '0') == '1'          # prefer the INT8-quantized export
+ONNX_PROVIDERS = os.environ.get('ONNX_PROVIDERS', 'OpenVINOExecutionProvider,CPUExecutionProvider').split(',')
+ONNX_INTRA_OP_THREADS = int(os.environ.get('ONNX_INTRA_OP_THREADS', 0))   # 0 = one per core
+ONNX_INTER_OP_THREADS = int(os.environ.get('ONNX_INTER_OP_THREADS', 1))
+
+# Detection post-processing (Ultralytics defaults)
+DETECTION_CONF_THRESHOLD = 0.25
+DETECTION_IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
+
+# Findings kept per image: every box of the winning model at or above this
+# confidence (after per-class NMS), strongest first, at most MAX_FINDINGS
+FINDING_CONF_THRESHOLD = float(os.environ.get('FINDING_CONF_THRESHOLD', 0.25))
+MAX_FINDINGS = int(os.environ.get('MAX_FINDINGS', 10))
+
+# Tiled inference for high-resolution films: images with more than `min_pixels`
+# pixels are also run as overlapping `tile`-px crops (overlap is a fraction of
+# the tile) and the boxes merged with cross-tile NMS. Body parts without an
+# entry use 'default'.
+TILED_INFERENCE = os.environ.get('TILED_INFERENCE', '0') == '1'
+TILING = {
+    'default': {'tile': 1280, 'overlap': 0.2, 'min_pixels': 2500 * 2500},
+    # Wrist and heel findings (periosteal reaction, small spurs) are tiny on full films
+    'wrist': {'tile': 960, 'overlap': 0.25, 'min_pixels': 2000 * 2000},
+    'heel': {'tile': 960, 'overlap': 0.25, 'min_pixels': 2000 * 2000},
+    'spine': {'tile': 1280, 'overlap': 0.25, 'min_pixels': 2500 * 2500}
+}
+
+# Run the detectors of different body parts concurrently in a thread pool of
+# MODEL_WORKERS threads. Each model gets MODEL_THREADS intra-op threads
+# (0 = cores / MODEL_WORKERS) so concurrent models don't oversubscribe the CPU.
+# Models not yet started are skipped once another one reaches
+# MODEL_DECISIVE_CONFIDENCE on all of their images (0 never skips).
+MODEL_WORKERS = int(os.environ.get('MODEL_WORKERS', 1))
+MODEL_THREADS = int(os.environ.get('MODEL_THREADS', 0))
+MODEL_DECISIVE_CONFIDENCE = float(os.environ.get('MODEL_DECISIVE_CONFIDENCE', 0))
+
+# Standalone inference server (python -m app.utils.inference_server). When the
+# socket is set, web and job workers send images to it over shared memory and
+# never load models; the server runs INFERENCE_SERVER_REPLICAS model processes.
+INFERENCE_SERVER_SOCKET = os.environ.get('INFERENCE_SERVER_SOCKET', '')
+INFERENCE_SERVER_REPLICAS = int(os.environ.get('INFERENCE_SERVER_REPLICAS', 2))
+INFERENCE_SERVER_TIMEOUT = 300    # seconds per request
+READINESS_TIMEOUT = 2             # seconds /readyz waits for the inference server
+
+# Model registry: load all models when the app is imported (gunicorn --preload)
+PRELOAD_MODELS = os.environ.get('PRELOAD_MODELS', '0') == '1'
+# Workers warm their models on a background thread after boot: they answer
+# /healthz at once, and /readyz turns 200 when every model is warm
+WARMUP_IN_BACKGROUND = os.environ.get('WARMUP_IN_BACKGROUND', '1') == '1'
+MODEL_WARMUP_IMGSZ = 640
+
+# Batched inference: max images per forward pass, and how long (ms) to wait
+# for concurrent requests to join a batch (0 disables cross-request batching)
+INFERENCE_MAX_BATCH = int(os.environ.get('INFERENCE_MAX_BATCH', 8))
+INFERENCE_BATCH_WINDOW_MS = int(os.environ.get('INFERENCE_BATCH_WINDOW_MS', 0))
+
 # Configuration
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'app', 'uploads')
 PROCESSED_FOLDER = os.path.join(BASE_DIR, 'app', 'processed')
 REPORTS_FOLDER = os.path.join(BASE_DIR, 'app', 'reports')
+DATA_FOLDER = os.path.join(BASE_DIR, 'app', 'data')
+
+# PDF reports are rendered in memory and served from an in-memory store;
+# REPORTS_PERSIST also writes them to REPORTS_FOLDER in the background. Keep it
+# on with several gunicorn workers or ASYNC_JOBS: the disk copy is how other
+# processes serve a report, waiting up to REPORT_PERSIST_WAIT seconds for one
+# still being written.
+REPORTS_PERSIST = os.environ.get('REPORTS_PERSIST', '1') == '1'
+REPORT_PERSIST_WAIT = 5
+REPORT_CACHE_BYTES = 64 * 1024 * 1024
+REPORT_CACHE_MAX_AGE = 3600    # seconds browsers may reuse a downloaded report
+
+# /serve_image: uploads and annotations have UUID-unique names and never change
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600
+# Hand file transfers to the front server: nginx internal location prefix for
+# X-Accel-Redirect (e.g. '/protected/' aliased to the app folder), or X-Sendfile
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '')
+USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', '0') == '1'
+
+# Asynchronous analysis jobs: uploads are queued in SQLite and processed by
+# local worker processes (started by gunicorn or `python -m app.utils.job_queue`)
+ASYNC_JOBS = os.environ.get('ASYNC_JOBS', '0') == '1'
+JOBS_DB_PATH = os.path.join(DATA_FOLDER, 'jobs.sqlite3')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_POLL_INTERVAL = 0.5       # seconds between queue polls when idle
+JOB_STALE_SECONDS = 600       # running jobs not updated for this long are requeued
+JOB_HEARTBEAT_INTERVAL = 30   # seconds between updates of a running job, so it never looks stale
+JOB_MAX_ATTEMPTS = 3          # a job whose worker died this many times is failed, not requeued
+JOB_SUPERVISE_INTERVAL = 5    # seconds between checks for dead workers
+JOB_REQUEUE_INTERVAL = 60     # seconds between sweeps for stale running jobs
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 7 * 24 * 3600))   # finished jobs kept
+
+# Per-study results (detections, boxes, file paths) live server-side; the
+# session cookie only carries the study ID. 'sqlite', 'memory' or "module:Class"
+STUDY_STORE_BACKEND = os.environ.get('STUDY_STORE_BACKEND', 'sqlite')
+STUDIES_DB_PATH = os.path.join(DATA_FOLDER, 'studies.sqlite3')
+
+# Persistent index of every detection, queried through /api/detections
+STUDY_INDEX_DB_PATH = os.path.join(DATA_FOLDER, 'study_index.sqlite3')
+STUDY_INDEX_PAGE_SIZE = 50
+STUDY_INDEX_MAX_PAGE_SIZE = 500
+
+# Bulk report exports (/api/report_exports): reports are rendered across
+# EXPORT_WORKERS processes; progress is kept in EXPORTS_DB_PATH
+EXPORTS_DB_PATH = os.path.join(DATA_FOLDER, 'exports.sqlite3')
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', os.cpu_count() or 2))
+EXPORT_MAX_STUDIES = 5000
+EXPORT_STALE_SECONDS = 600     # running exports with no progress for this long have failed
+
+ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'dcm', 'dicom'}
+
+# Streaming uploads (/api/uploads/stream): bytes read from the request per step
+UPLOAD_STREAM_CHUNK_SIZE = 64 * 1024
+
+# DICOM uploads (needs pydicom): frame analyzed in multi-frame files, negative
+# counts from the end
+DICOM_FRAME = int(os.environ.get('DICOM_FRAME', 0))
+
+# Image renditions: full-resolution annotations, a report-sized JPEG embedded in
+# PDFs (120x90 mm at ~250 dpi) and thumbnails for the result grid
+ANNOTATED_JPEG_QUALITY = 90
+REPORT_IMAGE_MAX_SIDE = 1200
+REPORT_IMAGE_JPEG_QUALITY = 85
+THUMBNAIL_MAX_SIDE = 480
+THUMBNAIL_FORMAT = os.environ.get('THUMBNAIL_FORMAT', 'webp')   # 'webp' or 'jpeg'
+THUMBNAIL_QUALITY = 75
+
+# Body-part router: run only the top-k most likely detectors per image.
+# Prototypes are learned from confident full sweeps and persisted to disk.
+# Off by default: its agreement with the full sweep has not been measured yet.
+# A routed detector's finding is only accepted well above the detection
+# threshold, weaker ones are swept across the other models too.
+ROUTER_ENABLED = os.environ.get('ROUTER_ENABLED', '0') == '1'
+ROUTER_TOP_K = 1
+ROUTER_MIN_CONFIDENCE = 0.6        # routing probability needed to skip the full sweep
+ROUTER_ACCEPT_CONFIDENCE = float(os.environ.get('ROUTER_ACCEPT_CONFIDENCE', 0.6))   # to skip the fallback sweep
+ROUTER_MIN_SAMPLES = 5             # learned samples per body part before routing to it
+ROUTER_TEMPERATURE = 0.05
+ROUTER_LEARN_MIN_CONFIDENCE = 0.5
+ROUTER_SAVE_EVERY = 10
+ROUTER_PROTOTYPES_PATH = os.path.join(BASE_DIR, 'app', 'models', 'router_prototypes.npz')
+
+# Inference result cache keyed by image hash + model file hashes
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', '1') == '1'
+RESULT_CACHE_FOLDER = os.path.join(BASE_DIR, 'app', 'cache', 'results')
+RESULT_CACHE_MEMORY_BYTES = 64 * 1024 * 1024    # annotated JPEGs kept in memory
+RESULT_CACHE_DISK_BYTES = 1024 * 1024 * 1024    # on-disk tier
+RESULT_CACHE_PRUNE_EVERY = 50                   # stores between disk size checks
+
+# Storage reaper: a background process (started with the job workers when
+# STORAGE_REAPER_ENABLED=1, or `python -m app.utils.storage_reaper`) expires
+# old studies, deletes files no live or indexed study references and keeps
+# each folder under its quota. Needs a shared STUDY_STORE_BACKEND (not 'memory').
+# Indexed studies keep their files for exports after the session's study has
+# expired, until INDEXED_STUDY_RETENTION_SECONDS after they were analyzed.
+STORAGE_REAPER_ENABLED = os.environ.get('STORAGE_REAPER_ENABLED', '0') == '1'
+STORAGE_REAPER_INTERVAL = int(os.environ.get('STORAGE_REAPER_INTERVAL', 600))   # seconds between runs
+STUDY_RETENTION_SECONDS = int(os.environ.get('STUDY_RETENTION_SECONDS', 7 * 24 * 3600))
+INDEXED_STUDY_RETENTION_SECONDS = int(os.environ.get('INDEXED_STUDY_RETENTION_SECONDS', 30 * 24 * 3600))
+REPORT_RETENTION_SECONDS = int(os.environ.get('REPORT_RETENTION_SECONDS', 30 * 24 * 3600))
+ORPHAN_GRACE_SECONDS = 3600     # unreferenced files younger than this may belong to an upload in flight
+STORAGE_QUOTA_BYTES = {
+    'uploads': int(os.environ.get('UPLOADS_QUOTA_BYTES', 10 * 1024 ** 3)),
+    'processed': int(os.environ.get('PROCESSED_QUOTA_BYTES', 10 * 1024 ** 3)),
+    'reports': int(os.environ.get('REPORTS_QUOTA_BYTES', 2 * 1024 ** 3))
+}
+STORAGE_REAPER_BATCH_SIZE = 200     # files deleted between pauses
+STORAGE_REAPER_BATCH_PAUSE = 0.05   # seconds, leaves disk bandwidth to requests
+STORAGE_REAPER_STATS_PATH = os.path.join(DATA_FOLDER, 'storage_reaper.json')
 
-ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+# /metrics: each process (gunicorn workers, job workers, inference server
+# replicas, export workers) writes its counters and histograms to its own file
+# in METRICS_DIR every METRICS_FLUSH_INTERVAL seconds, and a scrape sums them.
+# Empty: every process only reports its own values.
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(DATA_FOLDER, 'metrics'))
+METRICS_FLUSH_INTERVAL = 5    # seconds
 
 
 body_part_findings = {
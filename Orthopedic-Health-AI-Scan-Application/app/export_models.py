@@ -0,0 +1,111 @@
+import argparse
+import glob
+import os
+import shutil
+import sys
+import cv2
+import numpy as np
+
+from app.config import YOLO_MODELS, BASE_DIR
+from app.utils.inference_backend import TorchModel, OnnxModel, onnx_path_for
+
+# Export every model in YOLO_MODELS to ONNX next to its .pt file, optionally
+# quantize it to INT8, and check that ONNX Runtime matches PyTorch:
+#
+#   python -m app.export_models [--int8] [--verify test_images/*.jpg]
+
+# Allowed drift of the best detection between backends (fp32, int8)
+CONF_TOLERANCE = {False: 0.02, True: 0.10}
+IOU_TOLERANCE = {False: 0.95, True: 0.80}
+
+
+def export_onnx(model_path, imgsz):
+    from ultralytics import YOLO
+    exported = YOLO(model_path).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    target = onnx_path_for(model_path)
+    if os.path.abspath(exported) != os.path.abspath(target):
+        shutil.move(exported, target)
+    return target
+
+
+def quantize_int8(onnx_path):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    target = onnx_path.replace('.onnx', '.int8.onnx')
+    quantize_dynamic(onnx_path, target, weight_type=QuantType.QInt8)
+    return target
+
+
+def box_iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 1.0
+
+
+def check_parity(torch_model, onnx_model, images, int8=False):
+    """Compare the best detection of both backends on each image. Returns a list of problems."""
+    problems = []
+    for path in images:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        expected = torch_model(img)[0]
+        actual = onnx_model(img)[0]
+        if len(expected) == 0 and len(actual) == 0:
+            continue
+        if len(expected) == 0 or len(actual) == 0:
+            problems.append(f"{path}: {len(expected)} PyTorch vs {len(actual)} ONNX detections")
+            continue
+        e, a = int(np.argmax(expected.conf)), int(np.argmax(actual.conf))
+        if expected.cls[e] != actual.cls[a]:
+            problems.append(f"{path}: class {expected.cls[e]} vs {actual.cls[a]}")
+        conf_diff = abs(float(expected.conf[e]) - float(actual.conf[a]))
+        if conf_diff > CONF_TOLERANCE[int8]:
+            problems.append(f"{path}: confidence differs by {conf_diff:.3f}")
+        iou = box_iou(expected.xyxy[e], actual.xyxy[a])
+        if iou < IOU_TOLERANCE[int8]:
+            problems.append(f"{path}: box IoU {iou:.3f}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export YOLO models to ONNX for CPU inference")
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--int8', action='store_true', help="also write an INT8-quantized model")
+    parser.add_argument('--verify', nargs='*', metavar='IMAGE',
+                        default=sorted(glob.glob(os.path.join(BASE_DIR, 'test_images', '*'))),
+                        help="images used to check ONNX/PyTorch parity")
+    parser.add_argument('--skip-export', action='store_true', help="only run the parity check")
+    args = parser.parse_args()
+
+    failed = False
+    for body_part, model_path in YOLO_MODELS.items():
+        if not os.path.exists(model_path):
+            print(f"Skipping {body_part}: {model_path} not found")
+            continue
+
+        if args.skip_export:
+            onnx_path = onnx_path_for(model_path)
+        else:
+            onnx_path = export_onnx(model_path, args.imgsz)
+            print(f"Exported {body_part} -> {onnx_path}")
+
+        exports = [(onnx_path, False)]
+        if args.int8:
+            int8_path = onnx_path_for(model_path, int8=True) if args.skip_export else quantize_int8(onnx_path)
+            print(f"Quantized {body_part} -> {int8_path}")
+            exports.append((int8_path, True))
+
+        torch_model = TorchModel(model_path)
+        for path, int8 in exports:
+            problems = check_parity(torch_model, OnnxModel(path), args.verify, int8)
+            for problem in problems:
+                print(f"  PARITY {body_part} ({os.path.basename(path)}) {problem}")
+            failed = failed or bool(problems)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
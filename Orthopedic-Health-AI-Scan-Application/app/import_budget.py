@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from app.config import BASE_DIR
+
+# Startup regression check: import the web app in fresh interpreters and fail
+# when it takes longer than the budget or pulls in a library that is meant to
+# load on first use:
+#
+#   python -m app.import_budget [--budget 1.0] [--repeat 3]
+#
+# Exits non-zero on failure, so it can gate CI or a container build.
+
+DEFAULT_BUDGET = 1.0   # seconds for `import app.app`
+
+# Imported lazily: models load through the registry, PDFs render on demand
+DEFERRED_MODULES = ('torch', 'ultralytics', 'onnxruntime', 'fpdf', 'cv2', 'matplotlib', 'pandas', 'pydicom')
+
+CODE = (
+    "import json, sys, time; t = time.perf_counter();"
+    "import app.app;"
+    "elapsed = time.perf_counter() - t;"
+    # A module deferred with lazy_import.lazy_module stays a _LazyModule until first used
+    f"loaded = [m for m in {DEFERRED_MODULES!r} if m in sys.modules"
+    " and type(sys.modules[m]).__name__ != '_LazyModule'];"
+    "print(json.dumps({'seconds': elapsed, 'loaded': loaded}))"
+)
+
+
+def measure():
+    """Import the app once in a fresh interpreter. Returns (result dict, -X importtime lines)."""
+    env = dict(os.environ, PRELOAD_MODELS='0')
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', CODE], cwd=BASE_DIR, env=env,
+                         capture_output=True, text=True, timeout=300, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1]), out.stderr.splitlines()
+
+
+def slowest_imports(importtime_lines, count=10):
+    """(cumulative seconds, module) of the slowest imports, from -X importtime output."""
+    rows = []
+    for line in importtime_lines:
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        rows.append((int(parts[1]) / 1e6, parts[2].rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if importing the web app is too slow or too heavy")
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help="seconds allowed for import app.app")
+    parser.add_argument('--repeat', type=int, default=3, help="imports to run; the fastest counts")
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(max(1, args.repeat))]
+    result, importtime_lines = min(runs, key=lambda run: run[0]['seconds'])
+
+    print(f"import app.app: {result['seconds']:.3f}s (budget {args.budget:.3f}s)")
+    for seconds, name in slowest_imports(importtime_lines):
+        print(f"  {seconds:8.3f}s {name}")
+
+    failed = False
+    if result['seconds'] > args.budget:
+        print(f"FAIL: startup import is over budget by {result['seconds'] - args.budget:.3f}s")
+        failed = True
+    if result['loaded']:
+        print(f"FAIL: imported eagerly: {', '.join(result['loaded'])}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,4 +18,104 @@ document.querySelectorAll('form').forEach(form => {
             submitBtn.innerHTML = '<span class="spinner-border spinner-border-sm" role="status"></span> Processing...';
         }
     });
-});
\ No newline at end of file
+});
+// Poll a queued analysis job and reload the page once its results are ready
+document.addEventListener('DOMContentLoaded', function() {
+    const jobSection = document.getElementById('jobProgress');
+    if (!jobSection) {
+        return;
+    }
+    const bar = document.getElementById('jobProgressBar');
+    const text = document.getElementById('jobProgressText');
+
+    function poll() {
+        fetch(jobSection.dataset.statusUrl)
+            .then(response => response.json())
+            .then(job => {
+                if (job.total) {
+                    bar.style.width = Math.round(100 * job.progress / job.total) + '%';
+                    text.textContent = job.progress + ' / ' + job.total + ' images analyzed';
+                }
+                if (job.status === 'done') {
+                    fetch(jobSection.dataset.resultUrl).then(() => window.location.reload());
+                } else if (job.status === 'failed') {
+                    text.textContent = 'Analysis failed: ' + job.error;
+                    bar.classList.add('bg-danger');
+                } else {
+                    setTimeout(poll, 1000);
+                }
+            })
+            .catch(() => setTimeout(poll, 3000));
+    }
+    poll();
+});
+
+// Stream uploads: each image is analyzed as soon as it has arrived, while the
+// rest are still uploading. The results become the session's study, as with
+// the plain form submission, so the page is reloaded once they are all in.
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('uploadForm');
+    if (!form || !form.dataset.streamUrl || !window.TextDecoder || !window.ReadableStream) {
+        return;
+    }
+    const text = document.getElementById('uploadProgressText');
+
+    form.addEventListener('submit', function(event) {
+        event.preventDefault();
+        const data = new FormData(form);
+        const total = form.querySelector('input[name="images"]').files.length;
+        const hint = data.get('body_part_hint');
+        data.delete('body_part_hint');
+        const url = form.dataset.streamUrl + (hint ? '?body_part_hint=' + encodeURIComponent(hint) : '');
+        let analyzed = 0;
+        const errors = [];
+
+        function handle(line) {
+            if (!line.trim()) {
+                return;
+            }
+            const record = JSON.parse(line);
+            if (record.status === 'done') {
+                window.location.reload();
+                return;
+            }
+            analyzed += 1;
+            if (record.status === 'error') {
+                errors.push(record.error);
+            }
+            text.textContent = analyzed + ' / ' + total + ' images analyzed' +
+                (errors.length ? ' (' + errors.join('; ') + ')' : '');
+        }
+
+        text.textContent = 'Uploading...';
+        fetch(url, {method: 'POST', body: data})
+            .then(response => {
+                if (!response.ok) {
+                    return response.json().then(body => { throw new Error(body.error); });
+                }
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                function read() {
+                    return reader.read().then(({done, value}) => {
+                        buffer += decoder.decode(value || new Uint8Array(), {stream: !done});
+                        const lines = buffer.split('\n');
+                        buffer = lines.pop();
+                        lines.forEach(handle);
+                        if (done) {
+                            handle(buffer);
+                            return;
+                        }
+                        return read();
+                    });
+                }
+                return read();
+            })
+            .catch(error => {
+                text.textContent = 'Upload failed: ' + error.message;
+                const submitBtn = form.querySelector('button[type="submit"]');
+                submitBtn.disabled = false;
+                submitBtn.textContent = 'Upload Images';
+            });
+    });
+});
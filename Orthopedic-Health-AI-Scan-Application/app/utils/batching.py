@@ -0,0 +1,148 @@
+import queue
+import threading
+import time
+import weakref
+
+from app.config import INFERENCE_BATCH_WINDOW_MS, INFERENCE_MAX_BATCH
+
+# Queued by MicroBatcher.close() after the last submitted images
+_STOP = object()
+
+
+class _Pending:
+    """Images submitted by one caller, waiting for their share of a batch."""
+
+    def __init__(self, imgs):
+        self.imgs = imgs
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Collects images submitted by concurrent requests for one model during a
+    short window and runs them through the model as a single batch. close()
+    ends its thread; the model registry closes it when the model is replaced.
+    """
+
+    def __init__(self, model, window_ms, max_batch):
+        # Weak reference so a hot-reloaded model can be garbage collected
+        self._model = weakref.ref(model)
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __call__(self, imgs):
+        pending = _Pending(imgs)
+        with self._lock:
+            queued = not self._closed
+            if queued:
+                self._queue.put(pending)
+        if not queued:
+            # Closed while the caller still held it: no batching, but still an answer
+            model = self._model()
+            if model is None:
+                raise RuntimeError("Model was unloaded")
+            return predict_in_chunks(model, imgs, self.max_batch)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.results
+
+    def close(self):
+        """Stop the thread once the images already submitted have been run."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+
+    def _collect(self):
+        """The next group of submissions to run together, and whether close() was called."""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        group = [first]
+        size = len(first.imgs)
+        deadline = time.monotonic() + self.window
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if pending is _STOP:
+                return group, True
+            group.append(pending)
+            size += len(pending.imgs)
+        return group, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            group, stop = self._collect()
+            if not group:
+                continue
+            try:
+                imgs = [img for pending in group for img in pending.imgs]
+                model = self._model()
+                if model is None:
+                    raise RuntimeError("Model was unloaded")
+                results = predict_in_chunks(model, imgs, self.max_batch)
+                del model
+                offset = 0
+                for pending in group:
+                    pending.results = results[offset:offset + len(pending.imgs)]
+                    offset += len(pending.imgs)
+            except Exception as e:
+                for pending in group:
+                    pending.error = e
+            finally:
+                for pending in group:
+                    pending.done.set()
+
+
+_batchers = weakref.WeakKeyDictionary()
+_batchers_lock = threading.Lock()
+
+
+def predict_in_chunks(model, imgs, max_batch=INFERENCE_MAX_BATCH):
+    """Run imgs through the model in forward passes of at most max_batch images."""
+    results = []
+    for start in range(0, len(imgs), max_batch):
+        results.extend(model(imgs[start:start + max_batch]))
+    return results
+
+
+def batched_predict(model, imgs):
+    """
+    Run a list of decoded images through a model, one forward pass per batch.
+    With INFERENCE_BATCH_WINDOW_MS > 0, images from concurrent requests to the
+    same model are merged into shared batches.
+    """
+    if INFERENCE_BATCH_WINDOW_MS <= 0:
+        return predict_in_chunks(model, imgs)
+
+    with _batchers_lock:
+        batcher = _batchers.get(model)
+        if batcher is None:
+            batcher = MicroBatcher(model, INFERENCE_BATCH_WINDOW_MS, INFERENCE_MAX_BATCH)
+            _batchers[model] = batcher
+            # Also stopped if the model is dropped without close_batcher
+            weakref.finalize(model, batcher.close)
+    return batcher(imgs)
+
+
+def close_batcher(model):
+    """Stop the batcher of a model that is being replaced, if it has one."""
+    with _batchers_lock:
+        batcher = _batchers.pop(model, None)
+    if batcher is not None:
+        batcher.close()
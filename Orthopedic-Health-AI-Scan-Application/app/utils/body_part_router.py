@@ -0,0 +1,159 @@
+import fcntl
+import os
+import threading
+import numpy as np
+
+from app.config import (
+    ROUTER_ENABLED, ROUTER_TOP_K, ROUTER_MIN_CONFIDENCE, ROUTER_MIN_SAMPLES,
+    ROUTER_TEMPERATURE, ROUTER_LEARN_MIN_CONFIDENCE, ROUTER_PROTOTYPES_PATH,
+    ROUTER_SAVE_EVERY
+)
+from app.utils.lazy_import import lazy_module
+
+cv2 = lazy_module('cv2')
+
+EMBEDDING_SIZE = 32
+
+# body_part -> (mean embedding, sample count), learned from full sweeps
+_prototypes = {}
+# body_part -> (sum of embeddings, count) learned here since the last save.
+# Every worker learns, so saves merge these into the file rather than overwrite it.
+_unsaved = {}
+_lock = threading.Lock()
+_updates_since_save = 0
+
+_stats = {
+    'images': 0,
+    'detector_runs': 0,
+    'routed': 0,
+    'hinted': 0,
+    'fallbacks': 0
+}
+
+
+def embed(img):
+    """Cheap global descriptor: a normalized 32x32 grayscale thumbnail."""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    thumb = cv2.resize(gray, (EMBEDDING_SIZE, EMBEDDING_SIZE), interpolation=cv2.INTER_AREA)
+    vec = thumb.astype(np.float32).ravel()
+    vec -= vec.mean()
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+def _read_prototypes():
+    """The prototypes saved in ROUTER_PROTOTYPES_PATH, as {body_part: (mean, count)}."""
+    prototypes = {}
+    if not os.path.exists(ROUTER_PROTOTYPES_PATH):
+        return prototypes
+    try:
+        data = np.load(ROUTER_PROTOTYPES_PATH)
+        for key in data.files:
+            if key.endswith('__count'):
+                continue
+            prototypes[key] = (data[key], int(data[f'{key}__count']))
+    except Exception as e:
+        print(f"Error loading router prototypes: {str(e)}")
+    return prototypes
+
+
+def _load_prototypes():
+    _prototypes.update(_read_prototypes())
+
+
+def _save_prototypes():
+    """
+    Merge this process's unsaved samples into the file, under a file lock so
+    concurrent workers don't lose each other's, and adopt the merged result.
+    """
+    tmp_path = f"{ROUTER_PROTOTYPES_PATH}.{os.getpid()}.tmp.npz"
+    try:
+        os.makedirs(os.path.dirname(ROUTER_PROTOTYPES_PATH), exist_ok=True)
+        with open(f"{ROUTER_PROTOTYPES_PATH}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = _read_prototypes()
+            for body_part, (total, samples) in _unsaved.items():
+                mean, count = merged.get(body_part, (np.zeros_like(total), 0))
+                mean = (mean * count + total) / (count + samples)
+                norm = np.linalg.norm(mean)
+                merged[body_part] = (mean / norm if norm > 0 else mean, count + samples)
+            arrays = {}
+            for body_part, (mean, count) in merged.items():
+                arrays[body_part] = mean
+                arrays[f'{body_part}__count'] = np.array(count)
+            np.savez(tmp_path, **arrays)
+            os.replace(tmp_path, ROUTER_PROTOTYPES_PATH)
+    except Exception as e:
+        print(f"Error saving router prototypes: {str(e)}")
+        return
+    _unsaved.clear()
+    _prototypes.update(merged)
+
+
+def route(embedding, body_parts, hint=None):
+    """
+    Pick candidate detectors for one image.
+    Returns (candidates, full_sweep): the body parts to run first, and whether
+    that already is every available model.
+    """
+    body_parts = list(body_parts)
+    if hint in body_parts:
+        return [hint], len(body_parts) == 1
+    if not ROUTER_ENABLED or embedding is None:
+        return body_parts, True
+
+    with _lock:
+        known = [(bp, _prototypes[bp][0]) for bp in body_parts
+                 if bp in _prototypes and _prototypes[bp][1] >= ROUTER_MIN_SAMPLES]
+    # Every body part needs a prototype, otherwise an unseen part could never win
+    if len(known) < len(body_parts):
+        return body_parts, True
+
+    sims = np.array([float(np.dot(embedding, proto)) for _, proto in known])
+    probs = np.exp((sims - sims.max()) / ROUTER_TEMPERATURE)
+    probs /= probs.sum()
+    order = np.argsort(-probs)[:ROUTER_TOP_K]
+    if probs[order].sum() < ROUTER_MIN_CONFIDENCE:
+        return body_parts, True
+    return [known[i][0] for i in order], len(order) == len(body_parts)
+
+
+def learn(embedding, body_part, confidence):
+    """Fold a confident full-sweep result into the body part's prototype."""
+    global _updates_since_save
+    if embedding is None or confidence < ROUTER_LEARN_MIN_CONFIDENCE:
+        return
+    with _lock:
+        mean, count = _prototypes.get(body_part, (np.zeros_like(embedding), 0))
+        mean = mean + (embedding - mean) / (count + 1)
+        norm = np.linalg.norm(mean)
+        _prototypes[body_part] = (mean / norm if norm > 0 else mean, count + 1)
+        total, samples = _unsaved.get(body_part, (np.zeros_like(embedding), 0))
+        _unsaved[body_part] = (total + embedding, samples + 1)
+        _updates_since_save += 1
+        if _updates_since_save >= ROUTER_SAVE_EVERY:
+            _updates_since_save = 0
+            _save_prototypes()
+
+
+def record(detector_runs, routed=False, hinted=False, fallback=False):
+    """Account one routed image."""
+    with _lock:
+        _stats['images'] += 1
+        _stats['detector_runs'] += detector_runs
+        _stats['routed'] += int(routed)
+        _stats['hinted'] += int(hinted)
+        _stats['fallbacks'] += int(fallback)
+
+
+def router_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats['prototypes'] = {bp: count for bp, (_, count) in _prototypes.items()}
+    images = stats['images'] or 1
+    stats['detector_runs_per_image'] = stats['detector_runs'] / images
+    stats['fallback_rate'] = stats['fallbacks'] / images
+    return stats
+
+
+_load_prototypes()
@@ -0,0 +1,56 @@
+import os
+
+from app.config import (
+    PROCESSED_FOLDER, REPORT_IMAGE_MAX_SIDE, REPORT_IMAGE_JPEG_QUALITY,
+    THUMBNAIL_MAX_SIDE, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY
+)
+from app.utils.metrics import IMAGE_SAVE_SECONDS
+from app.utils.lazy_import import lazy_module
+
+cv2 = lazy_module('cv2')
+
+# Derivative renditions generated once per image: a report-sized JPEG that is
+# embedded in PDFs and a small thumbnail for the result grid. Full resolution
+# files are only served when the user opens them.
+
+
+def downscale(img, max_side):
+    """Resize so the longest side is at most max_side (never upscales)."""
+    h, w = img.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return img
+    return cv2.resize(img, (int(round(w * scale)), int(round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def encode_params(fmt, quality):
+    if fmt == 'webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    return [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+
+def _write(img, filename, fmt, quality):
+    path = os.path.join(PROCESSED_FOLDER, filename)
+    if cv2.imwrite(path, img, encode_params(fmt, quality)):
+        return f'processed/{filename}'
+    return None
+
+
+def _stem(filename):
+    return os.path.splitext(filename)[0]
+
+
+@IMAGE_SAVE_SECONDS.timed(kind='thumbnail')
+def save_thumbnail(img, filename):
+    """Write a grid thumbnail of img as processed/thumb_<stem>.<fmt>; returns its relative path."""
+    ext = 'webp' if THUMBNAIL_FORMAT == 'webp' else 'jpg'
+    return _write(downscale(img, THUMBNAIL_MAX_SIDE), f"thumb_{_stem(filename)}.{ext}",
+                  THUMBNAIL_FORMAT, THUMBNAIL_QUALITY)
+
+
+@IMAGE_SAVE_SECONDS.timed(kind='report')
+def save_report_image(img, filename):
+    """Write the PDF-sized JPEG as processed/report_<stem>.jpg; returns its relative path."""
+    # FPDF only embeds JPEG/PNG, so report renditions are always JPEG
+    return _write(downscale(img, REPORT_IMAGE_MAX_SIDE), f"report_{_stem(filename)}.jpg",
+                  'jpeg', REPORT_IMAGE_JPEG_QUALITY)
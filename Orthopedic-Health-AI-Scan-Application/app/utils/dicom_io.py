@@ -0,0 +1,219 @@
+import importlib.util
+import io
+import struct
+from collections.abc import Sequence
+import numpy as np
+
+from app.utils.lazy_import import lazy_module
+
+cv2 = lazy_module('cv2')
+
+# DICOM ingestion. Only the header is parsed with pydicom; the pixel data of
+# uncompressed files is mapped (np.memmap for files on disk, a view of the
+# buffer for uploaded bytes) and only the analyzed frame is read, so large
+# multi-frame studies are never loaded whole. 12/16-bit pixels are windowed
+# to 8 bits through a lookup table, one gather per frame. Compressed transfer
+# syntaxes go through pydicom's decoders. pydicom is optional: without it
+# DICOM files are reported as undecodable.
+
+DICOM_EXTENSIONS = {'dcm', 'dicom'}
+
+PIXEL_DATA_TAG = (0x7FE0, 0x0010)
+UNDEFINED_LENGTH = 0xFFFFFFFF
+
+# Explicit VRs whose length takes 4 bytes (after 2 reserved bytes)
+LONG_VRS = {b'OB', b'OD', b'OF', b'OL', b'OV', b'OW', b'SQ', b'SV', b'UC', b'UN', b'UR', b'UT', b'UV'}
+
+# Photometric interpretations read straight from the mapped pixel data
+NATIVE_PHOTOMETRICS = ('MONOCHROME1', 'MONOCHROME2', 'RGB')
+
+# Percentiles of the stored values used as window when the file has none
+AUTO_WINDOW_PERCENTILES = (0.5, 99.5)
+
+
+def available():
+    return importlib.util.find_spec('pydicom') is not None
+
+
+def is_dicom(header):
+    """True if `header`, the first bytes of a file, carries the DICOM Part 10 marker."""
+    return bytes(header[128:132]) == b'DICM'
+
+
+def _pixel_data_location(fp, syntax):
+    """
+    (offset, length) of the PixelData value, with fp where
+    dcmread(stop_before_pixels=True) left it, at the element's tag.
+    Returns (None, 0) when there is no PixelData element.
+    """
+    endian = '<' if syntax.is_little_endian else '>'
+    header = fp.read(8)
+    if len(header) < 8 or struct.unpack(endian + 'HH', header[:4]) != PIXEL_DATA_TAG:
+        return None, 0
+    if syntax.is_implicit_VR:
+        length, = struct.unpack(endian + 'I', header[4:])
+    elif header[4:6] in LONG_VRS:
+        length, = struct.unpack(endian + 'I', fp.read(4))
+    else:
+        length, = struct.unpack(endian + 'H', header[6:])
+    return fp.tell(), length
+
+
+def pixel_spacing_cm(ds):
+    """(row, column) pixel spacing in cm from the header, or None if it has none."""
+    spacing = ds.get('PixelSpacing') or ds.get('ImagerPixelSpacing')
+    try:
+        row, col = (float(value) / 10 for value in spacing)
+    except (TypeError, ValueError):
+        return None
+    if row <= 0 or col <= 0:
+        return None
+    if 'PixelSpacing' not in ds:
+        # Detector spacing; objects are smaller than their projection by the magnification
+        magnification = float(ds.get('EstimatedRadiographicMagnificationFactor') or 1) or 1
+        row, col = row / magnification, col / magnification
+    return row, col
+
+
+def _first(value, default=None):
+    """First value of a possibly multi-valued numeric element, as a float."""
+    if isinstance(value, Sequence) and not isinstance(value, (str, bytes)):
+        value = value[0] if len(value) else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _window_lut(ds, codes_seen, bits_stored, signed):
+    """
+    uint8 lookup table indexed by raw (unsigned, 8 or 16-bit) pixel codes,
+    applying the stored-bits mask, sign, modality rescale and VOI window in
+    one go. `codes_seen` are the frame's codes, for the automatic window.
+    """
+    codes = np.arange(1 << (8 * codes_seen.dtype.itemsize), dtype=np.int64)
+    stored = codes & ((1 << bits_stored) - 1)
+    if signed:
+        stored = np.where(stored >= 1 << (bits_stored - 1), stored - (1 << bits_stored), stored)
+    values = stored * _first(ds.get('RescaleSlope'), 1.0) + _first(ds.get('RescaleIntercept'), 0.0)
+
+    center, width = _first(ds.get('WindowCenter')), _first(ds.get('WindowWidth'))
+    if center is not None and width is not None and width >= 1:
+        low, high = center - width / 2, center + width / 2
+    else:
+        # No window in the header: stretch the frame's own value range
+        counts = np.bincount(codes_seen.ravel(), minlength=len(codes))
+        order = np.argsort(values, kind='stable')
+        cumulative = np.cumsum(counts[order])
+        low, high = (values[order][min(np.searchsorted(cumulative, cumulative[-1] * p / 100), len(codes) - 1)]
+                     for p in AUTO_WINDOW_PERCENTILES)
+    if high <= low:
+        high = low + 1
+    return (np.clip((values - low) / (high - low), 0, 1) * 255).astype(np.uint8)
+
+
+def _float_to_uint8(ds, pixels):
+    """Window 32-bit or float pixels, which are too wide for a lookup table."""
+    values = pixels.astype(np.float32) * _first(ds.get('RescaleSlope'), 1.0) + _first(ds.get('RescaleIntercept'), 0.0)
+    center, width = _first(ds.get('WindowCenter')), _first(ds.get('WindowWidth'))
+    if center is not None and width is not None and width >= 1:
+        low, high = center - width / 2, center + width / 2
+    else:
+        low, high = np.percentile(values[::4, ::4], AUTO_WINDOW_PERCENTILES)
+    values -= low
+    values *= 255.0 / max(high - low, 1e-6)
+    np.clip(values, 0, 255, out=values)
+    return values.astype(np.uint8)
+
+
+def to_bgr8(ds, pixels, photometric):
+    """Convert one frame of stored pixel values to a BGR uint8 image."""
+    bits_stored = int(ds.get('BitsStored') or 8 * pixels.dtype.itemsize)
+    if photometric.startswith('MONOCHROME'):
+        if pixels.ndim == 3:
+            pixels = pixels[..., 0]
+        if pixels.dtype.kind in 'iu' and pixels.dtype.itemsize <= 2:
+            # Same bytes read as unsigned codes, keeping the byte order
+            codes = pixels.view(pixels.dtype.str.replace('i', 'u'))
+            gray = _window_lut(ds, codes, bits_stored, pixels.dtype.kind == 'i')[codes]
+        else:
+            gray = _float_to_uint8(ds, pixels)
+        if photometric == 'MONOCHROME1':
+            # Inverted grayscale: low values are white
+            np.subtract(255, gray, out=gray)
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+    # Colour frames (RGB, or converted to RGB by pydicom)
+    if pixels.dtype != np.uint8:
+        pixels = (pixels >> max(bits_stored - 8, 0)).astype(np.uint8)
+    return np.ascontiguousarray(pixels[..., ::-1])
+
+
+def _native_frame(source, ds, syntax, offset, length, frame):
+    """One frame of uncompressed pixel data, mapped rather than read. None if not mappable."""
+    bits = int(ds.BitsAllocated)
+    if bits not in (8, 16, 32) or length == UNDEFINED_LENGTH:
+        return None
+    rows, cols = int(ds.Rows), int(ds.Columns)
+    samples = int(ds.get('SamplesPerPixel') or 1)
+    kind = 'i' if int(ds.get('PixelRepresentation') or 0) == 1 else 'u'
+    dtype = np.dtype(f"{kind}{bits // 8}").newbyteorder('<' if syntax.is_little_endian else '>')
+    count = rows * cols * samples
+    if (frame + 1) * count * dtype.itemsize > length:
+        raise ValueError("DICOM pixel data is truncated")
+    start = offset + frame * count * dtype.itemsize
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        pixels = np.frombuffer(source, dtype=dtype, count=count, offset=start)
+    else:
+        pixels = np.memmap(source, dtype=dtype, mode='r', offset=start, shape=(count,))
+
+    if samples == 1:
+        return pixels.reshape(rows, cols)
+    if int(ds.get('PlanarConfiguration') or 0) == 1:
+        return pixels.reshape(samples, rows, cols).transpose(1, 2, 0)
+    return pixels.reshape(rows, cols, samples)
+
+
+def _decoded_frame(source, frame, frames):
+    """One frame through pydicom's pixel decoders (compressed transfer syntaxes)."""
+    import pydicom
+    src = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+    try:
+        from pydicom.pixels import pixel_array
+    except ImportError:
+        # pydicom < 3 can only decode every frame at once
+        pixels = pydicom.dcmread(src).pixel_array
+        return pixels[frame] if frames > 1 else pixels
+    return pixel_array(src, index=frame if frames > 1 else None)
+
+
+def read_dicom(source, frame=0):
+    """
+    Read one frame of a DICOM file, given its path or its bytes. Negative
+    frames count from the end; out of range frames are clamped.
+    Returns (BGR uint8 image, (row, column) pixel spacing in cm or None).
+    """
+    import pydicom
+
+    in_memory = isinstance(source, (bytes, bytearray, memoryview))
+    with (io.BytesIO(source) if in_memory else open(source, 'rb')) as fp:
+        ds = pydicom.dcmread(fp, stop_before_pixels=True)
+        syntax = ds.file_meta.TransferSyntaxUID
+        offset, length = (None, 0) if syntax.is_deflated else _pixel_data_location(fp, syntax)
+
+    photometric = str(ds.get('PhotometricInterpretation', 'MONOCHROME2')).strip()
+    frames = int(ds.get('NumberOfFrames') or 1)
+    frame = min(max(frame + frames if frame < 0 else frame, 0), frames - 1)
+
+    pixels = None
+    if offset is not None and not syntax.is_compressed and photometric in NATIVE_PHOTOMETRICS:
+        pixels = _native_frame(source, ds, syntax, offset, length, frame)
+    if pixels is None:
+        if photometric == 'PALETTE COLOR':
+            raise ValueError("Palette colour DICOM images are not supported")
+        pixels = _decoded_frame(source, frame, frames)
+        if photometric not in NATIVE_PHOTOMETRICS:
+            # pydicom converts YBR and other colour spaces to RGB
+            photometric = 'RGB'
+    return to_bgr8(ds, pixels, photometric), pixel_spacing_cm(ds)
@@ -0,0 +1,204 @@
+import ast
+import os
+import numpy as np
+
+from app.config import (
+    INFERENCE_BACKEND, ONNX_INT8, ONNX_PROVIDERS, ONNX_INTRA_OP_THREADS, ONNX_INTER_OP_THREADS,
+    DETECTION_CONF_THRESHOLD, DETECTION_IOU_THRESHOLD, MAX_DETECTIONS, MODEL_WORKERS, MODEL_THREADS
+)
+from app.utils.lazy_import import lazy_module
+
+cv2 = lazy_module('cv2')
+
+# Inference backends. Every backend model is called with one image or a list of
+# decoded BGR images and returns one Detections per image, so the rest of the
+# pipeline doesn't care whether PyTorch or ONNX Runtime produced them.
+
+
+class Detections:
+    """Detections for one image: xyxy (N, 4) pixel boxes, conf (N,) scores, cls (N,) class ids."""
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float32).reshape(-1)
+        self.cls = np.asarray(cls, dtype=np.int64).reshape(-1)
+
+    def __len__(self):
+        return len(self.conf)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros((0, 4)), np.zeros(0), np.zeros(0))
+
+    @classmethod
+    def from_ultralytics(cls, results):
+        boxes = results.boxes
+        return cls(boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy())
+
+
+def nms(boxes, scores, iou_threshold):
+    """Greedy non-maximum suppression. Returns kept indices, highest score first."""
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    order = np.argsort(-scores)
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        order = order[1:][iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def batched_nms(boxes, scores, classes, iou_threshold):
+    """Per-class NMS: boxes of different classes never suppress each other."""
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Shift each class into its own coordinate range
+    offsets = classes[:, None].astype(np.float32) * (boxes.max() + 1)
+    return nms(boxes + offsets, scores, iou_threshold)
+
+
+def model_thread_budget():
+    """Intra-op threads per model, or 0 to keep the library default."""
+    if MODEL_THREADS:
+        return MODEL_THREADS
+    if MODEL_WORKERS > 1:
+        return max(1, (os.cpu_count() or 1) // MODEL_WORKERS)
+    return 0
+
+
+class TorchModel:
+    """Ultralytics/PyTorch backend."""
+
+    # Ultralytics predictors keep per-call state
+    thread_safe = False
+
+    def __init__(self, model_path):
+        from ultralytics import YOLO
+        budget = model_thread_budget()
+        if budget:
+            # torch's pool is per process; every model gets the same budget
+            import torch
+            torch.set_num_threads(budget)
+        self.model_path = model_path
+        self.model = YOLO(model_path)
+        self.names = self.model.names
+
+    def __call__(self, source, **kwargs):
+        kwargs.setdefault('verbose', False)
+        return [Detections.from_ultralytics(r) for r in self.model(source, **kwargs)]
+
+
+class OnnxModel:
+    """ONNX Runtime backend for models exported by `python -m app.export_models`."""
+
+    thread_safe = True
+
+    def __init__(self, model_path):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = ONNX_INTRA_OP_THREADS or model_thread_budget()
+        options.inter_op_num_threads = ONNX_INTER_OP_THREADS
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = [p for p in ONNX_PROVIDERS if p in ort.get_available_providers()] or ['CPUExecutionProvider']
+
+        self.model_path = model_path
+        self.session = ort.InferenceSession(model_path, options, providers=providers)
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+
+        # Ultralytics stores class names and input size in the model metadata
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+        imgsz = ast.literal_eval(metadata['imgsz']) if 'imgsz' in metadata else model_input.shape[2:]
+        self.imgsz = (int(imgsz[0]), int(imgsz[1]))
+
+    def _letterbox(self, img):
+        """Resize keeping aspect ratio and pad to the model input size, like Ultralytics."""
+        h, w = img.shape[:2]
+        new_h, new_w = self.imgsz
+        gain = min(new_h / h, new_w / w)
+        unpad_w, unpad_h = int(round(w * gain)), int(round(h * gain))
+        dw, dh = (new_w - unpad_w) / 2, (new_h - unpad_h) / 2
+        if (w, h) != (unpad_w, unpad_h):
+            img = cv2.resize(img, (unpad_w, unpad_h), interpolation=cv2.INTER_LINEAR)
+        top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+        left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+        img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+        return img, gain, (left, top)
+
+    def _postprocess(self, output, gain, pad, shape):
+        # output: (4 + num_classes, num_anchors) with cx, cy, w, h then class scores
+        preds = output.T
+        scores = preds[:, 4:]
+        cls = scores.argmax(axis=1)
+        conf = scores[np.arange(len(cls)), cls]
+        mask = conf > DETECTION_CONF_THRESHOLD
+        if not mask.any():
+            return Detections.empty()
+        preds, cls, conf = preds[mask], cls[mask], conf[mask]
+
+        xyxy = np.empty((len(preds), 4), dtype=np.float32)
+        xyxy[:, 0] = preds[:, 0] - preds[:, 2] / 2
+        xyxy[:, 1] = preds[:, 1] - preds[:, 3] / 2
+        xyxy[:, 2] = preds[:, 0] + preds[:, 2] / 2
+        xyxy[:, 3] = preds[:, 1] + preds[:, 3] / 2
+
+        keep = batched_nms(xyxy, conf, cls, DETECTION_IOU_THRESHOLD)[:MAX_DETECTIONS]
+        xyxy, conf, cls = xyxy[keep], conf[keep], cls[keep]
+
+        # Map back from the letterboxed input to original image pixels
+        xyxy[:, [0, 2]] = ((xyxy[:, [0, 2]] - pad[0]) / gain).clip(0, shape[1])
+        xyxy[:, [1, 3]] = ((xyxy[:, [1, 3]] - pad[1]) / gain).clip(0, shape[0])
+        return Detections(xyxy, conf, cls)
+
+    def __call__(self, source, **kwargs):
+        imgs = source if isinstance(source, list) else [source]
+        prepared = [self._letterbox(img) for img in imgs]
+        # BGR HWC uint8 -> RGB CHW float in [0, 1]
+        batch = np.stack([p[0][:, :, ::-1].transpose(2, 0, 1) for p in prepared]).astype(np.float32) / 255.0
+
+        if self.dynamic_batch:
+            outputs = self.session.run(None, {self.input_name: batch})[0]
+        else:
+            outputs = np.concatenate([self.session.run(None, {self.input_name: batch[i:i + 1]})[0]
+                                      for i in range(len(batch))])
+
+        return [self._postprocess(output, gain, pad, img.shape)
+                for output, (_, gain, pad), img in zip(outputs, prepared, imgs)]
+
+
+def onnx_path_for(model_path, int8=False):
+    base = os.path.splitext(model_path)[0]
+    return f"{base}.int8.onnx" if int8 else f"{base}.onnx"
+
+
+def resolve_model_file(model_path):
+    """
+    Pick the file and backend to serve a model from: the ONNX export when it
+    exists (and the backend allows it), otherwise the PyTorch weights.
+    Returns (path, backend_name).
+    """
+    if INFERENCE_BACKEND in ('auto', 'onnx'):
+        candidates = [onnx_path_for(model_path, int8=True)] if ONNX_INT8 else []
+        candidates.append(onnx_path_for(model_path))
+        for candidate in candidates:
+            if os.path.exists(candidate):
+                return candidate, 'onnx'
+        if INFERENCE_BACKEND == 'onnx':
+            print(f"No ONNX export for {model_path}, falling back to PyTorch")
+    return model_path, 'torch'
+
+
+def load_backend_model(path, backend):
+    if backend == 'onnx':
+        return OnnxModel(path)
+    return TorchModel(path)
@@ -0,0 +1,130 @@
+import socket
+import uuid
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from app.config import INFERENCE_SERVER_SOCKET, INFERENCE_SERVER_TIMEOUT
+from app.utils.inference_server import send_message, recv_message
+
+# Client side of the inference server (see inference_server). Mirrors
+# model_registry.get_models and yolo_utils.detect_body_parts so the pipeline
+# can use either; nothing here imports torch or loads a model.
+
+
+class InferenceServerUnavailable(ConnectionError):
+    pass
+
+
+class InferenceServerError(RuntimeError):
+    pass
+
+
+class RemoteModel:
+    """What the pipeline needs to know about a model loaded by the server."""
+
+    def __init__(self, body_part, info):
+        self.body_part = body_part
+        self.version = info['version']
+        self.backend = info['backend']
+        self.names = {int(k): v for k, v in info['names'].items()}
+
+
+def request(message, socket_path=None, timeout=None):
+    """
+    Send one request to the inference server and return its response.
+    Raises InferenceServerUnavailable if the server can't be reached, times
+    out or hangs up, and InferenceServerError for an unreadable or error reply.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout or INFERENCE_SERVER_TIMEOUT)
+    try:
+        try:
+            sock.connect(socket_path or INFERENCE_SERVER_SOCKET)
+        except OSError as e:
+            raise InferenceServerUnavailable(f"Inference server unavailable: {str(e)}")
+        try:
+            send_message(sock, message)
+            response = recv_message(sock)
+        except OSError as e:
+            # Timeouts, resets and replies cut short (ConnectionError)
+            raise InferenceServerUnavailable(f"Inference server did not answer: {str(e) or type(e).__name__}")
+        except ValueError as e:
+            raise InferenceServerError(f"Inference server sent an unreadable reply: {str(e)}")
+    finally:
+        sock.close()
+    if not isinstance(response, dict):
+        raise InferenceServerError("Inference server sent an unreadable reply")
+    if 'error' in response:
+        raise InferenceServerError(f"Inference server error: {response['error']}")
+    return response
+
+
+def get_models(warmup=True):
+    """Return (models, missing) like model_registry.get_models, as RemoteModel stand-ins."""
+    response = request({'op': 'models'})
+    models = {body_part: RemoteModel(body_part, info) for body_part, info in response['models'].items()}
+    return models, response['missing']
+
+
+def model_status(timeout=None):
+    """Like model_registry.model_status, for the server. Replicas only answer once warm."""
+    response = request({'op': 'models'}, timeout=timeout)
+    status = {body_part: 'warm' for body_part in response['models']}
+    status.update({body_part: 'missing' for body_part in response['missing']})
+    return status
+
+
+def server_stats():
+    """Router and result cache stats of the replica that answers."""
+    return request({'op': 'stats'})
+
+
+def detect_body_parts(images, models=None, hints=None, spacings=None):
+    """
+    Remote yolo_utils.detect_body_parts: same arguments (models is ignored, the
+    server uses its own) and the same (body_part, label, annotated_img,
+    confidence, detections) tuples.
+    """
+    from app.utils.yolo_utils import load_image
+    imgs = [load_image(image) for image in images]
+    outputs = [(None, None, None, 0.0, [])] * len(imgs)
+    valid = [i for i, img in enumerate(imgs) if img is not None]
+    if not valid:
+        return outputs
+
+    # One block per call: inputs first, then room for the annotated outputs
+    specs = []
+    offset = 0
+    for i in valid:
+        imgs[i] = np.ascontiguousarray(imgs[i], dtype=np.uint8)
+        specs.append({'shape': list(imgs[i].shape), 'offset': offset})
+        offset += imgs[i].nbytes
+    for spec, i in zip(specs, valid):
+        spec['out_offset'] = offset
+        offset += imgs[i].nbytes
+
+    shm = shared_memory.SharedMemory(name=f"ortho_{uuid.uuid4().hex[:16]}", create=True, size=offset)
+    try:
+        for spec, i in zip(specs, valid):
+            view = np.ndarray(imgs[i].shape, dtype=np.uint8, buffer=shm.buf, offset=spec['offset'])
+            view[...] = imgs[i]
+            del view
+
+        hints = hints or [None] * len(imgs)
+        spacings = spacings or [None] * len(imgs)
+        response = request({'op': 'detect', 'shm': shm.name, 'images': specs,
+                            'hints': [hints[i] for i in valid], 'spacings': [spacings[i] for i in valid]})
+
+        for spec, i, result in zip(specs, valid, response['results']):
+            annotated = None
+            if result['annotated']:
+                view = np.ndarray(imgs[i].shape, dtype=np.uint8, buffer=shm.buf, offset=spec['out_offset'])
+                annotated = view.copy()
+                del view
+            outputs[i] = (result['body_part'], result['label'], annotated,
+                          result['confidence'], result['detections'])
+    finally:
+        shm.close()
+        shm.unlink()
+    return outputs
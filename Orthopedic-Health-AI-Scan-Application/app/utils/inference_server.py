@@ -0,0 +1,187 @@
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from app.config import INFERENCE_SERVER_SOCKET, INFERENCE_SERVER_REPLICAS
+
+# Standalone inference server. It owns the detection models so web workers
+# and job workers never load torch or hold model weights:
+#
+#   python -m app.utils.inference_server --socket /tmp/ortho-inference.sock --replicas 2
+#
+# The master binds one UNIX socket and forks replica processes that accept on
+# it (the kernel spreads connections across them) and is restarted if one
+# dies. Each replica loads every model and serves requests on threads, so the
+# per-model locks and cross-request batching work as in a web worker.
+#
+# Messages are length-prefixed JSON, one request per connection. Pixels never
+# go through the socket: the client writes each image into a shared memory
+# block it owns, and the replica reads it in place and writes the annotated
+# image into the second half of the same block.
+
+_HEADER = struct.Struct('>I')
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode()
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed mid-message")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_message(sock):
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return json.loads(_recv_exact(sock, size))
+
+
+def attach_shared_memory(name):
+    """Attach to a block owned by another process without adopting its cleanup."""
+    shm = shared_memory.SharedMemory(name=name)
+    # Before Python 3.13 attaching also registers the block with this process's
+    # resource tracker, which would unlink it when the replica exits
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    return shm
+
+
+def _models_info(models, missing):
+    return {
+        'models': {body_part: {'version': model.version, 'backend': model.backend,
+                               'names': {str(k): v for k, v in model.names.items()}}
+                   for body_part, model in models.items()},
+        'missing': missing
+    }
+
+
+def handle_request(request):
+    from app.utils.model_registry import get_models
+    from app.utils.yolo_utils import detect_body_parts
+    from app.utils.body_part_router import router_stats
+    from app.utils.result_cache import cache_stats
+
+    op = request.get('op')
+    if op == 'models':
+        return _models_info(*get_models())
+    if op == 'stats':
+        return {'pid': os.getpid(), 'router': router_stats(), 'cache': cache_stats()}
+    if op != 'detect':
+        return {'error': f"Unknown op {op!r}"}
+
+    models, _ = get_models()
+    shm = attach_shared_memory(request['shm'])
+    try:
+        images = []
+        for spec in request['images']:
+            shape = tuple(spec['shape'])
+            images.append(np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=spec['offset']))
+
+        results = []
+        for spec, (body_part, label, annotated, conf, detections) in zip(
+                request['images'], detect_body_parts(images, models, request.get('hints'), request.get('spacings'))):
+            if annotated is not None:
+                # The annotated image has the input's shape; it goes in the output half
+                out = np.ndarray(annotated.shape, dtype=np.uint8, buffer=shm.buf, offset=spec['out_offset'])
+                out[...] = annotated
+                del out
+            results.append({
+                'body_part': body_part,
+                'label': label,
+                'confidence': conf,
+                'detections': detections,
+                'annotated': annotated is not None
+            })
+        del images
+        return {'results': results}
+    finally:
+        shm.close()
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            request = recv_message(self.request)
+        except (ConnectionError, ValueError):
+            return
+        try:
+            response = handle_request(request)
+        except Exception as e:
+            print(f"Inference request failed: {str(e)}")
+            response = {'error': str(e)}
+        send_message(self.request, response)
+
+
+class _ReplicaServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_replica(listener):
+    """Load and warm every model, then accept requests on the inherited socket."""
+    from app.utils.model_registry import warm_models
+    warm_models()
+    server = _ReplicaServer(listener.getsockname(), _Handler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = listener
+    print(f"Inference replica {os.getpid()} ready")
+    server.serve_forever()
+
+
+def serve(socket_path=INFERENCE_SERVER_SOCKET, replicas=INFERENCE_SERVER_REPLICAS):
+    """Bind the socket and keep `replicas` replica processes running."""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    os.chmod(socket_path, 0o660)
+    listener.listen(128)
+    # Exit through the finally below on SIGTERM so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Fork is safe here: the master never imports torch or loads a model
+    ctx = multiprocessing.get_context('fork')
+    processes = []
+    try:
+        while True:
+            processes = [p for p in processes if p.is_alive()]
+            for _ in range(replicas - len(processes)):
+                process = ctx.Process(target=serve_replica, args=(listener,), daemon=True)
+                process.start()
+                processes.append(process)
+            time.sleep(1)
+    finally:
+        listener.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve detection models to web and job workers")
+    parser.add_argument('--socket', default=INFERENCE_SERVER_SOCKET or '/tmp/ortho-inference.sock')
+    parser.add_argument('--replicas', type=int, default=INFERENCE_SERVER_REPLICAS)
+    args = parser.parse_args()
+    serve(args.socket, args.replicas)
+
+
+if __name__ == '__main__':
+    main()
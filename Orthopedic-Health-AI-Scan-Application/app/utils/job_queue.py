@@ -0,0 +1,307 @@
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from app.config import (
+    BASE_DIR, JOBS_DB_PATH, JOB_WORKERS, JOB_POLL_INTERVAL, JOB_STALE_SECONDS, JOB_HEARTBEAT_INTERVAL,
+    JOB_MAX_ATTEMPTS, JOB_SUPERVISE_INTERVAL, JOB_REQUEUE_INTERVAL, JOB_RETENTION_SECONDS
+)
+
+# Local job queue: jobs live in a SQLite table and are claimed by a pool of
+# worker processes. No external broker is needed; every process just opens
+# the same database file.
+#
+# The pool is owned by a supervisor (`python -m app.utils.job_queue`), which
+# restarts workers that die and puts back jobs they left running. Servers
+# start it as a plain subprocess: children started with multiprocessing
+# before gunicorn forks its workers are killed when any of those exits.
+# Running jobs are kept fresh by a heartbeat, so only jobs whose worker died
+# look stale; a job that took down its worker JOB_MAX_ATTEMPTS times is
+# failed. Finished jobs are deleted after JOB_RETENTION_SECONDS.
+
+# Job kind -> "module:function". Handlers are called as handler(payload, progress)
+# and return a JSON-serializable result.
+JOB_HANDLERS = {
+    'analyze_study': 'app.utils.pipeline:run_analysis_job'
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    progress INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+"""
+
+
+_initialized = False
+
+
+def _connect():
+    global _initialized
+    if not _initialized:
+        os.makedirs(os.path.dirname(JOBS_DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if not _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        # Databases created before attempts were counted
+        if 'attempts' not in {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}:
+            try:
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            except sqlite3.OperationalError:
+                pass    # added by another process meanwhile
+        _initialized = True
+    return conn
+
+
+def _execute(sql, params=()):
+    """Run one write statement on a fresh connection and return its row count."""
+    conn = _connect()
+    try:
+        return conn.execute(sql, params).rowcount
+    finally:
+        conn.close()
+
+
+def enqueue(kind, payload, total=0):
+    """Queue a job and return its ID."""
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    _execute(
+        "INSERT INTO jobs (id, kind, status, payload, total, created_at, updated_at) "
+        "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+        (job_id, kind, json.dumps(payload), total, now, now)
+    )
+    return job_id
+
+
+def get_job(job_id):
+    """Return a job as a dict (payload and result decoded), or None."""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    job = dict(row)
+    job['payload'] = json.loads(job['payload'])
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+def queue_depth():
+    conn = _connect()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def active_payloads():
+    """Payloads of queued and running jobs (their uploads must not be reaped)."""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT payload FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+    finally:
+        conn.close()
+    return [json.loads(row['payload']) for row in rows]
+
+
+def claim_next():
+    """Atomically move the oldest queued job to 'running', count the attempt and return it, or None."""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+            (time.time(), row['id'])
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return get_job(row['id'])
+
+
+def update_progress(job_id, progress, total=None):
+    if total is None:
+        _execute("UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?",
+                 (progress, time.time(), job_id))
+    else:
+        _execute("UPDATE jobs SET progress = ?, total = ?, updated_at = ? WHERE id = ?",
+                 (progress, total, time.time(), job_id))
+
+
+def heartbeat(job_id):
+    """Mark a running job as still alive."""
+    _execute("UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running'", (time.time(), job_id))
+
+
+def complete(job_id, result):
+    _execute(
+        "UPDATE jobs SET status = 'done', result = ?, progress = total, updated_at = ? WHERE id = ?",
+        (json.dumps(result), time.time(), job_id)
+    )
+
+
+def fail(job_id, error):
+    _execute("UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+             (error, time.time(), job_id))
+
+
+def requeue_stale():
+    """
+    Put back jobs left 'running' by a worker that died without finishing them,
+    or fail them once they have been attempted JOB_MAX_ATTEMPTS times.
+    Returns (requeued, failed) counts.
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        failed = conn.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? "
+            "WHERE status = 'running' AND updated_at < ? AND attempts >= ?",
+            (f"Worker died {JOB_MAX_ATTEMPTS} times running this job", now, now - JOB_STALE_SECONDS,
+             JOB_MAX_ATTEMPTS)
+        ).rowcount
+        requeued = conn.execute(
+            "UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running' AND updated_at < ?",
+            (now, now - JOB_STALE_SECONDS)
+        ).rowcount
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return requeued, failed
+
+
+def prune_finished(older_than):
+    """Delete done and failed jobs last updated before `older_than` (epoch seconds)."""
+    return _execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (older_than,))
+
+
+def _resolve(handler_path):
+    module_name, func_name = handler_path.split(':')
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def run_job(job):
+    handler = _resolve(JOB_HANDLERS[job['kind']])
+
+    def progress(done, total=None):
+        update_progress(job['id'], done, total)
+
+    # Long steps between progress updates must not make the job look stale
+    done = threading.Event()
+
+    def beat():
+        while not done.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                heartbeat(job['id'])
+            except Exception as e:
+                print(f"Error updating job {job['id']}: {str(e)}")
+
+    threading.Thread(target=beat, name='job-heartbeat', daemon=True).start()
+    try:
+        result = handler(job['payload'], progress)
+        complete(job['id'], result)
+    except Exception as e:
+        print(f"Job {job['id']} failed: {str(e)}")
+        fail(job['id'], str(e))
+    finally:
+        done.set()
+
+
+def worker_loop():
+    """Claim and run jobs until the supervisor is gone."""
+    print(f"Job worker {os.getpid()} started")
+    supervisor = os.getppid()
+    while os.getppid() == supervisor:
+        job = claim_next()
+        if job is None:
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        run_job(job)
+
+
+def _start_worker(ctx):
+    process = ctx.Process(target=worker_loop, daemon=True)
+    process.start()
+    return process
+
+
+def supervise(count=JOB_WORKERS, parent_pid=None):
+    """
+    Keep `count` workers running, and requeue stale jobs and delete old
+    finished ones every JOB_REQUEUE_INTERVAL seconds. Returns when
+    `parent_pid`, if given, exits. Workers are spawned, not forked, so they
+    never inherit torch state.
+    """
+    # Workers are daemonic: they are terminated when the supervisor exits
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    ctx = multiprocessing.get_context('spawn')
+    workers = [_start_worker(ctx) for _ in range(count)]
+    last_requeue = 0
+    while parent_pid is None or os.getppid() == parent_pid:
+        if time.time() - last_requeue >= JOB_REQUEUE_INTERVAL:
+            try:
+                requeued, failed = requeue_stale()
+                if requeued or failed:
+                    print(f"Requeued {requeued} stale jobs, failed {failed} after {JOB_MAX_ATTEMPTS} attempts")
+                prune_finished(time.time() - JOB_RETENTION_SECONDS)
+            except Exception as e:
+                print(f"Error requeuing stale jobs: {str(e)}")
+            last_requeue = time.time()
+        for i, process in enumerate(workers):
+            if not process.is_alive():
+                print(f"Job worker {process.pid} exited with code {process.exitcode}, restarting it")
+                workers[i] = _start_worker(ctx)
+        time.sleep(JOB_SUPERVISE_INTERVAL)
+
+
+def start_workers(count=JOB_WORKERS):
+    """Start the worker pool's supervisor as a subprocess that exits with this process."""
+    return subprocess.Popen([sys.executable, '-m', 'app.utils.job_queue', '--workers', str(count),
+                             '--parent-pid', str(os.getpid())], cwd=BASE_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run scan analysis job workers")
+    parser.add_argument('--workers', type=int, default=JOB_WORKERS, help="number of worker processes")
+    parser.add_argument('--parent-pid', type=int, help="exit when this process exits")
+    args = parser.parse_args()
+
+    supervise(args.workers, args.parent_pid)
+
+
+if __name__ == '__main__':
+    main()
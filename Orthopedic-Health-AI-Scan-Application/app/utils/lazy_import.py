@@ -0,0 +1,23 @@
+import importlib.util
+import sys
+
+# Deferred imports for heavy libraries on the app import path. A worker that
+# only serves pages, images or reports never pays for OpenCV; the module is
+# loaded on the first attribute access instead:
+#
+#   cv2 = lazy_module('cv2')
+
+
+def lazy_module(name):
+    """Return `name` as a module that is only executed when first used."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,313 @@
+import atexit
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from app.config import METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+# Minimal Prometheus instrumentation: counters, gauges and histograms rendered
+# in the text exposition format by render(). Recording a sample costs one lock
+# and a dict lookup.
+#
+# Every process keeps its own values. With METRICS_DIR set, a background
+# thread in each process that records samples writes its counters and
+# histograms to its own file there every METRICS_FLUSH_INTERVAL seconds (and
+# at exit), and render() sums the files of every process, live or exited, so
+# a scrape answered by any gunicorn worker covers all stages: requests, job
+# workers, the inference server and export workers. Values are at most one
+# flush interval old. What is not summed:
+#   - gauges set with Gauge.set stay per process,
+#   - `func` metrics are computed at scrape time by the process answering it.
+#     Those defined in app.py read shared state (job queue, reaper stats),
+#     except models_loaded, router_* and result_cache_*, which are those of
+#     the worker answering, or of the inference server replica it asks.
+# The directory is cleared when the server starts (clear_shared()).
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTE_BUCKETS = tuple(2 ** i * 1024 for i in range(4, 17, 2))   # 16 KiB .. 64 MiB
+
+_registry = []
+
+# This process's file in METRICS_DIR and whether its flusher runs; reset in forked children
+_process = {'path': None, 'flushing': False}
+_process_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    kind = 'untyped'
+    # Whether recorded values are written to METRICS_DIR and summed across processes
+    shared = True
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        """
+        `func`, if given, is called at scrape time and returns either a number
+        or a dict of label-value tuples to numbers; use it to export stats kept elsewhere.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.func = func
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def _snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def _add(total, value):
+        return total + value
+
+    def samples(self, values=None):
+        """Exposition lines for `values` (summed across processes), or this process's own."""
+        if self.func is not None:
+            values = self.func()
+            values = values if isinstance(values, dict) else {(): values}
+        elif values is None:
+            values = self._snapshot()
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples(values))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        if not _process['flushing']:
+            _start_flusher()
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+    shared = False
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+        if not _process['flushing']:
+            _start_flusher()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with-block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def timed(self, **labels):
+        """Decorator form of time()."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _snapshot(self):
+        with self._lock:
+            return {key: [list(counts), total, count] for key, (counts, total, count) in self._values.items()}
+
+    @staticmethod
+    def _add(total, value):
+        return [[a + b for a, b in zip(total[0], value[0])], total[1] + value[1], total[2] + value[2]]
+
+    def samples(self, values=None):
+        if values is None:
+            values = self._snapshot()
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = (('le', _number(bound)),)
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {count}"
+
+
+# --- Sharing across processes ---
+
+def flush(directory=None):
+    """Write this process's counters and histograms to its file in METRICS_DIR."""
+    directory = directory if directory is not None else METRICS_DIR
+    if not directory:
+        return
+    snapshot = {}
+    for metric in _registry:
+        if metric.shared and metric.func is None:
+            values = metric._snapshot()
+            if values:
+                snapshot[metric.name] = [[list(key), value] for key, value in values.items()]
+    with _process_lock:
+        if _process['path'] is None:
+            _process['path'] = os.path.join(directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+        path = _process['path']
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"Error writing metrics: {str(e)}")
+
+
+def _start_flusher():
+    """Start this process's flusher thread, on its first recorded sample."""
+    with _process_lock:
+        if _process['flushing']:
+            return
+        _process['flushing'] = True
+    if METRICS_DIR:
+        threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _after_fork():
+    # A forked child has its own values to report, and locks possibly held mid-fork
+    global _process_lock
+    _process_lock = threading.Lock()
+    _process.update(path=None, flushing=False)
+    for metric in _registry:
+        metric._lock = threading.Lock()
+        metric._values = {}
+
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(lambda: _process['flushing'] and flush())
+
+
+def shared_values(directory=None):
+    """{metric name: {labels: value}} summed over the files of every process in METRICS_DIR."""
+    directory = directory if directory is not None else METRICS_DIR
+    metrics = {metric.name: metric for metric in _registry if metric.shared and metric.func is None}
+    totals = {}
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith('.json')]
+    except FileNotFoundError:
+        return totals
+    for name in names:
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric_name, values in snapshot.items():
+            metric = metrics.get(metric_name)
+            if metric is None:
+                continue
+            merged = totals.setdefault(metric_name, {})
+            for key, value in values:
+                key = tuple(key)
+                merged[key] = metric._add(merged[key], value) if key in merged else value
+    return totals
+
+
+def clear_shared(directory=None):
+    """Delete every process's file, when the server (re)starts."""
+    directory = directory if directory is not None else METRICS_DIR
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def render(directory=None):
+    """All registered metrics in the Prometheus text exposition format."""
+    directory = directory if directory is not None else METRICS_DIR
+    totals = None
+    if directory:
+        try:
+            flush(directory)
+            totals = shared_values(directory)
+        except Exception as e:
+            print(f"Error reading shared metrics: {str(e)}")
+    blocks = []
+    for metric in _registry:
+        try:
+            values = totals.get(metric.name, {}) if totals is not None and metric.shared else None
+            blocks.append(metric.render(values))
+        except Exception as e:
+            print(f"Error collecting metric {metric.name}: {str(e)}")
+    return '\n'.join(blocks) + '\n'
+
+
+# --- Pipeline metrics ---
+
+UPLOAD_BYTES = Histogram('upload_size_bytes', 'Size of uploaded images', buckets=BYTE_BUCKETS)
+DECODE_SECONDS = Histogram('image_decode_seconds', 'Time to decode an uploaded image')
+INFERENCE_SECONDS = Histogram('model_inference_seconds', 'Time of one model forward pass over a batch',
+                              ['body_part'])
+ANNOTATE_SECONDS = Histogram('annotation_draw_seconds', 'Time to draw detections onto an image')
+IMAGE_SAVE_SECONDS = Histogram('image_save_seconds', 'Time to encode and write an image rendition',
+                               ['kind'])
+PDF_RENDER_SECONDS = Histogram('pdf_render_seconds', 'Time to render a PDF report')
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Latency of HTTP requests',
+                            ['method', 'endpoint', 'status'])
+
+DETECTIONS = Counter('detections_total', 'Detections returned by the pipeline', ['body_part', 'label'])
+MODEL_ERRORS = Counter('model_errors_total', 'Model calls that raised an exception', ['body_part'])
@@ -0,0 +1,165 @@
+import hashlib
+import os
+import threading
+import numpy as np
+
+from app.config import YOLO_MODELS, MODEL_WARMUP_IMGSZ
+from app.utils.batching import close_batcher
+from app.utils.inference_backend import resolve_model_file, load_backend_model
+
+# Process-wide registry: body_part -> SharedModel
+_models = {}
+_registry_lock = threading.Lock()
+_load_locks = {body_part: threading.Lock() for body_part in YOLO_MODELS}
+
+
+class SharedModel:
+    """A loaded detection model shared by all request threads of one worker.
+
+    Backends that are not thread-safe (Ultralytics predictors keep per-call
+    state) are serialized with a per-model lock. The file mtime is kept to
+    detect hot reloads.
+    """
+
+    def __init__(self, body_part, model_path, model, mtime, version=None, backend='torch'):
+        self.body_part = body_part
+        self.model_path = model_path
+        self.model = model
+        self.backend = backend
+        self.mtime = mtime
+        # Content hash of the weights file, used to key cached results
+        self.version = version
+        self.warm = False
+        self._lock = threading.Lock()
+
+    @property
+    def names(self):
+        return self.model.names
+
+    def __call__(self, source, **kwargs):
+        """Returns one inference_backend.Detections per input image."""
+        if self.model.thread_safe:
+            return self.model(source, **kwargs)
+        with self._lock:
+            return self.model(source, **kwargs)
+
+    def warmup(self):
+        """Run one dummy inference so the first real request doesn't pay for it."""
+        if self.warm:
+            return
+        dummy = np.zeros((MODEL_WARMUP_IMGSZ, MODEL_WARMUP_IMGSZ, 3), dtype=np.uint8)
+        self(dummy)
+        self.warm = True
+
+
+def file_hash(path):
+    """Short SHA-256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def _load(body_part, model_path, backend, mtime, warmup):
+    model = SharedModel(body_part, model_path, load_backend_model(model_path, backend),
+                        mtime, file_hash(model_path), backend)
+    if warmup:
+        model.warmup()
+    print(f"Loaded {body_part} model from {model_path} ({backend})")
+    return model
+
+
+def get_model(body_part, warmup=True):
+    """
+    Return the shared model for a body part, loading it on first use.
+    The ONNX export is served when present (see inference_backend), and the
+    model is reloaded if its file changed on disk since it was loaded.
+    Returns None if the model file does not exist.
+    """
+    model_path = YOLO_MODELS.get(body_part)
+    if model_path is None:
+        return None
+    model_path, backend = resolve_model_file(model_path)
+    try:
+        mtime = os.path.getmtime(model_path)
+    except OSError:
+        return None
+
+    current = _models.get(body_part)
+    if current is not None and current.model_path == model_path and current.mtime == mtime:
+        return current
+
+    with _load_locks[body_part]:
+        # Another thread may have (re)loaded it while we waited
+        current = _models.get(body_part)
+        if current is not None and current.model_path == model_path and current.mtime == mtime:
+            return current
+        model = _load(body_part, model_path, backend, mtime, warmup)
+        with _registry_lock:
+            _models[body_part] = model
+        if current is not None:
+            # Hot reload: the old model's batching thread would otherwise live on
+            close_batcher(current)
+        return model
+
+
+def get_models(warmup=True):
+    """
+    Return (models, missing): loaded models keyed by body part and the list
+    of body parts whose model file could not be found.
+    """
+    models = {}
+    missing = []
+    for body_part in YOLO_MODELS:
+        model = get_model(body_part, warmup=warmup)
+        if model is None:
+            missing.append(body_part)
+        else:
+            models[body_part] = model
+    return models, missing
+
+
+def loaded_models():
+    """Body part -> backend of the models loaded in this process."""
+    with _registry_lock:
+        return {body_part: model.backend for body_part, model in _models.items()}
+
+
+def preload_models():
+    """Deserialize every model without running inference (safe before fork)."""
+    return get_models(warmup=False)
+
+
+def warm_models():
+    """Load any missing models and run the warm-up inference on all of them."""
+    models, _ = get_models(warmup=False)
+    for model in models.values():
+        model.warmup()
+    return models
+
+
+def warm_models_in_background():
+    """Warm every model on a daemon thread so the worker can serve requests meanwhile."""
+    def warm():
+        try:
+            warm_models()
+        except Exception as e:
+            print(f"Model warm-up failed: {str(e)}")
+    thread = threading.Thread(target=warm, name='model-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def model_status():
+    """Body part -> 'warm', 'loaded', 'not loaded' or 'missing' (no model file) in this process."""
+    status = {}
+    for body_part, model_path in YOLO_MODELS.items():
+        model = _models.get(body_part)
+        if model is not None:
+            status[body_part] = 'warm' if model.warm else 'loaded'
+        elif os.path.exists(resolve_model_file(model_path)[0]):
+            status[body_part] = 'not loaded'
+        else:
+            status[body_part] = 'missing'
+    return status
@@ -1,14 +1,70 @@
 import os
+import tempfile
+import threading
+import cv2
+import numpy as np
 from fpdf import FPDF
 import unicodedata
 from datetime import datetime
-from app.config import findings_template, risks_template, tests_template, UPLOAD_FOLDER, PROCESSED_FOLDER
+from app.config import (
+    findings_template, risks_template, tests_template, UPLOAD_FOLDER, PROCESSED_FOLDER, REPORTS_FOLDER,
+    BASE_DIR, LOGO_PATH
+)
+from app.utils.metrics import PDF_RENDER_SECONDS
+
+LOGO_FILE = os.path.join(BASE_DIR, LOGO_PATH)
+LOGO_WIDTH_MM = 30
+LOGO_DPI = 300
+
+# Prepared once per process: (path of the print-sized logo, FPDF image info)
+_logo_resource = None
+_logo_lock = threading.Lock()
+
+
+def _prepare_logo():
+    """
+    Downscale the logo to its printed size, flattened onto the white page, and
+    parse it for FPDF once per process instead of once per report.
+    """
+    global _logo_resource
+    if _logo_resource is not None:
+        return _logo_resource
+    with _logo_lock:
+        if _logo_resource is not None:
+            return _logo_resource
+        img = cv2.imread(LOGO_FILE, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            _logo_resource = (None, None)
+            return _logo_resource
+
+        if img.ndim == 3 and img.shape[2] == 4:
+            alpha = img[:, :, 3:4].astype(np.float32) / 255.0
+            img = (img[:, :, :3] * alpha + 255 * (1 - alpha)).astype(np.uint8)
+        target_w = int(LOGO_WIDTH_MM / 25.4 * LOGO_DPI)
+        if img.shape[1] > target_w:
+            target_h = int(round(img.shape[0] * target_w / img.shape[1]))
+            img = cv2.resize(img, (target_w, target_h), interpolation=cv2.INTER_AREA)
+
+        path = os.path.join(tempfile.gettempdir(), f"report_logo_{os.getpid()}.jpg")
+        cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        # PyFPDF's parser; other FPDF flavours just parse the file on first use
+        info = FPDF()._parsejpg(path) if hasattr(FPDF, '_parsejpg') else None
+        _logo_resource = (path, info)
+        return _logo_resource
 
 
 class PDF(FPDF):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.logo_path, info = _prepare_logo()
+        # Seed the document's image table with the pre-parsed logo. FPDF drops
+        # 'data' from its entries on output, so each document gets its own copy.
+        if info is not None and isinstance(getattr(self, 'images', None), dict):
+            self.images[self.logo_path] = dict(info, i=len(self.images) + 1)
+
     def header(self):
-        if os.path.exists("app/logo.png"):
-            self.image("app/logo.png", 10, 10, 30)
+        if self.logo_path:
+            self.image(self.logo_path, 10, 10, LOGO_WIDTH_MM)
         self.set_xy(45, 10)
         self.set_font('Arial', 'B', 14)
         self.cell(0, 8, "THE SETV.G HOSPITAL", ln=True, align='L')
@@ -41,7 +97,125 @@ def _to_latin1(text):
         return text
     return unicodedata.normalize('NFKD', text).encode('latin-1', 'ignore').decode('latin-1')
 
-def generate_pdf_report(patient_info, selected_images_info, output_path=None):
+# Invariant report content, converted once per process
+DISCLAIMER_TEXT = _to_latin1(
+    "The scans show areas that could be fractures, dislocations, arthritis, "
+    "or no acute issues at all. To be sure, your doctor will review your history, examine you, "
+    "and may order additional tests or imaging. This summary is informational only and isn't "
+    "a substitute for professional medical advice. Please see a healthcare professional "
+    "for diagnosis and treatment."
+)
+
+SYMPTOMS_DATA = [[_to_latin1(cell) for cell in row] for row in [
+    ["Body Part", "Common Symptoms"],
+    ["Knee", "Joint pain, Swelling, Limited flexion/extension, Instability"],
+    ["Spine", "Back pain, Restricted movement, Radiculopathy, Postural changes"],
+    ["Heel", "Heel pain, Difficulty walking, Morning stiffness, Swelling"],
+    ["Wrist", "Wrist pain, Limited range of motion, Grip weakness, Swelling"]
+]]
+
+def render_static_sections(pdf):
+    """Disclaimer, symptoms table and signature block shared by every report."""
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 10, "Disclaimer:", ln=True)
+    pdf.set_font("Arial", "", 11)
+    pdf.multi_cell(0, 8, DISCLAIMER_TEXT)
+    
+    # Disease Symptoms Table
+    pdf.ln(5)
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 10, "Disease Symptoms Table:", ln=True)
+    pdf.ln(2)
+    
+    # Center the table
+    page_width = pdf.w
+    table_width = 170  # Total table width
+    x_offset = (page_width - table_width) / 2
+    pdf.set_x(x_offset)
+    
+    col_w = [40, 130]  # Adjusted column widths to match table_width
+    line_height = 8
+    pdf.set_font("Arial", "B", 10)
+    
+    # Header with background color
+    pdf.set_fill_color(230, 230, 230)
+    pdf.cell(col_w[0], line_height, SYMPTOMS_DATA[0][0], border=1, fill=True)
+    pdf.cell(col_w[1], line_height, SYMPTOMS_DATA[0][1], border=1, fill=True, ln=True)
+    
+    # Data rows
+    pdf.set_font("Arial", "", 10)
+    for row in SYMPTOMS_DATA[1:]:
+        pdf.set_x(x_offset)  # Reset X position for each row
+        pdf.cell(col_w[0], line_height, row[0], border=1)
+        pdf.multi_cell(col_w[1], line_height, row[1], border=1)
+    
+    pdf.ln(10)
+    
+    # Doctor's signature section
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 10, "Doctor's Comments:", ln=True)
+    pdf.set_font("Arial", "", 11)
+    pdf.multi_cell(0, 8, " ")
+    pdf.ln(5)
+    
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 10, "Signature: ____________________", ln=True)
+    pdf.set_font("Arial", "", 11)
+    pdf.cell(0, 8, "Name of Doctor: ", ln=True)
+    pdf.cell(0, 8, "Designation: ", ln=True)
+    pdf.cell(0, 8, "Contact No: +91 XXXXXXXXXX", ln=True)
+    pdf.ln(10)
+    
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 10, "*End of Report*", ln=True, align="C")
+
+def render_finding_sections(pdf, label):
+    """Findings, risks and recommended tests for one finding label."""
+    if label.startswith('knee osteoarthritis (') and label.endswith(')'):
+        base_label = label[label.find('(')+1:label.find(')')].strip()
+        findings = findings_template.get(base_label, "No findings available")
+        risks = risks_template.get(base_label, "No risks available")
+        tests = tests_template.get(base_label, "No tests available")
+        
+        # Section headers with consistent spacing
+        pdf.set_font("Arial", "B", 12)
+        pdf.cell(0, 10, _to_latin1(f"Findings for Knee Osteoarthritis ({base_label.title()}):"), ln=True)
+    else:
+        findings = findings_template.get(label, "No findings available")
+        risks = risks_template.get(label, "No risks available")
+        tests = tests_template.get(label, "No tests available")
+        
+        pdf.set_font("Arial", "B", 12)
+        pdf.cell(0, 10, _to_latin1(f"Findings for {label.title()}:"), ln=True)
+
+    # Add content with consistent margins and spacing
+    pdf.set_left_margin(20)
+    pdf.set_font("Arial", "", 11)
+    pdf.multi_cell(0, 8, _to_latin1(findings))
+    pdf.ln(5)
+    
+    pdf.set_font("Arial", "B", 12)
+    if label.startswith('knee osteoarthritis ('):
+        pdf.cell(0, 10, _to_latin1(f"Risks for Knee Osteoarthritis ({base_label.title()}):"), ln=True)
+    else:
+        pdf.cell(0, 10, _to_latin1(f"Risks for {label.title()}:"), ln=True)
+    pdf.set_font("Arial", "", 11)
+    pdf.multi_cell(0, 8, _to_latin1(risks))
+    pdf.ln(5)
+    
+    pdf.set_font("Arial", "B", 12)
+    if label.startswith('knee osteoarthritis ('):
+        pdf.cell(0, 10, _to_latin1(f"Recommended Tests for Knee Osteoarthritis ({base_label.title()}):"), ln=True)
+    else:
+        pdf.cell(0, 10, _to_latin1(f"Recommended Tests for {label.title()}:"), ln=True)
+    pdf.set_font("Arial", "", 11)
+    pdf.multi_cell(0, 8, _to_latin1(tests))
+    
+    pdf.set_left_margin(10)
+    pdf.ln(5)
+
+def build_pdf_report(patient_info, selected_images_info):
+    """Lay out the report and return the FPDF document (not yet serialized)."""
     pdf = PDF()
     pdf.add_page()
     pdf.set_font("Arial", "B", 16)
@@ -75,7 +249,12 @@ def generate_pdf_report(patient_info, selected_images_info, output_path=None):
         image_height = 90  
         x_offset = (page_width - image_width) / 2
 
-        annotated_abs_path = os.path.join(PROCESSED_FOLDER, img_info['annotated_path'].replace('processed/', ''))
+        # Embed the report-sized rendition when there is one, not the full-resolution file
+        annotated_rel_path = img_info.get('annotated_report_path') or img_info['annotated_path']
+        # Absolute paths (bulk_process output) are used as they are
+        if annotated_rel_path.startswith('processed/'):
+            annotated_rel_path = annotated_rel_path[len('processed/'):]
+        annotated_abs_path = os.path.join(PROCESSED_FOLDER, annotated_rel_path)
         if os.path.exists(annotated_abs_path):
             pdf.image(annotated_abs_path, x=x_offset, w=image_width, h=image_height)
             
@@ -85,46 +264,19 @@ def generate_pdf_report(patient_info, selected_images_info, output_path=None):
         pdf.line(20, pdf.get_y(), page_width-20, pdf.get_y())
         pdf.ln(5)
 
-        label = img_info['label']
-        if label.startswith('knee osteoarthritis (') and label.endswith(')'):
-            base_label = label[label.find('(')+1:label.find(')')].strip()
-            findings = findings_template.get(base_label, "No findings available")
-            risks = risks_template.get(base_label, "No risks available")
-            tests = tests_template.get(base_label, "No tests available")
-            
-            # Section headers with consistent spacing
-            pdf.set_font("Arial", "B", 12)
-            pdf.cell(0, 10, _to_latin1(f"Findings for Knee Osteoarthritis ({base_label.title()}):"), ln=True)
-        else:
-            findings = findings_template.get(label, "No findings available")
-            risks = risks_template.get(label, "No risks available")
-            tests = tests_template.get(label, "No tests available")
-            
+        detections = img_info.get('detections') or []
+        if len(detections) > 1:
+            # Every finding on the image, strongest first
             pdf.set_font("Arial", "B", 12)
-            pdf.cell(0, 10, _to_latin1(f"Findings for {label.title()}:"), ln=True)
+            pdf.cell(0, 10, _to_latin1("Detected findings:"), ln=True)
+            pdf.set_font("Arial", "", 11)
+            for detection in detections:
+                pdf.cell(0, 7, _to_latin1(f"- {detection['label'].title()}: confidence {detection['confidence']:.2f}, "
+                                          f"size {detection['size_mm']:.1f} mm"), ln=True)
+            pdf.ln(5)
 
-        # Add content with consistent margins and spacing
-        pdf.set_left_margin(20)
-        pdf.set_font("Arial", "", 11)
-        pdf.multi_cell(0, 8, _to_latin1(findings))
-        pdf.ln(5)
-        
-        pdf.set_font("Arial", "B", 12)
-        if label.startswith('knee osteoarthritis ('):
-            pdf.cell(0, 10, _to_latin1(f"Risks for Knee Osteoarthritis ({base_label.title()}):"), ln=True)
-        else:
-            pdf.cell(0, 10, _to_latin1(f"Risks for {label.title()}:"), ln=True)
-        pdf.set_font("Arial", "", 11)
-        pdf.multi_cell(0, 8, _to_latin1(risks))
-        pdf.ln(5)
-        
-        pdf.set_font("Arial", "B", 12)
-        if label.startswith('knee osteoarthritis ('):
-            pdf.cell(0, 10, _to_latin1(f"Recommended Tests for Knee Osteoarthritis ({base_label.title()}):"), ln=True)
-        else:
-            pdf.cell(0, 10, _to_latin1(f"Recommended Tests for {label.title()}:"), ln=True)
-        pdf.set_font("Arial", "", 11)
-        pdf.multi_cell(0, 8, _to_latin1(tests))
+        for label in img_info.get('labels') or [img_info['label']]:
+            render_finding_sections(pdf, label)
         
         # Reset margin and add section separator
         pdf.set_left_margin(10)
@@ -132,75 +284,21 @@ def generate_pdf_report(patient_info, selected_images_info, output_path=None):
         pdf.line(20, pdf.get_y(), page_width-20, pdf.get_y())
         pdf.ln(10)
 
-    # Add disclaimer and other content...
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 10, _to_latin1("Disclaimer:"), ln=True)
-    pdf.set_font("Arial", "", 11)
-    disclaimer_text = (
-        "The scans show areas that could be fractures, dislocations, arthritis, "
-        "or no acute issues at all. To be sure, your doctor will review your history, examine you, "
-        "and may order additional tests or imaging. This summary is informational only and isn't "
-        "a substitute for professional medical advice. Please see a healthcare professional "
-        "for diagnosis and treatment."
-    )
-    pdf.multi_cell(0, 8, _to_latin1(disclaimer_text))
-    
-    # Disease Symptoms Table
-    pdf.ln(5)
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 10, _to_latin1("Disease Symptoms Table:"), ln=True)
-    pdf.ln(2)
+    render_static_sections(pdf)
     
-    # Center the table
-    page_width = pdf.w
-    table_width = 170  # Total table width
-    x_offset = (page_width - table_width) / 2
-    pdf.set_x(x_offset)
+    return pdf
 
-    symptoms_data = [
-        ["Body Part", "Common Symptoms"],
-        ["Knee", "Joint pain, Swelling, Limited flexion/extension, Instability"],
-        ["Spine", "Back pain, Restricted movement, Radiculopathy, Postural changes"],
-        ["Heel", "Heel pain, Difficulty walking, Morning stiffness, Swelling"],
-        ["Wrist", "Wrist pain, Limited range of motion, Grip weakness, Swelling"]
-    ]
-    
-    col_w = [40, 130]  # Adjusted column widths to match table_width
-    line_height = 8
-    pdf.set_font("Arial", "B", 10)
-    
-    # Header with background color
-    pdf.set_fill_color(230, 230, 230)
-    pdf.cell(col_w[0], line_height, _to_latin1(symptoms_data[0][0]), border=1, fill=True)
-    pdf.cell(col_w[1], line_height, _to_latin1(symptoms_data[0][1]), border=1, fill=True, ln=True)
-    
-    # Data rows
-    pdf.set_font("Arial", "", 10)
-    for row in symptoms_data[1:]:
-        pdf.set_x(x_offset)  # Reset X position for each row
-        pdf.cell(col_w[0], line_height, _to_latin1(row[0]), border=1)
-        pdf.multi_cell(col_w[1], line_height, _to_latin1(row[1]), border=1)
-    
-    pdf.ln(10)
-    
-    # Doctor's signature section
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 10, _to_latin1("Doctor's Comments:"), ln=True)
-    pdf.set_font("Arial", "", 11)
-    pdf.multi_cell(0, 8, _to_latin1(" "))
-    pdf.ln(5)
-    
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 10, _to_latin1("Signature: ____________________"), ln=True)
-    pdf.set_font("Arial", "", 11)
-    pdf.cell(0, 8, _to_latin1("Name of Doctor: "), ln=True)
-    pdf.cell(0, 8, _to_latin1("Designation: "), ln=True)
-    pdf.cell(0, 8, _to_latin1("Contact No: +91 XXXXXXXXXX"), ln=True)
-    pdf.ln(10)
-    
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 10, _to_latin1("*End of Report*"), ln=True, align="C")
-    
+@PDF_RENDER_SECONDS.timed()
+def render_pdf_report(patient_info, selected_images_info):
+    """Render the report straight to memory and return the PDF bytes."""
+    pdf = build_pdf_report(patient_info, selected_images_info)
+    data = pdf.output(dest='S')
+    # PyFPDF returns a latin-1 str, fpdf2 returns a bytearray
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    return bytes(data)
+
+def generate_pdf_report(patient_info, selected_images_info, output_path=None):
     if output_path is None:
         os.makedirs(REPORTS_FOLDER, exist_ok=True)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -208,6 +306,7 @@ def generate_pdf_report(patient_info, selected_images_info, output_path=None):
         output_path = os.path.join(REPORTS_FOLDER, f"{pid}_report_{timestamp}.pdf")
     
     try:
+        pdf = build_pdf_report(patient_info, selected_images_info)
         pdf.output(output_path)
         return output_path
     except Exception as e:
@@ -0,0 +1,278 @@
+import os
+import uuid
+from werkzeug.utils import secure_filename
+
+from app.utils import report_store
+from app.utils.yolo_utils import decode_scan, read_scan, save_annotated_image_cv2
+from app.utils.inference_client import InferenceServerUnavailable, InferenceServerError
+from app.utils.derivatives import save_thumbnail, save_report_image
+from app.utils.dicom_io import DICOM_EXTENSIONS
+from app.utils.study_store import get_study_store
+from app.utils import study_index
+from app.utils.metrics import UPLOAD_BYTES
+from app.config import (
+    INFERENCE_SERVER_SOCKET, UPLOAD_FOLDER, PROCESSED_FOLDER, INFERENCE_MAX_BATCH,
+    findings_template, tests_template
+)
+
+# Scan analysis pipeline shared by the web request handlers and the job workers.
+# Functions report user-facing problems as (category, message) tuples so the
+# caller can flash them or store them with a job result.
+
+# Models live in the inference server when one is configured, else in this process
+if INFERENCE_SERVER_SOCKET:
+    from app.utils.inference_client import get_models, detect_body_parts
+else:
+    from app.utils.model_registry import get_models
+    from app.utils.yolo_utils import detect_body_parts
+
+
+def new_upload(filename):
+    """A unique name in UPLOAD_FOLDER for an upload: (safe filename, relative path, absolute path)."""
+    filename = secure_filename(filename)
+    unique_filename = f"{uuid.uuid4().hex}_{filename}"
+    return filename, f'uploads/{unique_filename}', os.path.join(UPLOAD_FOLDER, unique_filename)
+
+
+def store_upload(data, filename, decode=True):
+    """
+    Write an uploaded image (PNG/JPEG or DICOM) to UPLOAD_FOLDER under a unique
+    name. With decode=True the bytes are also decoded once and the pixel buffer
+    and pixel spacing are kept on the returned item for inference. Returns None
+    if undecodable.
+    """
+    UPLOAD_BYTES.observe(len(data))
+    filename, path, filepath = new_upload(filename)
+
+    image, spacing = None, None
+    if decode:
+        image, spacing = decode_scan(data)
+        if image is None:
+            return None
+
+    # Keep the original for display, but never read it back for inference
+    with open(filepath, 'wb') as f:
+        f.write(data)
+
+    # Store only the filename relative to UPLOAD_FOLDER, using forward slashes
+    return {
+        'filename': filename,
+        'path': path,
+        'image': image,
+        'pixel_spacing_cm': spacing
+    }
+
+
+def upload_abs_path(relative_path):
+    return os.path.join(UPLOAD_FOLDER, relative_path.replace('uploads/', '', 1))
+
+
+def analyze_batch(batch, models, hint=None):
+    """Auto-detect the body part of a batch of decoded uploads and save the annotations."""
+    uploaded_files = []
+    detections = detect_body_parts([item['image'] for item in batch], models, [hint] * len(batch),
+                                   [item.get('pixel_spacing_cm') for item in batch])
+    for item, (body_part, label, img, conf, findings) in zip(batch, detections):
+        if body_part:
+            # Generate unique filename for annotated image; DICOM uploads are annotated as JPEG
+            stem, ext = os.path.splitext(item['filename'])
+            annotated_name = f"{stem}.jpg" if ext[1:].lower() in DICOM_EXTENSIONS else item['filename']
+            unique_filename_annotated = f"annotated_{uuid.uuid4().hex}_{annotated_name}"
+            annotated_abs_path = os.path.join(PROCESSED_FOLDER, unique_filename_annotated)
+
+            # Save annotated image to the processed folder
+            saved_annotated_path = save_annotated_image_cv2(img, annotated_abs_path)
+
+            # Report-sized and thumbnail renditions, made once from the in-memory images
+            original_name = os.path.basename(item['path'])
+            uploaded_files.append({
+                'path': item['path'],
+                'thumb_path': save_thumbnail(item['image'], original_name),
+                'body_part': body_part,
+                'initial_detection': {
+                    'label': label,
+                    'confidence': conf,
+                    'box': findings[0]['box'],
+                    'size_mm': findings[0]['size_mm'],
+                    'detections': findings,
+                    'model_version': models[body_part].version,
+                    'annotated_img_path': f'processed/{unique_filename_annotated}' if saved_annotated_path else None,
+                    'annotated_report_path': save_report_image(img, unique_filename_annotated) if saved_annotated_path else None,
+                    'annotated_thumb_path': save_thumbnail(img, unique_filename_annotated) if saved_annotated_path else None
+                }
+            })
+    return uploaded_files
+
+
+def analyze_uploads(uploads, hint=None, progress=None, total=None):
+    """
+    Analyze stored uploads in batches of INFERENCE_MAX_BATCH so each model runs one
+    forward pass per batch. `uploads` may be a lazy iterable; at most one batch of
+    decoded images is held at a time. Items without a decoded 'image' are read
+    from disk. Returns (uploaded_files, messages).
+    """
+    messages = []
+
+    # Models are loaded once per process and shared across requests
+    try:
+        models, missing = get_models()
+    except InferenceServerUnavailable as e:
+        print(str(e))
+        return [], [('error', 'The analysis service is unavailable, please try again shortly')]
+    for body_part in missing:
+        messages.append(('error', f'YOLO model not found for {body_part}'))
+
+    uploaded_files = []
+    batch = []
+    done = 0
+
+    def flush():
+        nonlocal batch, done
+        if batch:
+            try:
+                uploaded_files.extend(analyze_batch(batch, models, hint))
+            except (InferenceServerUnavailable, InferenceServerError) as e:
+                print(str(e))
+                messages.append(('error', f'Could not analyze {len(batch)} images, please try again'))
+            done += len(batch)
+            batch = []
+        if progress:
+            progress(done, total)
+
+    for item in uploads:
+        if item.get('image') is None:
+            image, spacing = read_scan(upload_abs_path(item['path']))
+            item = dict(item, image=image, pixel_spacing_cm=spacing)
+            if item['image'] is None:
+                messages.append(('error', f"Could not decode image {item['filename']}"))
+                continue
+        batch.append(item)
+        if len(batch) >= INFERENCE_MAX_BATCH:
+            flush()
+    flush()
+    return uploaded_files, messages
+
+
+def result_labels(result):
+    """Distinct finding labels of a result, strongest first."""
+    labels = [d['label'] for d in result.get('detections') or []] or [result['label']]
+    return list(dict.fromkeys(labels))
+
+
+def join_templates(template, labels, default):
+    """Clinical text for every label that has an entry in `template`."""
+    texts = [template[label] for label in labels if label in template]
+    return '\n'.join(texts) if texts else default
+
+
+def build_img_results(uploaded_files):
+    """Turn analyzed uploads into the result entries shown on the page."""
+    img_results = []
+    for i, image_info in enumerate(uploaded_files):
+        image_path = image_info['path']
+        body_part = image_info['body_part']
+        initial_detection = image_info['initial_detection']
+
+        saved_path = initial_detection['annotated_img_path']
+
+        if saved_path:
+            detections = initial_detection.get('detections') or []
+            labels = result_labels({'label': initial_detection['label'], 'detections': detections})
+            result = {
+                'id': i,
+                'original_path': image_path,
+                'original_thumb_path': image_info.get('thumb_path'),
+                'annotated_path': saved_path,
+                'annotated_report_path': initial_detection.get('annotated_report_path'),
+                'annotated_thumb_path': initial_detection.get('annotated_thumb_path'),
+                'label': initial_detection['label'],
+                'body_part': body_part,
+                'confidence': initial_detection['confidence'],
+                'box': initial_detection.get('box'),
+                'size_mm': initial_detection.get('size_mm'),
+                'detections': detections,
+                'labels': labels,
+                'model_version': initial_detection.get('model_version'),
+                'type': 'image',
+                'findings': join_templates(findings_template, labels, 'No specific findings available'),
+                'tests': join_templates(tests_template, labels, 'No specific tests available')
+            }
+            img_results.append(result)
+    return img_results
+
+
+def report_images_info(img_results):
+    """The subset of each result that generate_pdf_report needs."""
+    return [{
+        'original_path': result['original_path'],
+        'annotated_path': result['annotated_path'],
+        'annotated_report_path': result.get('annotated_report_path'),
+        'label': result['label'],
+        'labels': result_labels(result),
+        'detections': result.get('detections') or []
+    } for result in img_results]
+
+
+def save_study(uploaded_files, img_results, patient_info=None, study_id=None):
+    """
+    Keep a study's results in the study store and add its detections to the
+    study index. Returns the study ID for the session. Pass study_id to fill
+    in a study created beforehand.
+    """
+    study = {
+        'uploaded_images': uploaded_files,
+        'img_results': img_results,
+        'patient_info': patient_info
+    }
+    if study_id:
+        get_study_store().update(study_id, study)
+    else:
+        study_id = get_study_store().create(study)
+    try:
+        study_index.record(study_id, (patient_info or {}).get('Patient_ID'), img_results, patient_info)
+    except Exception as e:
+        print(f"Error indexing study {study_id}: {str(e)}")
+    return study_id
+
+
+def create_report(patient_info, selected_images_info, sync=False):
+    """
+    Render a PDF report in memory and keep it in the report store.
+    Returns its filename, or None on failure. With sync=True the report is on
+    disk before returning, for callers in processes that don't serve downloads.
+    """
+    # fpdf is only imported by the processes that render reports
+    from app.utils.pdf_generator import render_pdf_report
+    report_filename = f"report_{uuid.uuid4().hex}.pdf"
+    try:
+        data = render_pdf_report(patient_info, selected_images_info)
+    except Exception as e:
+        print(f"Error generating PDF: {e}")
+        return None
+    report_store.put(report_filename, data, sync=sync)
+    return report_filename
+
+
+def run_analysis_job(payload, progress):
+    """
+    Job handler: analyze a stored study and generate its report.
+    payload holds 'uploads' (stored upload items), 'hint' and 'patient_info'.
+    """
+    uploads = payload['uploads']
+    uploaded_files, messages = analyze_uploads(uploads, payload.get('hint'), progress, len(uploads))
+    img_results = build_img_results(uploaded_files)
+    study_id = save_study(uploaded_files, img_results, payload.get('patient_info')) if img_results else None
+
+    report_filename = None
+    if payload.get('patient_info') and img_results:
+        report_filename = create_report(payload['patient_info'], report_images_info(img_results), sync=True)
+        if not report_filename:
+            messages.append(('error', 'Failed to automatically generate report.'))
+
+    return {
+        'study_id': study_id,
+        'uploaded_images': uploaded_files,
+        'img_results': img_results,
+        'report_filename': report_filename,
+        'messages': messages
+    }
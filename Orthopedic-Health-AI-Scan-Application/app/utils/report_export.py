@@ -0,0 +1,329 @@
+import fcntl
+import importlib.util
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.utils import secure_filename
+
+from app.config import EXPORTS_DB_PATH, EXPORT_WORKERS, EXPORT_STALE_SECONDS, REPORTS_FOLDER
+from app.utils import study_index
+
+# Bulk report export: render the PDF report of many studies at once (e.g. all
+# of yesterday's scans). Exports are queued in EXPORTS_DB_PATH and run one at
+# a time by a single coordinator process per node, which renders the reports
+# across one pool of EXPORT_WORKERS processes. Web workers spawn a coordinator
+# when they queue an export; the coordinator holds a file lock while it runs,
+# so any extra one waits for the lock and exits once the queue is empty. Job
+# workers are daemonic and may not start a pool of their own, hence the
+# separate coordinator. Every finished report is recorded, so any web worker
+# can report progress.
+#
+# A finished export downloads as a ZIP streamed from the rendered files, or
+# as one merged PDF ('merged', needs the optional pypdf package). Rendered
+# files live in REPORTS_FOLDER and expire with the other reports.
+
+FORMATS = ('zip', 'merged')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS exports (
+    id TEXT PRIMARY KEY,
+    format TEXT NOT NULL,
+    status TEXT NOT NULL,
+    merged_filename TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS export_items (
+    export_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    study_id TEXT NOT NULL,
+    patient_id TEXT,
+    status TEXT NOT NULL,
+    report_filename TEXT,
+    error TEXT,
+    PRIMARY KEY (export_id, position)
+);
+"""
+
+# Patient fields the report header expects, for studies saved without them
+EMPTY_PATIENT_INFO = {'Name': '', 'Age': '', 'Gender': '', 'Patient_ID': '',
+                      'Radiologist_Name': '', 'Radiologist_ID': ''}
+
+
+_initialized = False
+
+
+def _connect():
+    global _initialized
+    if not _initialized:
+        os.makedirs(os.path.dirname(EXPORTS_DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(EXPORTS_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if not _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _initialized = True
+    return conn
+
+
+def merge_available():
+    return importlib.util.find_spec('pypdf') is not None
+
+
+def create_export(studies, fmt='zip'):
+    """Record an export of `studies`, a list of (study_id, patient_id or None). Returns its ID."""
+    export_id = uuid.uuid4().hex
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN")
+        conn.execute("INSERT INTO exports (id, format, status, created_at, updated_at) "
+                     "VALUES (?, ?, 'queued', ?, ?)", (export_id, fmt, now, now))
+        conn.executemany(
+            "INSERT INTO export_items (export_id, position, study_id, patient_id, status) "
+            "VALUES (?, ?, ?, ?, 'queued')",
+            [(export_id, position, study_id, patient_id) for position, (study_id, patient_id) in enumerate(studies)])
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return export_id
+
+
+# This web worker's coordinator process, if it has one running
+_coordinator = None
+_coordinator_lock = threading.Lock()
+
+
+def start_export(export_id):
+    """
+    Make sure a coordinator will run the queued export `export_id`: spawn one
+    (non-daemonic) unless this process's last one is still running. A thread
+    joins it when it exits, so finished coordinators never linger as zombies.
+    """
+    global _coordinator
+    with _coordinator_lock:
+        if _coordinator is not None and _coordinator.is_alive():
+            return _coordinator
+        ctx = multiprocessing.get_context('spawn')
+        _coordinator = ctx.Process(target=run_coordinator, name='report-export')
+        _coordinator.start()
+        threading.Thread(target=_coordinator.join, daemon=True).start()
+        return _coordinator
+
+
+def _items(export_id, status=None):
+    query = "SELECT * FROM export_items WHERE export_id = ?"
+    params = [export_id]
+    if status:
+        query += " AND status = ?"
+        params.append(status)
+    with _connect() as conn:
+        return [dict(row) for row in conn.execute(query + " ORDER BY position", params).fetchall()]
+
+
+def _set_status(export_id, status, **fields):
+    assignments = ''.join(f", {column} = ?" for column in fields)
+    with _connect() as conn:
+        conn.execute(f"UPDATE exports SET status = ?, updated_at = ?{assignments} WHERE id = ?",
+                     (status, time.time(), *fields.values(), export_id))
+
+
+def _finish_item(export_id, position, status, report_filename=None, patient_id=None, error=None):
+    with _connect() as conn:
+        conn.execute("UPDATE export_items SET status = ?, report_filename = ?, "
+                     "patient_id = COALESCE(?, patient_id), error = ? WHERE export_id = ? AND position = ?",
+                     (status, report_filename, patient_id, error, export_id, position))
+        # Also the coordinator's heartbeat, see export_status
+        conn.execute("UPDATE exports SET updated_at = ? WHERE id = ?", (time.time(), export_id))
+
+
+def _write_report(filename, data):
+    path = os.path.join(REPORTS_FOLDER, filename)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def render_study_report(study_id, patient_id=None):
+    """Render one study's report into REPORTS_FOLDER (in a pool process). Returns (filename, patient ID)."""
+    from app.utils.study_store import get_study_store
+    from app.utils.pipeline import report_images_info
+    from app.utils.pdf_generator import render_pdf_report
+
+    # The index keeps studies after their session has released them; studies
+    # indexed before it kept their results are only in the study store
+    study = study_index.study(study_id) or get_study_store().get(study_id)
+    if study is None:
+        raise LookupError(f"Study {study_id} not found")
+    if not study.get('img_results'):
+        raise ValueError(f"Study {study_id} has no results")
+    patient_info = dict(EMPTY_PATIENT_INFO, Patient_ID=patient_id or '')
+    patient_info.update(study.get('patient_info') or {})
+    filename = f"report_{uuid.uuid4().hex}.pdf"
+    _write_report(filename, render_pdf_report(patient_info, report_images_info(study['img_results'])))
+    return filename, patient_info['Patient_ID'] or None
+
+
+def merge_reports(items, export_id):
+    """Concatenate the rendered reports into one PDF. Returns its filename."""
+    from pypdf import PdfWriter
+    writer = PdfWriter()
+    for item in items:
+        writer.append(os.path.join(REPORTS_FOLDER, item['report_filename']))
+    filename = f"export_{export_id}.pdf"
+    path = os.path.join(REPORTS_FOLDER, filename)
+    with open(f"{path}.tmp", 'wb') as f:
+        writer.write(f)
+    os.replace(f"{path}.tmp", path)
+    return filename
+
+
+def _claim_next():
+    """Mark the oldest queued export as running and return its ID, or None if there is none."""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT id FROM exports WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+        if row:
+            conn.execute("UPDATE exports SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), row['id']))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return row['id'] if row else None
+
+
+def run_coordinator(workers=EXPORT_WORKERS):
+    """Run queued exports one after another until there are none left, on a single node-wide pool."""
+    os.makedirs(os.path.dirname(EXPORTS_DB_PATH), exist_ok=True)
+    with open(f"{EXPORTS_DB_PATH}.lock", 'w') as lock:
+        # Blocks while another coordinator runs; it may miss exports queued as it exits
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with _connect() as conn:
+            # Holding the lock, no other coordinator is running: these were cut short
+            conn.execute("UPDATE exports SET status = 'queued' WHERE status = 'running'")
+        pool = None
+        try:
+            while True:
+                export_id = _claim_next()
+                if export_id is None:
+                    return
+                if pool is None:
+                    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+                if not run_export(export_id, pool):
+                    # A pool process died; the next export gets a new pool
+                    pool.shutdown(wait=False)
+                    pool = None
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+
+def run_export(export_id, pool):
+    """
+    Render every queued study of a (claimed) export across the coordinator's
+    pool. Returns False if the pool broke on the way.
+    """
+    with _connect() as conn:
+        export = conn.execute("SELECT * FROM exports WHERE id = ?", (export_id,)).fetchone()
+    pool_ok = True
+    try:
+        items = _items(export_id, status='queued')
+        futures = {pool.submit(render_study_report, item['study_id'], item['patient_id']): item['position']
+                   for item in items}
+        for future in as_completed(futures):
+            try:
+                filename, patient_id = future.result()
+                _finish_item(export_id, futures[future], 'done', filename, patient_id)
+            except BrokenProcessPool as e:
+                pool_ok = False
+                _finish_item(export_id, futures[future], 'failed', error=f"Report renderer crashed: {str(e)}")
+            except Exception as e:
+                print(f"Export {export_id}: {str(e)}")
+                _finish_item(export_id, futures[future], 'failed', error=str(e))
+
+        merged_filename = None
+        if export['format'] == 'merged':
+            done = _items(export_id, status='done')
+            if not done:
+                raise ValueError("No report could be rendered")
+            merged_filename = merge_reports(done, export_id)
+        _set_status(export_id, 'done', merged_filename=merged_filename)
+    except Exception as e:
+        print(f"Export {export_id} failed: {str(e)}")
+        _set_status(export_id, 'failed', error=str(e))
+        pool_ok = pool_ok and not isinstance(e, BrokenProcessPool)
+    return pool_ok
+
+
+def export_status(export_id):
+    """Progress of an export as a dict, or None if there is no such export."""
+    with _connect() as conn:
+        export = conn.execute("SELECT * FROM exports WHERE id = ?", (export_id,)).fetchone()
+        if export is None:
+            return None
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM export_items WHERE export_id = ? "
+                                   "GROUP BY status", (export_id,)).fetchall())
+    export = dict(export)
+    if export['status'] == 'running' and export['updated_at'] < time.time() - EXPORT_STALE_SECONDS:
+        # The coordinator died (e.g. a restart) without finishing
+        export['status'], export['error'] = 'failed', 'Export stopped making progress'
+        _set_status(export_id, 'failed', error=export['error'])
+    return {
+        'export_id': export_id,
+        'format': export['format'],
+        'status': export['status'],
+        'total': sum(counts.values()),
+        'done': counts.get('done', 0),
+        'failed': counts.get('failed', 0),
+        'failed_studies': [{'study_id': item['study_id'], 'error': item['error']}
+                           for item in _items(export_id, status='failed')],
+        'error': export['error'],
+        'merged_filename': export['merged_filename']
+    }
+
+
+class _ChunkSink:
+    """Write-only file object for zipfile; the bytes written are collected for streaming."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_zip(export_id, chunk_size=1024 * 1024):
+    """Stream a finished export as a ZIP of its reports, one chunk at a time."""
+    sink = _ChunkSink()
+    # PDFs are already compressed, so members are stored as they are
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+        for item in _items(export_id, status='done'):
+            name = f"{secure_filename(item['patient_id'] or '') or 'unknown'}/{item['study_id']}.pdf"
+            try:
+                src = open(os.path.join(REPORTS_FOLDER, item['report_filename']), 'rb')
+            except OSError:
+                # Expired and reaped since the export finished
+                continue
+            with src, archive.open(name, 'w') as dst:
+                for chunk in iter(lambda: src.read(chunk_size), b''):
+                    dst.write(chunk)
+                    yield sink.take()
+    yield sink.take()
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import REPORTS_FOLDER, REPORT_CACHE_BYTES, REPORTS_PERSIST, REPORT_PERSIST_WAIT
+
+# Rendered PDF reports kept in memory and served straight from the buffer.
+# With REPORTS_PERSIST they are also written to REPORTS_FOLDER by a background
+# thread (write-behind), so other processes and restarts can still serve them.
+
+_reports = OrderedDict()   # filename -> StoredReport
+_reports_bytes = 0
+_lock = threading.Lock()
+_write_queue = queue.Queue()
+_writer = None
+
+
+class StoredReport:
+    def __init__(self, data, created_at=None):
+        self.data = data
+        self.etag = hashlib.sha256(data).hexdigest()
+        self.created_at = created_at or time.time()
+
+
+def _remember(filename, report):
+    global _reports_bytes
+    with _lock:
+        if filename in _reports:
+            _reports_bytes -= len(_reports[filename].data)
+        _reports[filename] = report
+        _reports.move_to_end(filename)
+        _reports_bytes += len(report.data)
+        while _reports_bytes > REPORT_CACHE_BYTES and len(_reports) > 1:
+            _, evicted = _reports.popitem(last=False)
+            _reports_bytes -= len(evicted.data)
+
+
+def _write(filename, data):
+    path = os.path.join(REPORTS_FOLDER, filename)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error persisting report {filename}: {str(e)}")
+
+
+def _write_behind():
+    while True:
+        filename, data = _write_queue.get()
+        _write(filename, data)
+        _write_queue.task_done()
+
+
+def _start_writer():
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_behind, daemon=True)
+            _writer.start()
+
+
+def put(filename, data, sync=False):
+    """
+    Keep a rendered report in memory. It is persisted in the background, or
+    before returning with sync=True (e.g. from job workers in another process).
+    """
+    report = StoredReport(data)
+    _remember(filename, report)
+    if REPORTS_PERSIST:
+        if sync:
+            _write(filename, data)
+        else:
+            _start_writer()
+            _write_queue.put((filename, data))
+    return report
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(), os.path.getmtime(path)
+    except OSError:
+        return None, None
+
+
+def get(filename, wait=False):
+    """
+    Return the StoredReport for a filename from memory or disk, or None. With
+    wait=True and REPORTS_PERSIST, a report not on disk yet is waited for up
+    to REPORT_PERSIST_WAIT seconds: another process may still be writing it.
+    """
+    with _lock:
+        report = _reports.get(filename)
+        if report is not None:
+            _reports.move_to_end(filename)
+            return report
+
+    path = os.path.join(REPORTS_FOLDER, filename)
+    data, created_at = _read(path)
+    deadline = time.monotonic() + (REPORT_PERSIST_WAIT if wait and REPORTS_PERSIST else 0)
+    while data is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+        data, created_at = _read(path)
+    if data is None:
+        return None
+    report = StoredReport(data, created_at)
+    _remember(filename, report)
+    return report
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from app.config import (
+    RESULT_CACHE_ENABLED, RESULT_CACHE_FOLDER, RESULT_CACHE_MEMORY_BYTES,
+    RESULT_CACHE_DISK_BYTES, RESULT_CACHE_PRUNE_EVERY, FINDING_CONF_THRESHOLD, MAX_FINDINGS, TILED_INFERENCE
+)
+from app.utils.lazy_import import lazy_module
+
+cv2 = lazy_module('cv2')
+
+# Content-addressed cache of detection results. An entry is keyed by the hash
+# of the decoded pixels plus the versions of the models that produced it, and
+# holds the detection and the annotated JPEG. Entries live in a size-bounded
+# in-memory LRU and in an on-disk tier that survives restarts.
+
+_memory = OrderedDict()   # key -> (entry, annotated_jpeg)
+_memory_bytes = 0
+_lock = threading.Lock()
+_puts_since_prune = 0
+
+_stats = {
+    'memory_hits': 0,
+    'disk_hits': 0,
+    'misses': 0,
+    'stores': 0,
+    'memory_evictions': 0,
+    'disk_evictions': 0
+}
+
+
+def image_hash(img):
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(str(img.shape).encode())
+    digest.update(np.ascontiguousarray(img).data)
+    return digest.hexdigest()
+
+
+def cache_key(img_hash, models, hint=None, spacing=None):
+    """
+    Combine an image hash with the version of every model that can see it.
+    The pixel spacing changes the reported sizes, so it is part of the key too.
+    Returns None when some model has no version (its results can't be cached).
+    """
+    # Settings that change the output for the same image and models
+    versions = [f"findings={FINDING_CONF_THRESHOLD}/{MAX_FINDINGS}", f"tiled={TILED_INFERENCE}"]
+    for body_part, model in sorted(models.items()):
+        version = getattr(model, 'version', None)
+        if version is None:
+            return None
+        versions.append(f"{body_part}={version}")
+    key = f"{img_hash}|{','.join(versions)}|{hint or ''}"
+    if spacing is not None:
+        key += f"|spacing={tuple(float(v) for v in np.broadcast_to(spacing, 2))}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _disk_paths(key):
+    folder = os.path.join(RESULT_CACHE_FOLDER, key[:2])
+    return os.path.join(folder, f"{key}.json"), os.path.join(folder, f"{key}.jpg")
+
+
+def _remember(key, entry, jpeg):
+    """Insert into the memory tier and evict least recently used entries."""
+    global _memory_bytes
+    with _lock:
+        if key in _memory:
+            _memory_bytes -= len(_memory[key][1])
+        _memory[key] = (entry, jpeg)
+        _memory.move_to_end(key)
+        _memory_bytes += len(jpeg)
+        while _memory_bytes > RESULT_CACHE_MEMORY_BYTES and len(_memory) > 1:
+            _, (_, evicted) = _memory.popitem(last=False)
+            _memory_bytes -= len(evicted)
+            _stats['memory_evictions'] += 1
+
+
+def _count(stat):
+    with _lock:
+        _stats[stat] += 1
+
+
+def get(key):
+    """
+    Return (entry, annotated_img) for a cached result, or None.
+    entry holds body_part, label, confidence and box.
+    """
+    if not RESULT_CACHE_ENABLED or key is None:
+        return None
+
+    with _lock:
+        cached = _memory.get(key)
+        if cached is not None:
+            _memory.move_to_end(key)
+            _stats['memory_hits'] += 1
+    if cached is None:
+        json_path, jpg_path = _disk_paths(key)
+        try:
+            with open(json_path) as f:
+                entry = json.load(f)
+            with open(jpg_path, 'rb') as f:
+                jpeg = f.read()
+        except (OSError, ValueError):
+            _count('misses')
+            return None
+        # Touch the entry so disk pruning evicts least recently used first
+        os.utime(json_path)
+        _remember(key, entry, jpeg)
+        _count('disk_hits')
+        cached = (entry, jpeg)
+
+    entry, jpeg = cached
+    annotated_img = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return entry, annotated_img
+
+
+def put(key, entry, annotated_img):
+    """Store a detection and its annotated image in both tiers."""
+    global _puts_since_prune
+    if not RESULT_CACHE_ENABLED or key is None or annotated_img is None:
+        return
+    ok, buf = cv2.imencode('.jpg', annotated_img)
+    if not ok:
+        return
+    jpeg = buf.tobytes()
+    _remember(key, entry, jpeg)
+
+    json_path, jpg_path = _disk_paths(key)
+    try:
+        os.makedirs(os.path.dirname(json_path), exist_ok=True)
+        # Image first, so a readable .json always has its .jpg
+        tmp = f"{jpg_path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(jpeg)
+        os.replace(tmp, jpg_path)
+        tmp = f"{json_path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, json_path)
+    except OSError as e:
+        print(f"Error writing result cache entry: {str(e)}")
+        return
+
+    with _lock:
+        _stats['stores'] += 1
+        _puts_since_prune += 1
+        prune = _puts_since_prune >= RESULT_CACHE_PRUNE_EVERY
+        if prune:
+            _puts_since_prune = 0
+    if prune:
+        prune_disk()
+
+
+def prune_disk():
+    """Delete least recently used disk entries until the tier fits RESULT_CACHE_DISK_BYTES."""
+    entries = []
+    total = 0
+    for root, _, files in os.walk(RESULT_CACHE_FOLDER):
+        for name in files:
+            if not name.endswith('.json'):
+                continue
+            json_path = os.path.join(root, name)
+            jpg_path = json_path[:-len('.json')] + '.jpg'
+            try:
+                size = os.path.getsize(json_path) + os.path.getsize(jpg_path)
+                mtime = os.path.getmtime(json_path)
+            except OSError:
+                continue
+            entries.append((mtime, size, json_path, jpg_path))
+            total += size
+
+    entries.sort()
+    for _, size, json_path, jpg_path in entries:
+        if total <= RESULT_CACHE_DISK_BYTES:
+            break
+        for path in (json_path, jpg_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+        _count('disk_evictions')
+
+
+def cache_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats['memory_entries'] = len(_memory)
+        stats['memory_bytes'] = _memory_bytes
+    lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+    stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+    return stats
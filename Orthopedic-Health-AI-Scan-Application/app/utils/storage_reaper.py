@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from app.config import (
+    BASE_DIR, UPLOAD_FOLDER, PROCESSED_FOLDER, REPORTS_FOLDER,
+    STORAGE_REAPER_INTERVAL, STUDY_RETENTION_SECONDS, INDEXED_STUDY_RETENTION_SECONDS,
+    REPORT_RETENTION_SECONDS, ORPHAN_GRACE_SECONDS,
+    STORAGE_QUOTA_BYTES, STORAGE_REAPER_BATCH_SIZE, STORAGE_REAPER_BATCH_PAUSE, STORAGE_REAPER_STATS_PATH
+)
+from app.utils import job_queue, study_index
+from app.utils.study_store import get_study_store
+
+# Background storage reaper. Each run:
+#   1. expires studies not touched for STUDY_RETENTION_SECONDS, and prunes the
+#      kept results of studies indexed INDEXED_STUDY_RETENTION_SECONDS ago
+#      (see study_index; they keep exported studies' files after the session),
+#   2. releases the oldest studies, both their session study and their kept
+#      results, while uploads/ or processed/ is over quota. Only studies with
+#      files nothing else references are released,
+#   3. deletes files no live study, indexed study or pending job references
+#      (older than ORPHAN_GRACE_SECONDS, so uploads still being analyzed are
+#      kept),
+#   4. deletes reports past REPORT_RETENTION_SECONDS, oldest first over quota.
+# Deletes happen in batches with short pauses. Totals are written to
+# STORAGE_REAPER_STATS_PATH so the web processes can report them.
+#
+# Steps 1-3 need a study store shared across processes: with a process-local
+# one (STUDY_STORE_BACKEND='memory') the reaper would see no live studies, so
+# start_reaper refuses to start and reap only handles reports.
+
+FOLDERS = {
+    'uploads': UPLOAD_FOLDER,
+    'processed': PROCESSED_FOLDER,
+    'reports': REPORTS_FOLDER
+}
+
+
+def referenced_paths(value, paths=None):
+    """Collect every 'uploads/...' or 'processed/...' path in a study or job payload."""
+    if paths is None:
+        paths = set()
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            referenced_paths(item, paths)
+    elif isinstance(value, str) and value.startswith(('uploads/', 'processed/')):
+        paths.add(value)
+    return paths
+
+
+def scan_folder(prefix):
+    """Return {relative path: (size, mtime)} for the files directly in a storage folder."""
+    files = {}
+    try:
+        entries = list(os.scandir(FOLDERS[prefix]))
+    except FileNotFoundError:
+        return files
+    for entry in entries:
+        try:
+            # Dotfiles (.gitkeep and the like) are never reaped
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                files[f'{prefix}/{entry.name}'] = (stat.st_size, stat.st_mtime)
+        except OSError:
+            continue
+    return files
+
+
+def delete_files(relative_paths, files, stats):
+    """Delete files in batches, pausing between batches. Returns bytes reclaimed."""
+    reclaimed = 0
+    for start in range(0, len(relative_paths), STORAGE_REAPER_BATCH_SIZE):
+        if start:
+            time.sleep(STORAGE_REAPER_BATCH_PAUSE)
+        for relative_path in relative_paths[start:start + STORAGE_REAPER_BATCH_SIZE]:
+            prefix, name = relative_path.split('/', 1)
+            try:
+                os.remove(os.path.join(FOLDERS[prefix], name))
+            except FileNotFoundError:
+                # Already deleted, e.g. by delete_file
+                files.pop(relative_path)
+                continue
+            except OSError as e:
+                print(f"Error deleting {relative_path}: {str(e)}")
+                continue
+            size = files.pop(relative_path)[0]
+            reclaimed += size
+            stats['files_deleted'][prefix] = stats['files_deleted'].get(prefix, 0) + 1
+            stats['bytes_reclaimed'][prefix] = stats['bytes_reclaimed'].get(prefix, 0) + size
+    return reclaimed
+
+
+def folder_bytes(files, prefix):
+    return sum(size for path, (size, _) in files.items() if path.startswith(prefix + '/'))
+
+
+def reap_studies(store, files, stats, now):
+    """Steps 1-3: expire studies, release studies over quota, delete orphans."""
+    # 1. Retention
+    for study_id, _, _ in list(store.list_studies(updated_before=now - STUDY_RETENTION_SECONDS)):
+        store.delete(study_id)
+        stats['studies_expired'] += 1
+    stats['indexed_studies_expired'] += len(study_index.prune(now - INDEXED_STUDY_RETENTION_SECONDS))
+
+    # A study's files are held by its session study and by its kept results
+    held, updated = {}, {}
+    for source in (study_index.iter_studies(), store.list_studies()):
+        for study_id, data, updated_at in source:
+            held.setdefault(study_id, set()).update(referenced_paths(data))
+            updated[study_id] = max(updated_at, updated.get(study_id, 0))
+    holders = {}
+    for paths in held.values():
+        for path in paths:
+            holders[path] = holders.get(path, 0) + 1
+    pending = referenced_paths(job_queue.active_payloads())
+
+    # 2. Quota on study files: release the oldest studies until the folders fit,
+    # counting only the bytes actually deleted
+    for prefix in ('uploads', 'processed'):
+        excess = folder_bytes(files, prefix) - STORAGE_QUOTA_BYTES[prefix]
+        for study_id in sorted(held, key=updated.get):
+            if excess <= 0:
+                break
+            if study_id not in held:
+                continue
+            freed = [path for path in held[study_id]
+                     if path in files and holders[path] == 1 and path not in pending]
+            if not any(path.startswith(prefix + '/') for path in freed):
+                continue
+            store.delete(study_id)
+            study_index.prune(study_ids=[study_id])
+            for path in held.pop(study_id):
+                holders[path] -= 1
+            excess -= delete_files([path for path in freed if path.startswith(prefix + '/')], files, stats)
+            delete_files([path for path in freed if not path.startswith(prefix + '/')], files, stats)
+            stats['studies_released_for_quota'] += 1
+
+    # 3. Orphans
+    keep = pending.union(*held.values())
+    orphans = [path for path, (_, mtime) in files.items()
+               if not path.startswith('reports/') and path not in keep
+               and mtime < now - ORPHAN_GRACE_SECONDS]
+    delete_files(orphans, files, stats)
+
+
+def reap(now=None):
+    """Run one reaper pass and return its stats."""
+    now = now or time.time()
+    started = time.perf_counter()
+    store = get_study_store()
+    stats = {'studies_expired': 0, 'indexed_studies_expired': 0, 'studies_released_for_quota': 0,
+             'files_deleted': {}, 'bytes_reclaimed': {}}
+
+    files = {}
+    for prefix in FOLDERS:
+        files.update(scan_folder(prefix))
+
+    if store.shared:
+        reap_studies(store, files, stats, now)
+    else:
+        print("Storage reaper: the study store is not shared across processes, only reports are reaped")
+
+    # 4. Reports: retention, then quota, oldest first
+    reports = sorted((mtime, path) for path, (_, mtime) in files.items() if path.startswith('reports/'))
+    expired = [path for mtime, path in reports if mtime < now - REPORT_RETENTION_SECONDS]
+    delete_files(expired, files, stats)
+    excess = folder_bytes(files, 'reports') - STORAGE_QUOTA_BYTES['reports']
+    over_quota = []
+    for _, path in reports:
+        if excess <= 0:
+            break
+        if path in files:
+            excess -= files[path][0]
+            over_quota.append(path)
+    delete_files(over_quota, files, stats)
+
+    stats['folder_bytes'] = {prefix: folder_bytes(files, prefix) for prefix in FOLDERS}
+    stats['duration_s'] = time.perf_counter() - started
+    return stats
+
+
+def _merge_totals(stats):
+    """Add one run's stats to the running totals in STORAGE_REAPER_STATS_PATH."""
+    totals = reaper_stats()
+    totals['runs'] = totals.get('runs', 0) + 1
+    for key in ('studies_expired', 'indexed_studies_expired', 'studies_released_for_quota'):
+        totals[key] = totals.get(key, 0) + stats[key]
+    for key in ('files_deleted', 'bytes_reclaimed'):
+        merged = totals.setdefault(key, {})
+        for prefix, value in stats[key].items():
+            merged[prefix] = merged.get(prefix, 0) + value
+    totals['last_run'] = dict(stats, finished_at=time.time())
+
+    os.makedirs(os.path.dirname(STORAGE_REAPER_STATS_PATH), exist_ok=True)
+    tmp_path = f"{STORAGE_REAPER_STATS_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(totals, f)
+    os.replace(tmp_path, STORAGE_REAPER_STATS_PATH)
+    return totals
+
+
+def reaper_stats():
+    """Totals over all reaper runs (empty before the first run)."""
+    try:
+        with open(STORAGE_REAPER_STATS_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def run_once():
+    stats = reap()
+    _merge_totals(stats)
+    reclaimed = sum(stats['bytes_reclaimed'].values())
+    print(f"Storage reaper: {sum(stats['files_deleted'].values())} files, {reclaimed} bytes reclaimed, "
+          f"{stats['studies_expired'] + stats['studies_released_for_quota']} studies released, "
+          f"{stats['indexed_studies_expired']} indexed studies pruned")
+    return stats
+
+
+def reaper_loop(interval=STORAGE_REAPER_INTERVAL, parent_pid=None):
+    """Reap every `interval` seconds, until `parent_pid` (if given) exits."""
+    print(f"Storage reaper {os.getpid()} started")
+    next_run = 0
+    while parent_pid is None or os.getppid() == parent_pid:
+        if time.time() >= next_run:
+            try:
+                run_once()
+            except Exception as e:
+                print(f"Storage reaper failed: {str(e)}")
+            next_run = time.time() + interval
+        time.sleep(1)
+
+
+def start_reaper(interval=STORAGE_REAPER_INTERVAL):
+    """
+    Start the reaper in its own process, off the request path, as a plain
+    subprocess that exits with this one (see job_queue.start_workers).
+    Returns None without starting it when the study store is process-local.
+    """
+    if not get_study_store().shared:
+        print("Storage reaper not started: STUDY_STORE_BACKEND is not shared across processes")
+        return None
+    return subprocess.Popen([sys.executable, '-m', 'app.utils.storage_reaper', '--interval', str(interval),
+                             '--parent-pid', str(os.getpid())], cwd=BASE_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete expired studies and unreferenced files")
+    parser.add_argument('--once', action='store_true', help="run a single pass and exit")
+    parser.add_argument('--interval', type=int, default=STORAGE_REAPER_INTERVAL, help="seconds between runs")
+    parser.add_argument('--parent-pid', type=int, help="exit when this process exits")
+    args = parser.parse_args()
+
+    if args.once:
+        run_once()
+    else:
+        reaper_loop(args.interval, args.parent_pid)
+
+
+if __name__ == '__main__':
+    main()
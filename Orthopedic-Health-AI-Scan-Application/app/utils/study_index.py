@@ -0,0 +1,231 @@
+import json
+import os
+import sqlite3
+import time
+
+from app.config import STUDY_INDEX_DB_PATH, STUDY_INDEX_PAGE_SIZE, STUDY_INDEX_MAX_PAGE_SIZE
+
+# Persistent index of every detection, kept after sessions and studies are
+# gone. One row per detection; queried by patient, body part, label, date
+# range and confidence band with keyset pagination, newest first. Each
+# indexed study's results and patient info are kept too, so its report can be
+# rendered (see report_export) once the session's study has been released;
+# the storage reaper keeps every file they reference until it prunes them
+# (see prune). Pruned studies' detections stay queryable without their files.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    study_id TEXT NOT NULL,
+    patient_id TEXT,
+    body_part TEXT NOT NULL,
+    label TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER,
+    size_mm REAL,
+    model_version TEXT,
+    original_path TEXT,
+    annotated_path TEXT,
+    created_at REAL NOT NULL
+);
+-- One index per query shape. Each ends in created_at (and the implicit rowid)
+-- so filtered pages come out of the index already in (created_at, id) order.
+-- The unfiltered one also carries confidence, after id so the keyset order
+-- holds, letting confidence filters skip rows without reading them.
+DROP INDEX IF EXISTS idx_detections_created;
+CREATE INDEX IF NOT EXISTS idx_detections_created_confidence ON detections (created_at, id, confidence);
+CREATE INDEX IF NOT EXISTS idx_detections_patient ON detections (patient_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_detections_body_part ON detections (body_part, created_at);
+CREATE INDEX IF NOT EXISTS idx_detections_body_part_label ON detections (body_part, label, created_at);
+CREATE INDEX IF NOT EXISTS idx_detections_label ON detections (label, created_at);
+CREATE INDEX IF NOT EXISTS idx_detections_study ON detections (study_id);
+CREATE TABLE IF NOT EXISTS studies (
+    study_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_studies_created ON studies (created_at);
+"""
+
+COLUMNS = ('id', 'study_id', 'patient_id', 'body_part', 'label', 'confidence', 'x1', 'y1', 'x2', 'y2',
+           'size_mm', 'model_version', 'original_path', 'annotated_path', 'created_at')
+
+
+_initialized = False
+
+
+def _connect():
+    global _initialized
+    if not _initialized:
+        os.makedirs(os.path.dirname(STUDY_INDEX_DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(STUDY_INDEX_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if not _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _initialized = True
+    return conn
+
+
+def record(study_id, patient_id, img_results, patient_info=None):
+    """
+    Index the detections of a study's results (as built by build_img_results)
+    and keep the results and patient info for its report.
+    """
+    now = time.time()
+    rows = []
+    for result in img_results:
+        # One row per finding; results without a findings list hold just the top one
+        for detection in result.get('detections') or [result]:
+            box = detection.get('box') or (None, None, None, None)
+            rows.append((study_id, patient_id, result['body_part'], detection['label'], detection['confidence'],
+                         *box, detection.get('size_mm'), result.get('model_version'),
+                         result['original_path'], result['annotated_path'], now))
+    if not rows:
+        return
+    conn = _connect()
+    try:
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO detections (study_id, patient_id, body_part, label, confidence, x1, y1, x2, y2, "
+            "size_mm, model_version, original_path, annotated_path, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("INSERT OR REPLACE INTO studies (study_id, data, created_at) VALUES (?, ?, ?)",
+                     (study_id, json.dumps({'img_results': img_results, 'patient_info': patient_info}), now))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def forget(study_id, original_path):
+    """Drop the detections and kept result of an image the user deleted from a study."""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM detections WHERE study_id = ? AND original_path = ?",
+                     (study_id, original_path))
+        row = conn.execute("SELECT data FROM studies WHERE study_id = ?", (study_id,)).fetchone()
+        if row:
+            data = json.loads(row['data'])
+            data['img_results'] = [result for result in data['img_results']
+                                   if result['original_path'] != original_path]
+            if data['img_results']:
+                conn.execute("UPDATE studies SET data = ? WHERE study_id = ?", (json.dumps(data), study_id))
+            else:
+                conn.execute("DELETE FROM studies WHERE study_id = ?", (study_id,))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def study(study_id):
+    """The kept results and patient info of an indexed study, or None."""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT data FROM studies WHERE study_id = ?", (study_id,)).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row['data']) if row else None
+
+
+def iter_studies():
+    """Yield (study_id, kept data, created_at) of every indexed study (for the storage reaper)."""
+    conn = _connect()
+    try:
+        for row in conn.execute("SELECT study_id, data, created_at FROM studies"):
+            yield row['study_id'], json.loads(row['data']), row['created_at']
+    finally:
+        conn.close()
+
+
+def prune(older_than=None, study_ids=()):
+    """
+    Drop the kept results of the studies indexed before `older_than` (epoch
+    seconds) and of `study_ids`, and the file paths of their detections, so
+    their files can be reaped. Returns the IDs of the studies dropped.
+    """
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        ids = set(study_ids)
+        if older_than is not None:
+            ids.update(row['study_id'] for row in
+                       conn.execute("SELECT study_id FROM studies WHERE created_at < ?", (older_than,)))
+        rows = [(study_id,) for study_id in sorted(ids)]
+        conn.executemany("DELETE FROM studies WHERE study_id = ?", rows)
+        conn.executemany("UPDATE detections SET original_path = NULL, annotated_path = NULL "
+                         "WHERE study_id = ?", rows)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return sorted(ids)
+
+
+def study_ids(patient_id=None, since=None, until=None, limit=None):
+    """(study_id, patient_id) of the indexed studies created in a date range, oldest first."""
+    clauses, params = [], []
+    for clause, value in (("patient_id = ?", patient_id), ("created_at >= ?", since), ("created_at < ?", until)):
+        if value is not None:
+            clauses.append(clause)
+            params.append(value)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            f"SELECT study_id, patient_id, MIN(created_at) AS created_at FROM detections {where} "
+            "GROUP BY study_id ORDER BY created_at LIMIT ?", (*params, limit or -1)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [(row['study_id'], row['patient_id']) for row in rows]
+
+
+def encode_cursor(row):
+    return f"{row['created_at']!r}:{row['id']}"
+
+
+def decode_cursor(cursor):
+    created_at, row_id = cursor.split(':')
+    return float(created_at), int(row_id)
+
+
+def query(patient_id=None, body_part=None, label=None, since=None, until=None,
+          min_confidence=None, max_confidence=None, limit=None, cursor=None):
+    """
+    Return (detections, next_cursor), newest first. Dates are epoch seconds;
+    `cursor` is the next_cursor of the previous page. Raises ValueError for a
+    malformed cursor.
+    """
+    limit = max(1, min(limit or STUDY_INDEX_PAGE_SIZE, STUDY_INDEX_MAX_PAGE_SIZE))
+    clauses, params = [], []
+    for column, value in (('patient_id', patient_id), ('body_part', body_part), ('label', label)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    for clause, value in (("created_at >= ?", since), ("created_at < ?", until),
+                          ("confidence >= ?", min_confidence), ("confidence <= ?", max_confidence)):
+        if value is not None:
+            clauses.append(clause)
+            params.append(value)
+    if cursor:
+        # Keyset pagination: resume strictly after the last row of the previous page
+        clauses.append("(created_at, id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM detections {where} "
+            "ORDER BY created_at DESC, id DESC LIMIT ?", (*params, limit + 1)
+        ).fetchall()
+    finally:
+        conn.close()
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    detections = []
+    for row in rows[:limit]:
+        detection = dict(row)
+        detection['box'] = [detection.pop(key) for key in ('x1', 'y1', 'x2', 'y2')]
+        detections.append(detection)
+    return detections, next_cursor
@@ -0,0 +1,168 @@
+import importlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from app.config import STUDY_STORE_BACKEND, STUDIES_DB_PATH
+
+# Server-side storage for per-study results (detections, boxes and file paths).
+# The Flask session only carries the study ID. Backends implement StudyStore;
+# STUDY_STORE_BACKEND selects 'sqlite', 'memory' or a "module:Class" path.
+
+
+class StudyStore:
+    """Interface of a study store. Studies are JSON-serializable dicts."""
+
+    # Whether every process on the node sees the same studies. The storage
+    # reaper runs in its own process and only deletes unreferenced files when
+    # it can see the studies that reference them.
+    shared = True
+
+    def create(self, data):
+        """Store a new study and return its ID."""
+        raise NotImplementedError
+
+    def get(self, study_id):
+        """Return the study dict, or None if it does not exist."""
+        raise NotImplementedError
+
+    def update(self, study_id, data):
+        raise NotImplementedError
+
+    def delete(self, study_id):
+        raise NotImplementedError
+
+    def list_studies(self, updated_before=None):
+        """Yield (study_id, data, updated_at) for every study, optionally only older ones."""
+        raise NotImplementedError
+
+
+class MemoryStudyStore(StudyStore):
+    """Process-local store; only suitable for a single worker process."""
+
+    shared = False
+
+    def __init__(self):
+        self._studies = {}
+        self._lock = threading.Lock()
+
+    def create(self, data):
+        study_id = uuid.uuid4().hex
+        with self._lock:
+            self._studies[study_id] = (json.dumps(data), time.time())
+        return study_id
+
+    def get(self, study_id):
+        with self._lock:
+            stored = self._studies.get(study_id)
+        return json.loads(stored[0]) if stored else None
+
+    def update(self, study_id, data):
+        with self._lock:
+            self._studies[study_id] = (json.dumps(data), time.time())
+
+    def delete(self, study_id):
+        with self._lock:
+            self._studies.pop(study_id, None)
+
+    def list_studies(self, updated_before=None):
+        with self._lock:
+            items = list(self._studies.items())
+        for study_id, (data, updated_at) in items:
+            if updated_before is None or updated_at < updated_before:
+                yield study_id, json.loads(data), updated_at
+
+
+class SQLiteStudyStore(StudyStore):
+    """Studies as JSON rows in a SQLite database shared by all local processes."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS studies (
+        id TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_studies_updated ON studies (updated_at);
+    """
+
+    def __init__(self, path=STUDIES_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self.SCHEMA)
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def create(self, data):
+        study_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("INSERT INTO studies (id, data, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                         (study_id, json.dumps(data), now, now))
+        finally:
+            conn.close()
+        return study_id
+
+    def get(self, study_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT data FROM studies WHERE id = ?", (study_id,)).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+
+    def update(self, study_id, data):
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE studies SET data = ?, updated_at = ? WHERE id = ?",
+                         (json.dumps(data), time.time(), study_id))
+        finally:
+            conn.close()
+
+    def delete(self, study_id):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM studies WHERE id = ?", (study_id,))
+        finally:
+            conn.close()
+
+    def list_studies(self, updated_before=None):
+        conn = self._connect()
+        try:
+            if updated_before is None:
+                rows = conn.execute("SELECT id, data, updated_at FROM studies").fetchall()
+            else:
+                rows = conn.execute("SELECT id, data, updated_at FROM studies WHERE updated_at < ?",
+                                    (updated_before,)).fetchall()
+        finally:
+            conn.close()
+        for study_id, data, updated_at in rows:
+            yield study_id, json.loads(data), updated_at
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_study_store():
+    """Return the process-wide study store selected by STUDY_STORE_BACKEND."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if STUDY_STORE_BACKEND == 'sqlite':
+                    _store = SQLiteStudyStore()
+                elif STUDY_STORE_BACKEND == 'memory':
+                    _store = MemoryStudyStore()
+                else:
+                    module_name, class_name = STUDY_STORE_BACKEND.split(':')
+                    _store = getattr(importlib.import_module(module_name), class_name)()
+    return _store
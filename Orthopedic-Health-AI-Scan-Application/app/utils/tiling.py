@@ -0,0 +1,75 @@
+import numpy as np
+
+from app.config import TILED_INFERENCE, TILING, DETECTION_IOU_THRESHOLD, MAX_DETECTIONS
+from app.utils.batching import batched_predict
+from app.utils.inference_backend import Detections, batched_nms
+
+# Tiled (sliding-window) inference for very high-resolution radiographs. A
+# model sees its input at ~640 px, so small findings on a 4000x5000 film are
+# downsampled away. Images above a per-body-part pixel count are additionally
+# cut into overlapping tiles; the whole image and all tiles go through the
+# model in one batched call, and the tile boxes are shifted back to image
+# coordinates and merged with the whole-image boxes by per-class NMS.
+
+
+def tiling_for(body_part):
+    return TILING.get(body_part, TILING['default'])
+
+
+def tile_starts(length, tile, stride):
+    """Start offsets of tiles covering [0, length); the last tile ends at the edge."""
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+    return starts
+
+
+def make_tiles(img, tile, overlap):
+    """Return (tiles, origins): overlapping crops (views, not copies) and their (x, y) offsets."""
+    h, w = img.shape[:2]
+    stride = max(1, int(tile * (1 - overlap)))
+    tiles, origins = [], []
+    for y in tile_starts(h, tile, stride):
+        for x in tile_starts(w, tile, stride):
+            tiles.append(img[y:y + tile, x:x + tile])
+            origins.append((x, y))
+    return tiles, origins
+
+
+def merge_detections(parts, origins, iou_threshold=DETECTION_IOU_THRESHOLD, max_det=MAX_DETECTIONS):
+    """Shift each Detections by its (x, y) origin and merge them with per-class NMS."""
+    xyxy = np.concatenate([d.xyxy + np.array([x, y, x, y], dtype=np.float32)
+                           for d, (x, y) in zip(parts, origins)])
+    conf = np.concatenate([d.conf for d in parts])
+    cls = np.concatenate([d.cls for d in parts])
+    keep = batched_nms(xyxy, conf, cls, iou_threshold)[:max_det]
+    return Detections(xyxy[keep], conf[keep], cls[keep])
+
+
+def tiled_predict(model, imgs, body_part):
+    """
+    Drop-in replacement for batched_predict that tiles images larger than the
+    body part's `min_pixels`. Returns one Detections per image.
+    """
+    settings = tiling_for(body_part)
+    if not TILED_INFERENCE or all(img.shape[0] * img.shape[1] <= settings['min_pixels'] for img in imgs):
+        return batched_predict(model, imgs)
+
+    inputs = []
+    layout = []   # per image: (first input index, origins of its inputs)
+    for img in imgs:
+        origins = [(0, 0)]
+        inputs.append(img)
+        if img.shape[0] * img.shape[1] > settings['min_pixels']:
+            tiles, tile_origins = make_tiles(img, settings['tile'], settings['overlap'])
+            inputs.extend(tiles)
+            origins.extend(tile_origins)
+        layout.append((len(inputs) - len(origins), origins))
+
+    results = batched_predict(model, inputs)
+    merged = []
+    for start, origins in layout:
+        parts = results[start:start + len(origins)]
+        merged.append(parts[0] if len(parts) == 1 else merge_detections(parts, origins))
+    return merged
@@ -0,0 +1,203 @@
+import os
+import queue
+import threading
+
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+
+from app.config import INFERENCE_MAX_BATCH, UPLOAD_STREAM_CHUNK_SIZE
+from app.utils.inference_client import InferenceServerUnavailable, InferenceServerError
+from app.utils.metrics import UPLOAD_BYTES
+from app.utils.pipeline import new_upload, analyze_batch
+from app.utils.yolo_utils import read_scan
+
+# Streaming uploads (/api/uploads/stream). Instead of waiting for Werkzeug to
+# spool the whole multipart body, the request thread parses it as it arrives
+# and writes each image to UPLOAD_FOLDER chunk by chunk. As soon as an image's
+# part is complete it is queued for an analysis thread, which decodes it from
+# the file, so inference of one image overlaps the upload of the next and no
+# image is ever held in memory whole besides its decoded pixels. Images that
+# arrive while the models are busy are analyzed together, up to
+# INFERENCE_MAX_BATCH at a time.
+
+_END = object()
+
+
+def iter_multipart(stream, boundary, chunk_size=UPLOAD_STREAM_CHUNK_SIZE, max_form_memory_size=None,
+                   max_parts=None):
+    """
+    Parse a multipart/form-data body incrementally from `stream`. Yields
+    ('field', name, value) for complete form fields, and for files
+    ('file', name, filename), then ('data', chunk) as the bytes arrive and
+    ('end',) when the part is complete.
+    """
+    decoder = MultipartDecoder(boundary.encode(), max_form_memory_size, max_parts=max_parts)
+    part = None
+    field_data = []
+    while True:
+        chunk = stream.read(chunk_size)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, NeedData):
+            if isinstance(event, (Field, File)):
+                part, field_data = event, []
+                if isinstance(part, File):
+                    yield 'file', part.name, part.filename
+            elif isinstance(event, Data):
+                if isinstance(part, File):
+                    if event.data:
+                        yield 'data', event.data
+                    if not event.more_data:
+                        yield 'end',
+                else:
+                    field_data.append(event.data)
+                    if not event.more_data:
+                        yield 'field', part.name, b''.join(field_data).decode('utf-8', 'replace')
+            elif isinstance(event, Epilogue):
+                return
+            event = decoder.next_event()
+
+
+def _analyze(batch, models):
+    """Decode and analyze uploads whose parts are complete. Returns one record per upload."""
+    records = []
+    decoded = []
+    for item in batch:
+        abs_path = item.pop('abs_path')
+        try:
+            image, spacing = read_scan(abs_path)
+        except OSError as e:
+            print(f"Error reading streamed upload {abs_path}: {str(e)}")
+            image, spacing = None, None
+        if image is None:
+            # Like store_upload, keep nothing of an upload that isn't an image
+            try:
+                os.remove(abs_path)
+            except OSError as e:
+                print(f"Error removing undecodable upload {abs_path}: {str(e)}")
+            records.append(dict(item, status='error', error=f"Could not decode image {item['filename']}"))
+            continue
+        decoded.append(dict(item, image=image, pixel_spacing_cm=spacing))
+        records.append(None)
+
+    analyzed = {}
+    error = None
+    if decoded:
+        try:
+            analyzed = {entry['path']: entry for entry in analyze_batch(decoded, models, decoded[0]['hint'])}
+        except (InferenceServerUnavailable, InferenceServerError) as e:
+            print(str(e))
+            error = 'Could not analyze image, please try again'
+        except Exception as e:
+            print(f"Error analyzing streamed upload: {str(e)}")
+            error = 'Could not analyze image'
+
+    items = iter(decoded)
+    for i, record in enumerate(records):
+        if record is None:
+            item = next(items)
+            record = {'index': item['index'], 'filename': item['filename'], 'path': item['path']}
+            if error:
+                record.update(status='error', error=error)
+            elif item['path'] in analyzed:
+                record.update(status='ok', uploaded_file=analyzed[item['path']])
+            else:
+                record['status'] = 'no_finding'
+            records[i] = record
+    return records
+
+
+def _analysis_worker(pending, results, models):
+    """Analyze queued uploads until _END, batching those that share a hint."""
+    carry = None
+    try:
+        while True:
+            item = carry if carry is not None else pending.get()
+            carry = None
+            if item is _END:
+                return
+            if 'error' in item:
+                results.put(item)
+                continue
+            batch = [item]
+            while len(batch) < INFERENCE_MAX_BATCH:
+                try:
+                    queued = pending.get_nowait()
+                except queue.Empty:
+                    break
+                if queued is _END or 'error' in queued or queued['hint'] != item['hint']:
+                    carry = queued
+                    break
+                batch.append(queued)
+            for record in _analyze(batch, models):
+                results.put(record)
+    finally:
+        results.put(_END)
+
+
+def _ready(results):
+    while True:
+        try:
+            record = results.get_nowait()
+        except queue.Empty:
+            return
+        yield record
+
+
+def analyze_stream(parts, models, allowed, hint=None):
+    """
+    Store and analyze the images of a multipart upload while it is arriving.
+    `parts` comes from iter_multipart and `allowed(filename)` filters the
+    files. Yields one record per file, in upload order, as soon as it is
+    analyzed: 'index', 'filename', 'status' ('ok', 'no_finding' or 'error')
+    and, for 'ok', the analyzed 'uploaded_file' (see analyze_batch). A
+    'body_part_hint' field applies to the files after it.
+    """
+    pending, results = queue.Queue(), queue.Queue()
+    worker = threading.Thread(target=_analysis_worker, args=(pending, results, models),
+                              name='upload-stream', daemon=True)
+    worker.start()
+
+    index = 0
+    current = None
+    try:
+        try:
+            for event in parts:
+                if event[0] == 'field' and event[1] == 'body_part_hint':
+                    hint = event[2] or None
+                elif event[0] == 'file' and event[1] == 'images':
+                    filename = event[2]
+                    if allowed(filename):
+                        filename, path, abs_path = new_upload(filename)
+                        current = {'index': index, 'filename': filename, 'path': path, 'hint': hint,
+                                   'abs_path': abs_path, 'file': open(abs_path, 'wb'), 'size': 0}
+                    else:
+                        pending.put({'index': index, 'filename': filename, 'status': 'error',
+                                     'error': f"Unsupported file {filename}"})
+                    index += 1
+                elif event[0] == 'data' and current:
+                    # The original goes to disk while the rest of the body is still arriving
+                    current['file'].write(event[1])
+                    current['size'] += len(event[1])
+                elif event[0] == 'end' and current:
+                    current.pop('file').close()
+                    UPLOAD_BYTES.observe(current.pop('size'))
+                    pending.put(current)
+                    current = None
+                yield from _ready(results)
+        except (ValueError, RequestEntityTooLarge, ClientDisconnected) as e:
+            # Malformed, oversized or interrupted body: finish what has arrived
+            print(f"Streamed upload stopped: {str(e)}")
+            pending.put({'status': 'error', 'error': 'The upload was incomplete or too large'})
+        pending.put(_END)
+        while True:
+            record = results.get()
+            if record is _END:
+                return
+            yield record
+    finally:
+        pending.put(_END)
+        if current and 'file' in current:
+            # An image cut off mid-part is not kept
+            current['file'].close()
+            os.remove(current['abs_path'])
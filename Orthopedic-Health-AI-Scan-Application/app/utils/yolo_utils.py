@@ -1,7 +1,23 @@
-import cv2
-import math
+import numpy as np
 import tempfile
+import threading
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app.config import (
+    ROUTER_ACCEPT_CONFIDENCE, ANNOTATED_JPEG_QUALITY,
+    FINDING_CONF_THRESHOLD, MAX_FINDINGS, DETECTION_IOU_THRESHOLD,
+    MODEL_WORKERS, MODEL_DECISIVE_CONFIDENCE, DICOM_FRAME
+)
+from app.utils import body_part_router, result_cache, dicom_io
+from app.utils.tiling import tiled_predict
+from app.utils.inference_backend import batched_nms
+from app.utils.lazy_import import lazy_module
+from app.utils.metrics import (
+    DECODE_SECONDS, INFERENCE_SECONDS, ANNOTATE_SECONDS, IMAGE_SAVE_SECONDS, DETECTIONS, MODEL_ERRORS
+)
+
+cv2 = lazy_module('cv2')
 
 pixel_spacing_cm = 0.05
 
@@ -38,60 +54,183 @@ severity_thresholds = {
     }
 }
 
-def custom_yolo_annotate(image_path, model, body_part):
-    img = cv2.imread(image_path)
-    if img is None:
-        return "normal", None, 0.0, body_part
-        
-    results = model(image_path)[0]
-    if len(results.boxes) > 0:
-        best_box_idx = results.boxes.conf.argmax()
-        box = results.boxes[best_box_idx]
-        x1, y1, x2, y2 = map(int, box.xyxy[0])
-        conf = float(box.conf[0])
-        class_id = int(box.cls[0])
-        predicted_class = model.names[class_id]
-        
-        # Add "knee osteoarthritis" prefix for specific knee conditions
-        if body_part == 'knee' and predicted_class.lower() in ['doubtful', 'mild', 'moderate']:
-            predicted_class = f"knee osteoarthritis ({predicted_class})"
-        
-        width = x2 - x1
-        height = y2 - y1
-        size_mm = math.sqrt(width**2 + height**2) * pixel_spacing_cm * 10
-        
-        # Get condition-specific threshold
-        threshold = severity_thresholds.get(body_part, {}).get(predicted_class, 20.0)
-        box_color = (0, 0, 255) if size_mm > threshold else (0, 255, 0)
-        
-        label = f"{body_part}-{predicted_class}\nSize: {size_mm:.1f}mm\nConf: {conf:.2f}"
-        
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        font_scale = 0.6
-        thickness = 2
-        text_color = (255, 255, 255)
-        
+@DECODE_SECONDS.timed()
+def decode_image(data):
+    """Decode raw uploaded image bytes into a BGR array (None if undecodable)."""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if buf.size == 0:
+        return None
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+def decode_scan(data):
+    """
+    Decode uploaded bytes, a PNG/JPEG or a DICOM file, into (BGR array or None,
+    pixel spacing in cm or None). Only DICOM headers carry a pixel spacing.
+    """
+    if not dicom_io.is_dicom(data[:132]):
+        return decode_image(data), None
+    return _read_dicom(data)
+
+def read_scan(path):
+    """decode_scan for a file on disk; DICOM pixel data is memory-mapped, not read whole."""
+    with open(path, 'rb') as f:
+        header = f.read(132)
+        if not dicom_io.is_dicom(header):
+            return decode_image(header + f.read()), None
+    return _read_dicom(path)
+
+@DECODE_SECONDS.timed()
+def _read_dicom(source):
+    if not dicom_io.available():
+        print("Cannot read DICOM files: pydicom is not installed")
+        return None, None
+    try:
+        return dicom_io.read_dicom(source, DICOM_FRAME)
+    except Exception as e:
+        print(f"Error reading DICOM file: {str(e)}")
+        return None, None
+
+def load_image(image):
+    """Accept either a file path or an already decoded BGR array."""
+    if isinstance(image, np.ndarray):
+        return image
+    return cv2.imread(image)
+
+def class_label(model, class_id, body_part):
+    predicted_class = model.names[int(class_id)]
+
+    # Add "knee osteoarthritis" prefix for specific knee conditions
+    if body_part == 'knee' and predicted_class.lower() in ['doubtful', 'mild', 'moderate']:
+        predicted_class = f"knee osteoarthritis ({predicted_class})"
+    return predicted_class
+
+def best_box_from_results(results, model, body_part):
+    """Pick the highest-confidence box out of one image's Detections, or None."""
+    if len(results) == 0:
+        return None
+
+    best_box_idx = int(results.conf.argmax())
+    x1, y1, x2, y2 = map(int, results.xyxy[best_box_idx])
+    return {
+        'label': class_label(model, results.cls[best_box_idx], body_part),
+        'confidence': float(results.conf[best_box_idx]),
+        'box': (x1, y1, x2, y2)
+    }
+
+def detections_from_results(results, model, body_part, spacing_cm=None):
+    """
+    All findings in one image's Detections, strongest first: boxes at or above
+    FINDING_CONF_THRESHOLD after per-class NMS, capped at MAX_FINDINGS. The
+    strongest box is always kept, so there is a finding whenever
+    best_box_from_results has one. Sizes use the image's spacing_cm (see
+    detection_size_mm).
+    """
+    if len(results) == 0:
+        return []
+    keep = results.conf >= FINDING_CONF_THRESHOLD
+    keep[int(results.conf.argmax())] = True
+    xyxy, conf, cls = results.xyxy[keep], results.conf[keep], results.cls[keep]
+    order = batched_nms(xyxy, conf, cls, DETECTION_IOU_THRESHOLD)[:MAX_FINDINGS]
+
+    boxes = xyxy[order].astype(np.int64)
+    sizes = detection_size_mm(boxes, spacing_cm)
+    return [{
+        'label': class_label(model, class_id, body_part),
+        'confidence': float(score),
+        'box': tuple(int(v) for v in box),
+        'size_mm': float(size)
+    } for box, score, class_id, size in zip(boxes, conf[order], cls[order], sizes)]
+
+def predict_best_box(img, model, body_part):
+    """Run one model on a decoded image and return its highest-confidence box, or None."""
+    results = model(img)[0]
+    return best_box_from_results(results, model, body_part)
+
+def detection_size_mm(boxes, spacing_cm=None):
+    """
+    Diagonal in millimetres of a box, or of each row of an (N, 4) array of boxes.
+    spacing_cm is the image's pixel spacing, one value or a (row, column) pair
+    as read from DICOM headers; pixel_spacing_cm when the image has none.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    row_cm, col_cm = np.broadcast_to(pixel_spacing_cm if spacing_cm is None else spacing_cm, 2)
+    return np.hypot((boxes[..., 2] - boxes[..., 0]) * col_cm, (boxes[..., 3] - boxes[..., 1]) * row_cm) * 10
+
+SEVERE_COLOR = (0, 0, 255)
+NORMAL_COLOR = (0, 255, 0)
+
+@ANNOTATE_SECONDS.timed()
+def annotate_detections(img, detections, body_part, spacing_cm=None):
+    """
+    Draw detections (as returned by detections_from_results) onto img in place.
+    Sizes, severities and box outlines are computed for all boxes at once and
+    the outlines drawn with one polylines call per colour; only the text labels
+    are drawn box by box.
+    """
+    if not detections:
+        return img
+    boxes = np.array([d['box'] for d in detections], dtype=np.int32).reshape(-1, 4)
+    sizes = detection_size_mm(boxes, spacing_cm)
+
+    # Condition-specific thresholds
+    part_thresholds = severity_thresholds.get(body_part, {})
+    thresholds = np.array([part_thresholds.get(d['label'], 20.0) for d in detections])
+    severe = sizes > thresholds
+
+    x1, y1, x2, y2 = boxes.T
+    outlines = np.stack([np.stack([x1, y1], 1), np.stack([x2, y1], 1),
+                         np.stack([x2, y2], 1), np.stack([x1, y2], 1)], axis=1)
+
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 0.6
+    thickness = 2
+    text_color = (255, 255, 255)
+
+    # Weakest first, so the strongest finding's label ends up on top
+    for i in reversed(range(len(detections))):
+        box_color = SEVERE_COLOR if severe[i] else NORMAL_COLOR
+        label = f"{body_part}-{detections[i]['label']}\nSize: {sizes[i]:.1f}mm\nConf: {detections[i]['confidence']:.2f}"
+
         (text_w, text_h), baseline = cv2.getTextSize(label, font, font_scale, thickness)
-        
-        rect_x1 = x1
-        rect_y2 = y1 - 5
+
+        rect_x1 = int(x1[i])
+        rect_y2 = int(y1[i]) - 5
         rect_y1 = rect_y2 - (text_h + baseline + 10)
         rect_x2 = rect_x1 + text_w + 10
-        
+
         if rect_y1 < 0:
-            rect_y1 = y2 + 5
+            rect_y1 = int(y2[i]) + 5
             rect_y2 = rect_y1 + (text_h + baseline + 10)
-        
+
         cv2.rectangle(img, (rect_x1, rect_y1), (rect_x2, rect_y2), box_color, -1)
         cv2.putText(img, label, (rect_x1 + 5, rect_y2 - 5), font, font_scale, text_color, thickness)
-        cv2.rectangle(img, (x1, y1), (x2, y2), box_color, 2)
-        
-        return predicted_class.lower(), img, conf, body_part
-    else:
-        return "normal", img, 0.0, body_part
 
+    for flags, box_color in ((severe, SEVERE_COLOR), (~severe, NORMAL_COLOR)):
+        if flags.any():
+            cv2.polylines(img, list(outlines[flags]), True, box_color, 2)
+    return img
+
+def annotate_detection(img, detection, body_part):
+    """Draw a single detection (as returned by predict_best_box) onto img in place."""
+    return annotate_detections(img, [detection], body_part)
+
+def custom_yolo_annotate(image, model, body_part):
+    img = load_image(image)
+    if img is None:
+        return "normal", None, 0.0, body_part
 
+    # Draw on a copy so the decoded buffer can be shared between models
+    annotated = img.copy()
+    detections = detections_from_results(model(img)[0], model, body_part)
+    if not detections:
+        return "normal", annotated, 0.0, body_part
 
+    annotate_detections(annotated, detections, body_part)
+    return detections[0]['label'].lower(), annotated, detections[0]['confidence'], body_part
+
+
+
+@IMAGE_SAVE_SECONDS.timed(kind='annotated')
 def save_annotated_image_cv2(annotated_img, output_path=None):
     if annotated_img is None:
         return None
@@ -101,37 +240,193 @@ def save_annotated_image_cv2(annotated_img, output_path=None):
         output_path = temp_file.name
         temp_file.close()
     
-    success = cv2.imwrite(output_path, annotated_img)
+    params = []
+    if output_path.lower().endswith(('.jpg', '.jpeg')):
+        params = [cv2.IMWRITE_JPEG_QUALITY, ANNOTATED_JPEG_QUALITY]
+    success = cv2.imwrite(output_path, annotated_img, params)
     if success:
         return output_path
     else:
         return None
 
-def detect_body_part(image_path, models):
+def _run_detector(body_part, model, imgs, spacings):
+    """One model over a batch of images; returns its findings per image, or None on error."""
+    try:
+        with INFERENCE_SECONDS.time(body_part=body_part):
+            batch_results = tiled_predict(model, imgs, body_part)
+    except Exception as e:
+        print(f"Error processing {body_part} model: {str(e)}")
+        MODEL_ERRORS.inc(body_part=body_part)
+        return None
+    return [detections_from_results(results, model, body_part, spacing)
+            for results, spacing in zip(batch_results, spacings)]
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MODEL_WORKERS, thread_name_prefix='detector')
+        return _executor
+
+def _is_decisive(findings):
+    return (MODEL_DECISIVE_CONFIDENCE > 0 and findings is not None
+            and all(f and f[0]['confidence'] >= MODEL_DECISIVE_CONFIDENCE for f in findings))
+
+def _sweep(imgs, spacings, parts_by_image, models, best):
     """
-    Run image through all models and return the body part with highest confidence detection.
-    This function is designed to work with multiple models, each trained for a specific body part.
-    It iterates through all the models and returns the result from the model with the highest confidence score.
+    Run each model once over the images routed to it and keep, per image, the
+    findings of the model with the strongest detection. Returns the number of
+    detector runs per image.
+    With MODEL_WORKERS > 1 the models run concurrently in a thread pool (torch,
+    ONNX Runtime and OpenCV release the GIL). Once a model is decisive for all
+    of its images, models that share those images and have not started are skipped.
+    Findings are merged in model order either way, so ties resolve the same.
     """
-    best_confidence = 0
-    best_result = None
-    
+    tasks = {}
     for body_part, model in models.items():
-        try:
-            label, annotated_img, conf, _ = custom_yolo_annotate(image_path, model, body_part)
-            if conf > best_confidence:
-                best_confidence = conf
-                best_result = {
-                    'body_part': body_part,
-                    'label': label,
-                    'annotated_img': annotated_img,
-                    'confidence': conf
-                }
-        except Exception as e:
-            print(f"Error processing {body_part} model: {str(e)}")
+        indices = [i for i, parts in parts_by_image.items() if body_part in parts]
+        if indices:
+            tasks[body_part] = indices
+    outputs = {}
+    decisive = set()
+
+    if MODEL_WORKERS > 1 and len(tasks) > 1:
+        futures = {
+            _get_executor().submit(_run_detector, body_part, models[body_part],
+                                   [imgs[i] for i in indices], [spacings[i] for i in indices]): body_part
+            for body_part, indices in tasks.items()
+        }
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            body_part = futures[future]
+            outputs[body_part] = future.result()
+            if _is_decisive(outputs[body_part]):
+                decisive.update(tasks[body_part])
+                # Running models finish; queued ones whose images are all decided are dropped
+                for other, other_part in futures.items():
+                    if other_part not in outputs and set(tasks[other_part]) <= decisive:
+                        other.cancel()
+    else:
+        for body_part, indices in tasks.items():
+            if set(indices) <= decisive:
+                continue
+            outputs[body_part] = _run_detector(body_part, models[body_part], [imgs[i] for i in indices],
+                                               [spacings[i] for i in indices])
+            if _is_decisive(outputs[body_part]):
+                decisive.update(indices)
+
+    runs = [0] * len(imgs)
+    for body_part, indices in tasks.items():
+        if body_part not in outputs:
             continue
-    
-    if best_result:
-        return (best_result['body_part'], best_result['label'], 
-                best_result['annotated_img'], best_result['confidence'])
-    return None, None, None, 0.0
+        for i in indices:
+            runs[i] += 1
+        for i, detections in zip(indices, outputs[body_part] or []):
+            if not detections:
+                continue
+            if best[i] is None or detections[0]['confidence'] > best[i]['detection']['confidence']:
+                best[i] = {'body_part': body_part, 'detection': detections[0], 'detections': detections}
+    return runs
+
+def detect_body_parts(images, models, hints=None, spacings=None):
+    """
+    Batched version of detect_body_part.
+    Each image is first routed to its most likely body-part detectors (or to the
+    client-provided hint); every model sees all images routed to it in a single
+    forward pass. Images whose routed detectors find nothing confident fall back
+    to the remaining models. Returns one
+    (body_part, label, annotated_img, confidence, detections) tuple per input
+    image, where label and confidence are those of the strongest finding and
+    detections lists every finding (see detections_from_results).
+    spacings optionally gives each image's pixel spacing in cm (see
+    detection_size_mm), e.g. from its DICOM header.
+    """
+    imgs = [load_image(image) for image in images]
+    hints = hints or [None] * len(imgs)
+    spacings = spacings or [None] * len(imgs)
+    best = [None] * len(imgs)
+    outputs = [(None, None, None, 0.0, [])] * len(imgs)
+
+    # Serve repeated images from the result cache
+    keys = [None] * len(imgs)
+    for i, img in enumerate(imgs):
+        if img is None or not result_cache.RESULT_CACHE_ENABLED:
+            continue
+        keys[i] = result_cache.cache_key(result_cache.image_hash(img), models, hints[i], spacings[i])
+        cached = result_cache.get(keys[i])
+        if cached is not None:
+            entry, annotated_img = cached
+            # Entries cached before multi-detection output only hold the top box
+            detections = entry.get('detections') or [{
+                'label': entry['label'], 'confidence': entry['confidence'], 'box': entry['box'],
+                'size_mm': float(detection_size_mm(entry['box'], spacings[i]))
+            }]
+            outputs[i] = (entry['body_part'], entry['label'], annotated_img,
+                          entry['confidence'], detections)
+            imgs[i] = None
+
+    embeddings = {}
+    candidates = {}
+    full_sweep = {}
+    for i, img in enumerate(imgs):
+        if img is None:
+            continue
+        embeddings[i] = body_part_router.embed(img) if body_part_router.ROUTER_ENABLED else None
+        candidates[i], full_sweep[i] = body_part_router.route(embeddings[i], models, hints[i])
+
+    runs = _sweep(imgs, spacings, candidates, models, best)
+
+    # Fall back to the rest of the models when the routed ones were not conclusive
+    retry = {}
+    for i, parts in candidates.items():
+        if full_sweep[i]:
+            continue
+        if best[i] is None or best[i]['detection']['confidence'] < ROUTER_ACCEPT_CONFIDENCE:
+            retry[i] = [bp for bp in models if bp not in parts]
+    if retry:
+        for i, extra in enumerate(_sweep(imgs, spacings, retry, models, best)):
+            runs[i] += extra
+
+    for i in candidates:
+        hinted = hints[i] in models
+        swept = full_sweep[i] or i in retry
+        body_part_router.record(runs[i], routed=not swept and not hinted,
+                                hinted=hinted, fallback=swept and not hinted)
+        if swept and not hinted and best[i] is not None:
+            body_part_router.learn(embeddings[i], best[i]['body_part'],
+                                   best[i]['detection']['confidence'])
+
+    for i, best_result in enumerate(best):
+        if best_result:
+            body_part = best_result['body_part']
+            detection = best_result['detection']
+            annotated_img = annotate_detections(imgs[i].copy(), best_result['detections'], body_part, spacings[i])
+            # Labels are reported lower-cased, as the template lookups expect
+            detections = [dict(d, label=d['label'].lower()) for d in best_result['detections']]
+            outputs[i] = (body_part, detection['label'].lower(), annotated_img,
+                          detection['confidence'], detections)
+            result_cache.put(keys[i], {
+                'body_part': body_part,
+                'label': detection['label'].lower(),
+                'confidence': detection['confidence'],
+                'box': list(detection['box']),
+                'detections': detections
+            }, annotated_img)
+
+    for body_part, _, _, _, detections in outputs:
+        for detection in detections:
+            DETECTIONS.inc(body_part=body_part, label=detection['label'])
+    return outputs
+
+def detect_body_part(image, models, hint=None):
+    """
+    Run image through all models and return the body part with highest confidence detection.
+    `image` is either a file path or an already decoded BGR array; it is decoded at most
+    once and the same buffer is passed to every model. Only the winning detection is drawn.
+    Returns (body_part, label, annotated_img, confidence).
+    """
+    return detect_body_parts([image], models, [hint])[0][:4]
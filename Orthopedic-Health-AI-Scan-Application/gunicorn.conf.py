@@ -0,0 +1,38 @@
+# app.config is only imported inside the hooks: it reads the environment once,
+# and this file is loaded before gunicorn applies raw_env
+
+# Load the YOLO weights once in the master process and share them with workers
+preload_app = True
+raw_env = ['PRELOAD_MODELS=1']
+
+
+def on_starting(server):
+    # Metrics files of the previous run (see app.utils.metrics)
+    from app.utils.metrics import clear_shared
+    clear_shared()
+
+
+def when_ready(server):
+    from app.config import ASYNC_JOBS, STORAGE_REAPER_ENABLED
+    # One pool of analysis job workers per node, owned by the master
+    if ASYNC_JOBS:
+        from app.utils.job_queue import start_workers
+        start_workers()
+    # Likewise a single storage reaper per node
+    if STORAGE_REAPER_ENABLED:
+        from app.utils.storage_reaper import start_reaper
+        start_reaper()
+
+
+def post_worker_init(worker):
+    from app.config import INFERENCE_SERVER_SOCKET, WARMUP_IN_BACKGROUND
+    # Warm-up inference runs in each worker, after fork, so torch thread pools
+    # are never created in the master. Workers of an inference server hold no models.
+    if INFERENCE_SERVER_SOCKET:
+        return
+    from app.utils.model_registry import warm_models, warm_models_in_background
+    if WARMUP_IN_BACKGROUND:
+        # Serve (and answer /healthz) right away; /readyz reports when warm
+        warm_models_in_background()
+    else:
+        warm_models()
@@ -1,4 +1,20 @@
+import os
 from app.app import app
+from app.config import ASYNC_JOBS, STORAGE_REAPER_ENABLED, INFERENCE_SERVER_SOCKET, WARMUP_IN_BACKGROUND
 
 if __name__ == '__main__':
+    # With the debug reloader, only the child process that serves requests starts
+    # job workers and the storage reaper, and warms the models
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        from app.utils.metrics import clear_shared
+        clear_shared()
+        if ASYNC_JOBS:
+            from app.utils.job_queue import start_workers
+            start_workers()
+        if STORAGE_REAPER_ENABLED:
+            from app.utils.storage_reaper import start_reaper
+            start_reaper()
+        if WARMUP_IN_BACKGROUND and not INFERENCE_SERVER_SOCKET:
+            from app.utils.model_registry import warm_models_in_background
+            warm_models_in_background()
     app.run(host='0.0.0.0', port=5000, debug=True)
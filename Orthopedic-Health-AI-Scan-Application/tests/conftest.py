@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+# Tests don't share metrics through app/data
+os.environ.setdefault('METRICS_DIR', '')
+
+from app.utils import job_queue, pdf_generator, report_export, storage_reaper, study_index, study_store
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """Point the study store, index, job queue and storage folders at a temporary directory."""
+    folders = {name: str(tmp_path / name) for name in ('uploads', 'processed', 'reports')}
+    for folder in folders.values():
+        os.makedirs(folder)
+    monkeypatch.setattr(study_store, '_store', study_store.SQLiteStudyStore(str(tmp_path / 'studies.sqlite3')))
+    monkeypatch.setattr(study_index, 'STUDY_INDEX_DB_PATH', str(tmp_path / 'study_index.sqlite3'))
+    monkeypatch.setattr(study_index, '_initialized', False)
+    monkeypatch.setattr(job_queue, 'JOBS_DB_PATH', str(tmp_path / 'jobs.sqlite3'))
+    monkeypatch.setattr(job_queue, '_initialized', False)
+    monkeypatch.setattr(pdf_generator, 'PROCESSED_FOLDER', folders['processed'])
+    monkeypatch.setattr(report_export, 'REPORTS_FOLDER', folders['reports'])
+    monkeypatch.setattr(report_export, 'EXPORTS_DB_PATH', str(tmp_path / 'exports.sqlite3'))
+    monkeypatch.setattr(report_export, '_initialized', False)
+    monkeypatch.setattr(storage_reaper, 'FOLDERS', folders)
+    monkeypatch.setattr(storage_reaper, 'STORAGE_REAPER_BATCH_PAUSE', 0)
+    return folders
@@ -0,0 +1,48 @@
+import os
+
+from app.utils import batching, model_registry
+
+
+class FakeModel:
+    """Returns each image as its own result."""
+
+    def __init__(self, model_path=None, mtime=None):
+        self.model_path = model_path
+        self.mtime = mtime
+
+    def __call__(self, imgs):
+        return list(imgs)
+
+
+def test_close_stops_the_thread(monkeypatch):
+    monkeypatch.setattr(batching, 'INFERENCE_BATCH_WINDOW_MS', 5)
+    model = FakeModel()
+    assert batching.batched_predict(model, [1, 2]) == [1, 2]
+    batcher = batching._batchers[model]
+
+    batching.close_batcher(model)
+    batcher._thread.join(timeout=2)
+
+    assert not batcher._thread.is_alive()
+    # A caller still holding the closed batcher gets its results unbatched
+    assert batcher([3]) == [3]
+
+
+def test_hot_reload_closes_the_old_batcher(tmp_path, monkeypatch):
+    weights = tmp_path / 'knee.pt'
+    weights.write_bytes(b'weights')
+    monkeypatch.setitem(model_registry.YOLO_MODELS, 'knee', str(weights))
+    monkeypatch.setattr(model_registry, '_models', {})
+    monkeypatch.setattr(model_registry, '_load', lambda body_part, path, backend, mtime, warmup: FakeModel(path, mtime))
+    monkeypatch.setattr(model_registry, 'resolve_model_file', lambda path: (path, 'torch'))
+    monkeypatch.setattr(batching, 'INFERENCE_BATCH_WINDOW_MS', 5)
+
+    old = model_registry.get_model('knee')
+    batching.batched_predict(old, [1])
+    batcher = batching._batchers[old]
+    os.utime(weights, (0, 0))
+    new = model_registry.get_model('knee')
+    batcher._thread.join(timeout=2)
+
+    assert new is not old
+    assert not batcher._thread.is_alive()
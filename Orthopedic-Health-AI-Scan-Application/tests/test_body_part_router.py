@@ -0,0 +1,33 @@
+import numpy as np
+
+from app.utils import body_part_router
+
+
+def unit(seed):
+    vec = np.random.default_rng(seed).standard_normal(body_part_router.EMBEDDING_SIZE ** 2).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def save_as_other_worker(prototypes):
+    np.savez(body_part_router.ROUTER_PROTOTYPES_PATH,
+             **{key: value for body_part, (mean, count) in prototypes.items()
+                for key, value in ((body_part, mean), (f'{body_part}__count', np.array(count)))})
+
+
+def test_saves_merge_with_other_workers(tmp_path, monkeypatch):
+    path = str(tmp_path / 'router_prototypes.npz')
+    monkeypatch.setattr(body_part_router, 'ROUTER_PROTOTYPES_PATH', path)
+    monkeypatch.setattr(body_part_router, 'ROUTER_SAVE_EVERY', 1)
+    monkeypatch.setattr(body_part_router, '_prototypes', {})
+    monkeypatch.setattr(body_part_router, '_unsaved', {})
+    save_as_other_worker({'knee': (unit(0), 7)})
+
+    body_part_router.learn(unit(1), 'wrist', 0.9)
+    # Another worker saves more knee samples before this one learns its own
+    save_as_other_worker({'knee': (unit(0), 9), 'wrist': (unit(1), 1)})
+    body_part_router.learn(unit(0), 'knee', 0.9)
+
+    saved = body_part_router._read_prototypes()
+    assert {body_part: count for body_part, (_, count) in saved.items()} == {'knee': 10, 'wrist': 1}
+    assert np.allclose(saved['knee'][0], unit(0), atol=1e-5)
+    assert body_part_router.router_stats()['prototypes'] == {'knee': 10, 'wrist': 1}
@@ -0,0 +1,23 @@
+import os
+
+import cv2
+import numpy as np
+
+from app.bulk_process import output_name, parse_args, render_patient_report
+
+
+def test_reports_embed_images_with_relative_directories(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    args = parse_args(['archive', '--output', 'results.jsonl',
+                       '--annotated', 'out/annotated', '--reports', 'out/reports'])
+    annotated_path = output_name('PT1/knee.png', args.annotated)
+    cv2.imwrite(annotated_path, np.full((64, 64, 3), 128, np.uint8))
+    record = {'source': 'PT1/knee.png', 'annotated_path': annotated_path, 'label': 'fracture',
+              'labels': ['fracture'], 'detections': []}
+    os.makedirs(args.reports)
+
+    path = render_patient_report('PT1', [record], os.path.join(args.reports, 'PT1_report.pdf'))
+
+    with open(path, 'rb') as f:
+        # The 64 px scan, not just the header logo
+        assert b'/Width 64' in f.read()
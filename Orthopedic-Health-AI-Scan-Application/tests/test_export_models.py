@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.export_models import box_iou, check_parity
+from app.utils.inference_backend import Detections
+
+
+def test_box_iou():
+    assert box_iou((0, 0, 10, 10), (0, 0, 10, 10)) == 1.0
+    assert box_iou((0, 0, 10, 10), (20, 20, 30, 30)) == 0.0
+    assert box_iou((0, 0, 10, 10), (5, 0, 15, 10)) == pytest.approx(50 / 150)
+    # Degenerate boxes count as matching
+    assert box_iou((0, 0, 0, 0), (0, 0, 0, 0)) == 1.0
+
+
+def stub_model(*detections):
+    """A model returning the given Detections for successive images."""
+    outputs = iter(detections)
+    return lambda img: [next(outputs)]
+
+
+def images(tmp_path, count):
+    paths = []
+    for i in range(count):
+        paths.append(str(tmp_path / f'{i}.png'))
+        cv2.imwrite(paths[-1], np.zeros((8, 8, 3), np.uint8))
+    return paths
+
+
+def test_matching_backends_pass(tmp_path):
+    found = Detections([(10, 10, 50, 50), (0, 0, 5, 5)], [0.9, 0.3], [1, 0])
+    close = Detections([(10, 10, 50, 51), (0, 0, 5, 5)], [0.89, 0.3], [1, 0])
+
+    assert check_parity(stub_model(found, Detections.empty()), stub_model(close, Detections.empty()),
+                        images(tmp_path, 2)) == []
+
+
+def test_drift_is_reported(tmp_path):
+    expected = Detections([(10, 10, 50, 50)], [0.9], [1])
+    paths = images(tmp_path, 4)
+    torch_model = stub_model(expected, expected, expected, expected)
+    onnx_model = stub_model(Detections([(10, 10, 50, 50)], [0.9], [2]),
+                            Detections([(10, 10, 50, 50)], [0.8], [1]),
+                            Detections([(30, 30, 70, 70)], [0.9], [1]),
+                            Detections.empty())
+
+    problems = check_parity(torch_model, onnx_model, paths)
+
+    assert [problem.split(': ', 1)[0] for problem in problems] == paths
+    assert 'class 1 vs 2' in problems[0]
+    assert 'confidence differs by 0.100' in problems[1]
+    assert 'box IoU' in problems[2]
+    assert '1 PyTorch vs 0 ONNX detections' in problems[3]
+
+
+def test_int8_tolerates_more_drift(tmp_path):
+    expected = Detections([(10, 10, 50, 50)], [0.9], [1])
+    quantized = Detections([(10, 10, 50, 54)], [0.85], [1])
+
+    assert check_parity(stub_model(expected), stub_model(quantized), images(tmp_path, 1))
+    assert check_parity(stub_model(expected), stub_model(quantized), images(tmp_path, 1), int8=True) == []
+
+
+def test_unreadable_images_are_skipped(tmp_path):
+    path = tmp_path / 'broken.png'
+    path.write_bytes(b'not an image')
+
+    assert check_parity(stub_model(), stub_model(), [str(path)]) == []
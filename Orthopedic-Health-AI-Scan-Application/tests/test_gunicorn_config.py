@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+
+from app.config import BASE_DIR
+
+# Load gunicorn.conf.py the way the gunicorn CLI does, then apply raw_env the
+# way the arbiter does before preloading the app
+LOAD_CONFIG = """
+import os, sys
+from gunicorn.app.wsgiapp import WSGIApplication
+sys.argv = ['gunicorn', '-c', 'gunicorn.conf.py', 'run:app']
+application = WSGIApplication()
+loaded_early = 'app.config' in sys.modules
+for key, value in application.cfg.env.items():
+    os.environ[key] = value
+from app import config
+print(loaded_early, config.PRELOAD_MODELS)
+"""
+
+
+def test_preload_models_is_on_under_gunicorn_config():
+    env = {key: value for key, value in os.environ.items() if key != 'PRELOAD_MODELS'}
+    out = subprocess.run([sys.executable, '-c', LOAD_CONFIG], cwd=BASE_DIR, env=env,
+                         capture_output=True, text=True, check=True)
+    assert out.stdout.split() == ['False', 'True']
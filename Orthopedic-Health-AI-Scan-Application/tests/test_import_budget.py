@@ -0,0 +1,23 @@
+from app.import_budget import measure, slowest_imports
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:       297 |        297 |   _io
+import time:      1200 |     250000 |     flask
+import time:       800 |     419000 | app.app
+not an importtime line
+import time:        62 |         62 |   marshal
+""".splitlines()
+
+
+def test_slowest_imports_parses_importtime_output():
+    # Names keep their indentation, which shows the import nesting
+    assert slowest_imports(IMPORTTIME, count=2) == [(0.419, ' app.app'), (0.25, '     flask')]
+    assert [name.strip() for _, name in slowest_imports(IMPORTTIME)] == ['app.app', 'flask', '_io', 'marshal']
+
+
+def test_app_import_defers_heavy_modules():
+    result, importtime_lines = measure()
+
+    assert result['loaded'] == []
+    assert 'app.app' in [name.strip() for _, name in slowest_imports(importtime_lines, count=len(importtime_lines))]
@@ -0,0 +1,55 @@
+import socket
+import struct
+import threading
+
+import pytest
+
+from app.utils.inference_client import InferenceServerError, InferenceServerUnavailable, request
+from app.utils.inference_server import recv_message
+
+
+def serve_once(path, reply):
+    """Accept one connection on a Unix socket, read the request and answer with reply(conn)."""
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+
+    def handle():
+        conn, _ = listener.accept()
+        with conn:
+            recv_message(conn)
+            reply(conn)
+        listener.close()
+
+    thread = threading.Thread(target=handle, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_stalled_server(tmp_path):
+    path = str(tmp_path / 'inference.sock')
+    done = threading.Event()
+    thread = serve_once(path, lambda conn: done.wait(5))
+
+    with pytest.raises(InferenceServerUnavailable):
+        request({'op': 'models'}, socket_path=path, timeout=0.2)
+    done.set()
+    thread.join()
+
+
+def test_server_hangs_up_mid_reply(tmp_path):
+    path = str(tmp_path / 'inference.sock')
+    thread = serve_once(path, lambda conn: conn.sendall(struct.pack('>I', 100) + b'{"models"'))
+
+    with pytest.raises(InferenceServerUnavailable):
+        request({'op': 'models'}, socket_path=path, timeout=2)
+    thread.join()
+
+
+def test_unreadable_reply(tmp_path):
+    path = str(tmp_path / 'inference.sock')
+    thread = serve_once(path, lambda conn: conn.sendall(struct.pack('>I', 4) + b'\xff{]x'))
+
+    with pytest.raises(InferenceServerError):
+        request({'op': 'models'}, socket_path=path, timeout=2)
+    thread.join()
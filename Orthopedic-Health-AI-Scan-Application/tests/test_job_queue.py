@@ -0,0 +1,53 @@
+import time
+
+from app.utils import job_queue
+
+
+def make_stale(job_id):
+    job_queue._execute("UPDATE jobs SET updated_at = ? WHERE id = ?",
+                       (time.time() - job_queue.JOB_STALE_SECONDS - 1, job_id))
+
+
+def test_job_that_keeps_killing_its_worker_is_failed(storage):
+    job_id = job_queue.enqueue('analyze_study', {})
+
+    for attempt in range(1, job_queue.JOB_MAX_ATTEMPTS + 1):
+        assert job_queue.claim_next()['attempts'] == attempt
+        # The worker dies without finishing the job
+        make_stale(job_id)
+        requeued, failed = job_queue.requeue_stale()
+        assert (requeued, failed) == ((0, 1) if attempt == job_queue.JOB_MAX_ATTEMPTS else (1, 0))
+
+    assert job_queue.get_job(job_id)['status'] == 'failed'
+    assert job_queue.claim_next() is None
+
+
+def test_running_job_is_kept_fresh_by_heartbeat(storage, monkeypatch):
+    monkeypatch.setattr(job_queue, 'JOB_HEARTBEAT_INTERVAL', 0.01)
+    beats = []
+
+    def slow_handler(payload, progress):
+        # A long step without progress updates
+        time.sleep(0.1)
+        beats.append(job_queue.get_job(job_id)['updated_at'])
+        return {}
+
+    monkeypatch.setattr(job_queue, '_resolve', lambda handler_path: slow_handler)
+    job_id = job_queue.enqueue('analyze_study', {})
+    job = job_queue.claim_next()
+    make_stale(job_id)
+
+    job_queue.run_job(job)
+
+    assert beats[0] > time.time() - job_queue.JOB_STALE_SECONDS
+    assert job_queue.get_job(job_id)['status'] == 'done'
+
+
+def test_old_finished_jobs_are_pruned(storage):
+    done, queued = job_queue.enqueue('analyze_study', {}), job_queue.enqueue('analyze_study', {})
+    job_queue.complete(done, {})
+
+    assert job_queue.prune_finished(time.time() + 1) == 1
+
+    assert job_queue.get_job(done) is None
+    assert job_queue.get_job(queued)['status'] == 'queued'
@@ -0,0 +1,37 @@
+import multiprocessing
+
+from app.utils import metrics
+
+REQUESTS = metrics.Counter('test_requests_total', 'Requests', ['route'])
+LATENCY = metrics.Histogram('test_latency_seconds', 'Latency', buckets=(0.1, 1.0))
+
+
+def record_in_child(directory):
+    REQUESTS.inc(route='/a')
+    LATENCY.observe(0.5)
+    metrics.flush(directory)
+
+
+def test_render_sums_every_process(tmp_path):
+    directory = str(tmp_path)
+    process = multiprocessing.get_context('spawn').Process(target=record_in_child, args=(directory,))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+    REQUESTS.inc(2, route='/a')
+    LATENCY.observe(0.05)
+    text = metrics.render(directory)
+
+    assert 'test_requests_total{route="/a"} 3.0' in text
+    assert 'test_latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{le="1.0"} 2' in text
+    assert 'test_latency_seconds_count 2' in text
+
+
+def test_clear_shared(tmp_path):
+    REQUESTS.inc(route='/b')
+    metrics.flush(str(tmp_path))
+    metrics.clear_shared(str(tmp_path))
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,64 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from app.utils import report_export, storage_reaper
+from app.utils.pipeline import save_study
+from app.utils.report_export import create_export, export_status, render_study_report, run_coordinator
+from app.utils.study_store import get_study_store
+
+
+def save_scan(storage):
+    """Save a one-image study, with its files on disk. Returns the study ID."""
+    image = np.full((64, 64, 3), 128, np.uint8)
+    cv2.imwrite(os.path.join(storage['uploads'], 'scan.png'), image)
+    cv2.imwrite(os.path.join(storage['processed'], 'annotated_scan.png'), image)
+    result = {'original_path': 'uploads/scan.png', 'annotated_path': 'processed/annotated_scan.png',
+              'body_part': 'hand', 'label': 'fracture', 'confidence': 0.9}
+    return save_study(['uploads/scan.png'], [result], {'Patient_ID': 'P1', 'Name': 'Test'})
+
+
+def test_export_after_release(storage):
+    study_id = save_scan(storage)
+    get_study_store().delete(study_id)
+
+    filename, patient_id = render_study_report(study_id)
+
+    assert patient_id == 'P1'
+    with open(os.path.join(storage['reports'], filename), 'rb') as f:
+        # The 64 px scan, not just the header logo
+        assert b'/Width 64' in f.read()
+
+
+def test_reaper_keeps_files_of_indexed_studies(storage, monkeypatch):
+    monkeypatch.setattr(storage_reaper, 'ORPHAN_GRACE_SECONDS', 0)
+    study_id = save_scan(storage)
+    get_study_store().delete(study_id)
+    with open(os.path.join(storage['uploads'], 'stray.png'), 'wb') as f:
+        f.write(b'x')
+
+    storage_reaper.reap(now=time.time() + 1)
+
+    assert sorted(os.listdir(storage['uploads'])) == ['scan.png']
+    assert os.listdir(storage['processed']) == ['annotated_scan.png']
+
+
+def test_coordinator_runs_queued_exports_on_one_pool(storage, monkeypatch):
+    pools = []
+
+    def thread_pool(workers, mp_context=None):
+        # Threads see the temporary storage patched into this process
+        pools.append(ThreadPoolExecutor(workers))
+        return pools[-1]
+
+    monkeypatch.setattr(report_export, 'ProcessPoolExecutor', thread_pool)
+    study_id = save_scan(storage)
+    export_ids = [create_export([(study_id, None)]) for _ in range(3)]
+
+    run_coordinator(workers=2)
+
+    assert len(pools) == 1
+    assert [export_status(export_id)['status'] for export_id in export_ids] == ['done'] * 3
@@ -0,0 +1,28 @@
+import threading
+
+from app.app import app
+from app.utils import report_store
+
+FILENAME = 'report_0123456789abcdef0123456789abcdef.pdf'
+
+
+def test_download_waits_for_a_report_another_process_is_writing(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_store, 'REPORTS_FOLDER', str(tmp_path))
+    monkeypatch.setattr(report_store, 'REPORTS_PERSIST', True)
+    assert report_store.get(FILENAME) is None
+
+    # Another process's write-behind lands while the request waits
+    writer = threading.Timer(0.2, report_store._write, (FILENAME, b'%PDF-1.4 other worker'))
+    writer.start()
+    response = app.test_client().get(f'/download_report/{FILENAME}')
+    writer.join()
+
+    assert response.status_code == 200
+    assert response.data == b'%PDF-1.4 other worker'
+
+
+def test_missing_report_is_not_found_after_the_wait(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_store, 'REPORTS_FOLDER', str(tmp_path))
+    monkeypatch.setattr(report_store, 'REPORT_PERSIST_WAIT', 0.1)
+
+    assert report_store.get('report_missing.pdf', wait=True) is None
@@ -0,0 +1,84 @@
+import os
+import time
+
+from app.utils import job_queue, storage_reaper, study_index, study_store
+
+
+def write_file(folder, name, age=3600):
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(b'x')
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def test_orphans_are_deleted(storage):
+    write_file(storage['uploads'], 'stray.png')
+
+    stats = storage_reaper.reap()
+
+    assert os.listdir(storage['uploads']) == []
+    assert stats['files_deleted'] == {'uploads': 1}
+
+
+def test_process_local_store_keeps_study_files(storage, monkeypatch):
+    # In its own process the reaper sees an empty memory store: nothing may look orphaned
+    monkeypatch.setattr(study_store, '_store', study_store.MemoryStudyStore())
+    write_file(storage['uploads'], 'scan.png')
+    write_file(storage['reports'], 'report.pdf', age=storage_reaper.REPORT_RETENTION_SECONDS + 60)
+
+    storage_reaper.reap()
+
+    assert os.listdir(storage['uploads']) == ['scan.png']
+    assert os.listdir(storage['reports']) == []
+
+
+def test_reaper_does_not_start_with_process_local_store(storage, monkeypatch):
+    monkeypatch.setattr(study_store, '_store', study_store.MemoryStudyStore())
+
+    assert storage_reaper.start_reaper() is None
+
+
+def save_indexed_study(storage, name, size=1):
+    """Save a study with one upload of `size` bytes, indexed like an analyzed one."""
+    with open(os.path.join(storage['uploads'], f'{name}.png'), 'wb') as f:
+        f.write(b'x' * size)
+    result = {'original_path': f'uploads/{name}.png', 'annotated_path': f'uploads/{name}.png',
+              'body_part': 'hand', 'label': 'fracture', 'confidence': 0.9}
+    study_id = study_store.get_study_store().create({'uploaded_files': [result]})
+    study_index.record(study_id, 'P1', [result])
+    return study_id
+
+
+def test_expired_indexed_study_files_are_deleted(storage, monkeypatch):
+    monkeypatch.setattr(storage_reaper, 'ORPHAN_GRACE_SECONDS', 0)
+    save_indexed_study(storage, 'scan')
+
+    # The session's study has expired, the indexed one keeps its files for exports
+    storage_reaper.reap(now=time.time() + storage_reaper.STUDY_RETENTION_SECONDS + 60)
+    assert os.listdir(storage['uploads']) == ['scan.png']
+
+    stats = storage_reaper.reap(now=time.time() + storage_reaper.INDEXED_STUDY_RETENTION_SECONDS + 60)
+
+    assert os.listdir(storage['uploads']) == []
+    assert stats['indexed_studies_expired'] == 1
+    detections, _ = study_index.query()
+    assert len(detections) == 1
+
+
+def test_quota_releases_only_studies_whose_files_are_freed(storage, monkeypatch):
+    monkeypatch.setattr(storage_reaper, 'STORAGE_QUOTA_BYTES', dict(storage_reaper.STORAGE_QUOTA_BYTES, uploads=200))
+    queued = save_indexed_study(storage, 'queued', size=100)
+    old = save_indexed_study(storage, 'old', size=100)
+    save_indexed_study(storage, 'new', size=100)
+    job_queue.enqueue('analyze_study', {'paths': ['uploads/queued.png']})
+
+    stats = storage_reaper.reap()
+
+    # The oldest study's file is still queued for analysis, so the next one goes
+    assert sorted(os.listdir(storage['uploads'])) == ['new.png', 'queued.png']
+    assert stats['studies_released_for_quota'] == 1
+    assert stats['bytes_reclaimed'] == {'uploads': 100}
+    store = study_store.get_study_store()
+    assert store.get(queued) is not None and store.get(old) is None
+    assert study_index.study(old) is None
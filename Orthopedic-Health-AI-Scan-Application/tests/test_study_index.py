@@ -0,0 +1,69 @@
+import time
+
+from app.app import app
+from app.utils import study_index
+
+
+def index_detections(confidences):
+    results = [{'original_path': f'uploads/scan{i}.png', 'annotated_path': f'processed/scan{i}.png',
+                'body_part': 'knee', 'label': 'fracture', 'confidence': confidence}
+               for i, confidence in enumerate(confidences)]
+    study_index.record('study', 'P1', results)
+
+
+def test_unparsable_confidence_is_rejected(storage):
+    client = app.test_client()
+    for query in ('min_confidence=high', 'max_confidence=0.x', 'limit=ten'):
+        response = client.get(f'/api/detections?{query}')
+        assert response.status_code == 400, query
+
+
+def test_confidence_filter_pages_through_the_index(storage):
+    index_detections([0.2, 0.9, 0.4, 0.95, 0.8, 0.3])
+    client = app.test_client()
+
+    seen, cursor = [], ''
+    while True:
+        page = client.get(f'/api/detections?min_confidence=0.5&limit=2&cursor={cursor}').get_json()
+        seen += [detection['confidence'] for detection in page['detections']]
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    assert seen == [0.8, 0.95, 0.9]
+
+    assert query_plan("confidence >= 0.5 AND (created_at, id) < (1, 1)") == \
+        'SEARCH detections USING INDEX idx_detections_created_confidence (created_at<?)'
+
+
+def query_plan(where):
+    conn = study_index._connect()
+    try:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN SELECT * FROM detections WHERE {where} "
+                            "ORDER BY created_at DESC, id DESC").fetchall()
+    finally:
+        conn.close()
+    return ' '.join(row['detail'] for row in plan)
+
+
+def test_every_filter_is_served_in_keyset_order(storage):
+    index_detections([0.9])
+    # A single index search each, with no sort (TEMP B-TREE) for the ORDER BY
+    for where, index in (("patient_id = 'P1'", 'idx_detections_patient'),
+                         ("body_part = 'knee'", 'idx_detections_body_part'),
+                         ("body_part = 'knee' AND label = 'fracture'", 'idx_detections_body_part_label'),
+                         ("label = 'fracture'", 'idx_detections_label'),
+                         ("created_at >= 1", 'idx_detections_created_confidence')):
+        assert query_plan(where).startswith(f'SEARCH detections USING INDEX {index} ('), where
+        assert 'TEMP B-TREE' not in query_plan(where), where
+
+
+def test_prune_drops_kept_results_but_not_detections(storage):
+    index_detections([0.9])
+    assert study_index.study('study') is not None
+
+    assert study_index.prune(older_than=time.time() + 1) == ['study']
+
+    assert study_index.study('study') is None
+    assert list(study_index.iter_studies()) == []
+    detections, _ = study_index.query()
+    assert [(d['confidence'], d['original_path']) for d in detections] == [(0.9, None)]
@@ -0,0 +1,73 @@
+import io
+import os
+
+import cv2
+import numpy as np
+
+from app.utils import pipeline, upload_stream
+from app.utils.upload_stream import iter_multipart, analyze_stream
+
+BOUNDARY = 'scanboundary'
+
+
+def multipart(*files, truncate=0):
+    body = b''
+    for filename, data in files:
+        body += (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="images"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + b'\r\n'
+    body += f'--{BOUNDARY}--\r\n'.encode()
+    return io.BytesIO(body[:len(body) - truncate])
+
+
+def png(value):
+    return cv2.imencode('.png', np.full((32, 32, 3), value, np.uint8))[1].tobytes()
+
+
+def fake_analysis(monkeypatch):
+    """Analyze every decoded image as a finding, recording the pixels each was decoded to."""
+    seen = []
+
+    def analyze_batch(items, models, hint):
+        seen.extend(int(item['image'][0, 0, 0]) for item in items)
+        return [{'path': item['path'], 'body_part': 'knee'} for item in items]
+
+    monkeypatch.setattr(upload_stream, 'analyze_batch', analyze_batch)
+    return seen
+
+
+def test_images_are_analyzed_from_their_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, 'UPLOAD_FOLDER', str(tmp_path))
+    seen = fake_analysis(monkeypatch)
+
+    parts = iter_multipart(multipart(('a.png', png(10)), ('b.png', png(20))), BOUNDARY, chunk_size=64)
+    records = list(analyze_stream(parts, {}, lambda filename: True))
+
+    assert [(record['index'], record['status']) for record in records] == [(0, 'ok'), (1, 'ok')]
+    assert seen == [10, 20]
+    assert all(set(record) == {'index', 'filename', 'path', 'status', 'uploaded_file'} for record in records)
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_truncated_body_keeps_only_complete_images(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, 'UPLOAD_FOLDER', str(tmp_path))
+    seen = fake_analysis(monkeypatch)
+    second = png(20)
+    body = multipart(('a.png', png(10)), ('b.png', second), truncate=len(second) // 2 + len(BOUNDARY) + 8)
+
+    records = list(analyze_stream(iter_multipart(body, BOUNDARY, chunk_size=64), {}, lambda filename: True))
+
+    assert [record['status'] for record in records] == ['ok', 'error']
+    assert seen == [10]
+    # The cut-off image is not kept
+    assert os.listdir(tmp_path) == [os.path.basename(records[0]['path'])]
+
+
+def test_undecodable_upload_is_not_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, 'UPLOAD_FOLDER', str(tmp_path))
+
+    parts = iter_multipart(multipart(('broken.png', b'not an image')), BOUNDARY, chunk_size=8)
+    records = list(analyze_stream(parts, {}, lambda filename: True))
+
+    assert [record['status'] for record in records] == ['error']
+    assert 'abs_path' not in records[0]
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,41 @@
+import numpy as np
+
+from app.utils import body_part_router, result_cache, yolo_utils
+
+
+def detector_confidences(monkeypatch, confidences):
+    """Replace the detectors with ones finding a single box of a fixed confidence per body part."""
+    calls = []
+
+    def run_detector(body_part, model, imgs, spacings):
+        calls.append(body_part)
+        return [[{'label': 'fracture', 'confidence': confidences[body_part], 'box': (1, 1, 8, 8),
+                  'size_mm': 1.0}] for _ in imgs]
+
+    monkeypatch.setattr(yolo_utils, '_run_detector', run_detector)
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE_ENABLED', False)
+    monkeypatch.setattr(body_part_router, 'learn', lambda *args: None)
+    return calls
+
+
+def test_weak_routed_finding_falls_back_to_the_other_models(monkeypatch):
+    calls = detector_confidences(monkeypatch, {'knee': 0.3, 'hand': 0.8})
+    monkeypatch.setattr(body_part_router, 'route', lambda embedding, models, hint: (['knee'], False))
+    img = np.zeros((16, 16, 3), np.uint8)
+
+    body_part, _, _, confidence, _ = yolo_utils.detect_body_parts([img], {'knee': None, 'hand': None})[0]
+
+    # 0.3 passes the detection threshold but not ROUTER_ACCEPT_CONFIDENCE
+    assert calls == ['knee', 'hand']
+    assert (body_part, confidence) == ('hand', 0.8)
+
+
+def test_confident_routed_finding_skips_the_other_models(monkeypatch):
+    calls = detector_confidences(monkeypatch, {'knee': 0.9, 'hand': 0.95})
+    monkeypatch.setattr(body_part_router, 'route', lambda embedding, models, hint: (['knee'], False))
+    img = np.zeros((16, 16, 3), np.uint8)
+
+    body_part, _, _, _, _ = yolo_utils.detect_body_parts([img], {'knee': None, 'hand': None})[0]
+
+    assert calls == ['knee']
+    assert body_part == 'knee'